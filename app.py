@@ -1,12 +1,30 @@
-from flask import Flask
+import os
+import sys
+from flask import Flask, request
+
+# load ghhops-server-py source from this repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ghhops-server-py"))
 import ghhops_server as hs
+from ghhops_server.decimate import decimate_mesh
 
 import rhino3dm
-from utils import get_mesh_by_grey_map
+from image_store import ImageStore
+from utils import get_mesh_by_grey_map, DEFAULT_IMAGE, DEFAULT_TILE_SIZE
 
 # register hops app as middleware
 app = Flask(__name__)
 hops = hs.Hops(app)
+image_store = ImageStore()
+
+
+# upload an image once and reference it by the returned hash afterwards
+@app.route("/images", methods=["POST"])
+def upload_image():
+    try:
+        return image_store.put_bytes(request.get_data())
+    except ValueError as ex:
+        return str(ex), 400
+
 
 @hops.component(
     "/greymesh",
@@ -16,14 +34,35 @@ hops = hs.Hops(app)
     inputs=[
         hs.HopsNumber("height", "H", "Height factor", default=0.2),
         hs.HopsInteger("step", "S", "Pixel step", default=5),
+        hs.HopsInteger("tile", "T", "Tile size in grid cells, 0 disables tiling"),
+        hs.HopsBoolean("split", "Sp", "Output one mesh per tile instead of a merged mesh"),
+        hs.HopsString("image", "I", "Image path under the images root, base64 encoded image bytes, or hash of an uploaded image"),
+        hs.HopsString("smooth", "Sm", "Height pre-filter: none, gaussian or bilateral"),
+        hs.HopsInteger("radius", "R", "Pre-filter radius in grid cells"),
+        hs.HopsBoolean("normals", "N", "Write vertex normals computed from the height field"),
+        hs.HopsInteger("faces", "F", "Face budget, meshes are decimated down to it (0 keeps full resolution)"),
     ],
     outputs=[
-        hs.HopsMesh("M", "M", "Mesh generated based on grey map"),
+        hs.HopsMesh("M", "M", "Mesh generated based on grey map", hs.HopsParamAccess.TREE),
+        hs.HopsString("hash", "#", "Image hash, pass it back as image to skip re-uploading"),
+        hs.HopsInteger("faces in", "Fi", "Triangle count before decimation"),
+        hs.HopsInteger("faces out", "Fo", "Triangle count of the output meshes"),
+        hs.HopsNumber("error", "E", "Largest quadric error accepted by decimation, 0 when no face was removed"),
     ],
 )
-def generate_mesh_by_grep_map(height_factor, step):
-    mesh = get_mesh_by_grey_map(height_factor, step)
-    return mesh
+def generate_mesh_by_grep_map(height_factor, step, tile_size=DEFAULT_TILE_SIZE, split=False, image=DEFAULT_IMAGE,
+                              smooth="none", radius=2, normals=True, max_faces=0):
+    digest, path = image_store.resolve(image)
+    mesh = get_mesh_by_grey_map(height_factor, step, tile_size, split, path,
+                                smooth=smooth, radius=radius, normals=normals)
+    tree = mesh if split else {"{0}": [mesh]}
+    # 预算在各分块之间平均分配，为 0 时不简化，只统计面数
+    budget = max(max_faces // len(tree), 1) if max_faces > 0 else 0
+    decimated = {key: [decimate_mesh(m, budget) for m in meshes] for key, meshes in tree.items()}
+    tree = {key: [m for m, _ in results] for key, results in decimated.items()}
+    reports = [report for results in decimated.values() for _, report in results]
+    return (tree, digest, sum(report.faces_in for report in reports),
+            sum(report.faces_out for report in reports), max(report.error for report in reports))
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
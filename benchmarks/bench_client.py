@@ -0,0 +1,87 @@
+"""
+参数扫描吞吐测试：每次求解新建连接、手写 json 的脚本写法与 HopsClient（长连接池 + 并发提交）对比
+服务端为子进程中的内置 http 服务器，同时统计客户端每次求解的 CPU 时间
+用法: python benchmarks/bench_client.py [求解次数]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ghhops-server-py')
+sys.path.insert(0, ROOT)
+from ghhops_server import wire  # noqa: E402
+from ghhops_server.client import HopsClient  # noqa: E402
+
+PORT = 5099
+URL = f"http://localhost:{PORT}"
+
+
+def serve():
+    import ghhops_server as hs
+
+    hops = hs.Hops()
+
+    @hops.component(
+        "/sweep",
+        inputs=[hs.HopsNumber("A", "A", "a"), hs.HopsInteger("N", "N", "n")],
+        outputs=[hs.HopsNumber("R", "R", "r")],
+    )
+    def sweep(a, n):
+        return a * n
+
+    hops.start(port=PORT)
+
+
+def naive_solve(a, n):
+    # 扫描脚本原来的写法：每次求解一个新连接，手写 values/InnerTree
+    payload = {"pointer": "/sweep", "values": [
+        {"ParamName": "A", "InnerTree": {"0": [{"type": "System.Double", "data": json.dumps(a)}]}},
+        {"ParamName": "N", "InnerTree": {"0": [{"type": "System.Int32", "data": json.dumps(n)}]}},
+    ]}
+    request = urllib.request.Request(URL + "/solve", json.dumps(payload).encode(), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        result = json.loads(response.read())
+    return json.loads(result["values"][0]["InnerTree"]["0"][0]["data"])
+
+
+def measure(name, run, count):
+    cpu = time.process_time()
+    start = time.perf_counter()
+    results = run()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    assert results[-1] == (count - 1) * 0.5 * 3
+    print(f"{name:<28} {count / elapsed:>8.0f}/s {cpu / count * 1e6:>9.0f}us")
+
+
+def main(count=2000):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'], stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(URL + "/sweep").read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        sweep = [(i * 0.5, 3) for i in range(count)]
+        print(f"{'':<28} {'solves':>10} {'client cpu':>11}")
+        measure("new connection + json", lambda: [naive_solve(a, n) for a, n in sweep], count)
+        for connections in (1, 4):
+            for media_type in (wire.JSON, wire.FRAME):
+                with HopsClient(URL, connections=connections, media_type=media_type) as client:
+                    component = client.component("/sweep")
+                    name = f"HopsClient x{connections} {media_type.split('/')[1]}"
+                    measure(name, lambda: list(component.map(sweep)), count)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--serve']:
+        serve()
+    else:
+        main(*[int(arg) for arg in sys.argv[1:2]])
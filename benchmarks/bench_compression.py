@@ -0,0 +1,91 @@
+"""
+响应压缩测试：典型 Hops 响应（灰度图网格、L-System）在不同编码和压缩级别下的体积与 CPU 耗时
+用法: python benchmarks/bench_compression.py [带宽 Mbit/s]
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'ghhops-server-py'))
+sys.path.insert(0, os.path.join(ROOT, 'ghhops-server-py', 'L_system'))
+sys.path.insert(0, ROOT)
+from ghhops_server import compression  # noqa: E402
+
+
+def load_app(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def solve(app, pointer, **inputs):
+    values = [
+        {"ParamName": name, "InnerTree": {"0": [{"type": kind, "data": json.dumps(value)}]}}
+        for name, (kind, value) in inputs.items()
+    ]
+    response = app.test_client().post('/solve', data=json.dumps({"pointer": pointer, "values": values}))
+    assert response.status_code == 200, response.data[:200]
+    return response.get_data(as_text=True)
+
+
+def payloads():
+    # 灰度图默认路径相对于仓库根目录
+    os.chdir(ROOT)
+    greymesh = load_app('greymesh_app', os.path.join(ROOT, 'app.py'))
+    lsystem = load_app('lsystem_app', os.path.join(ROOT, 'ghhops-server-py', 'L_system', 'app.py'))
+    for step in (10, 4):
+        yield f"greymesh step {step}", solve(
+            greymesh, "greymesh",
+            height=("System.Double", 0.2), step=("System.Int32", step), tile=("System.Int32", 0),
+            split=("System.Boolean", False), image=("System.String", "imgs/img1.png"),
+            smooth=("System.String", "none"), radius=("System.Int32", 2), normals=("System.Boolean", True),
+            faces=("System.Int32", 0),
+        )
+    for iterations in (3, 4):
+        yield f"lsystem N={iterations}", solve(
+            lsystem, "lsystem",
+            N=("System.Int32", iterations), A=("System.Double", 25.0), S=("System.Double", 1.0),
+            R=("System.Double", 0.1), Sd=("System.Int32", 6), F=("System.Int32", 0),
+            X=("System.String", "F"), Rl=("System.String", "F -> FF+[+F-F-F]-[-F+F+F]"),
+            Se=("System.Int32", 0),
+        )
+
+
+def settings():
+    for encoding in compression.available_encodings():
+        default, low, high = compression._LEVELS[encoding]
+        for level in sorted({low, default, high}):
+            yield encoding, level
+
+
+def measure(body, encoding, level, repeat=3):
+    best, size = None, 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in compression.compress(compression.iter_text(body), encoding, level))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size, best
+
+
+def main(bandwidth=100):
+    # 传输耗时 = 压缩耗时 + 体积 / 带宽
+    byte_rate = bandwidth * 1e6 / 8
+    print(f"transfer at {bandwidth} Mbit/s, encodings: {', '.join(compression.available_encodings())}")
+    for name, body in payloads():
+        raw = len(body.encode('utf_8'))
+        print(f"\n{name}: {raw / 1e6:.2f} MB, sent as is in {raw / byte_rate * 1000:.0f} ms")
+        print(f"{'encoding':>10} {'level':>5} {'MB':>8} {'ratio':>6} {'cpu ms':>8} {'MB/s':>7} {'total ms':>9}")
+        for encoding, level in settings():
+            size, elapsed = measure(body, encoding, level)
+            total = elapsed + size / byte_rate
+            print(f"{encoding:>10} {level:>5} {size / 1e6:>8.2f} {raw / size:>6.1f} "
+                  f"{elapsed * 1000:>8.1f} {raw / 1e6 / elapsed:>7.0f} {total * 1000:>9.0f}")
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
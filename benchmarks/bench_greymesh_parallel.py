@@ -0,0 +1,57 @@
+"""
+灰度图网格多进程构建的扩展性测试
+子进程只计算顶点、面与法向量数组，主进程拼接行带并构建 rhino3dm 网格，后者是串行部分，决定了加速比的上限
+默认测试 1 到 CPU 核数个进程，也可以用逗号分隔指定进程数
+用法: python benchmarks/bench_greymesh_parallel.py [边长像素] [步长] [滤波方式] [进程数,...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'ghhops-server-py')]
+import rhino3dm  # noqa: E402
+import utils  # noqa: E402
+
+
+def main(size=4096, step=4, smooth='bilateral', counts=None):
+    rng = np.random.default_rng(0)
+    heightmap = rng.integers(0, 256, size=(size, size), dtype=np.uint8)
+    path = os.path.join(tempfile.mkdtemp(), 'heightmap.npy')
+    np.save(path, heightmap)
+    stages = dict(smooth=smooth, radius=3, normals=True)
+
+    utils.PARALLEL_MIN_VERTICES = 0
+    cpu_count = os.cpu_count() or 1
+    if counts is None:
+        counts = sorted({1, cpu_count} | {2 ** i for i in range(1, 6) if 2 ** i < cpu_count})
+    image = utils.open_heightmap(path)
+    rows, cols = utils.grid_shape(image, step)
+    # 串行部分：主进程拼接行带并写入 rhino3dm 网格
+    bands = [utils.grid_window_buffers(image, 1.0, step, row0, row1, 0, cols - 1, **stages)
+             for row0, row1 in utils.iter_bands(rows, 4)]
+    start = time.perf_counter()
+    utils.add_buffers_to_mesh(rhino3dm.Mesh(), *utils.stitch_bands(bands, cols))
+    assemble = time.perf_counter() - start
+
+    print(f"heightmap {size}x{size}, step {step}, {smooth} filter, {rows * cols} vertices, {cpu_count} cores")
+    print(f"serial mesh assembly {assemble:.3f}s")
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8}")
+    baseline = None
+    for workers in counts:
+        if workers > 1:
+            utils.get_mesh_by_grey_map(1.0, step * 4, 0, path=path, workers=workers, **stages)  # 预热进程池
+        start = time.perf_counter()
+        utils.get_mesh_by_grey_map(1.0, step, 0, path=path, workers=workers, **stages)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>10.3f} {baseline / elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    names = ('size', 'step', 'smooth', 'counts')
+    parsers = (int, int, str, lambda arg: [int(count) for count in arg.split(',')])
+    main(**{name: parse(arg) for name, parse, arg in zip(names, parsers, sys.argv[1:])})
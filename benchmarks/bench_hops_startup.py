@@ -0,0 +1,80 @@
+"""
+Hops 服务冷启动耗时测试：导入、注册大量组件、首次元数据请求与首次求解
+用法: python benchmarks/bench_hops_startup.py [组件数]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+HOPS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ghhops-server-py')
+
+COMPONENT = '''
+@hops.component(
+    "/comp{index}",
+    name="Comp{index}",
+    description="benchmark component {index}",
+    icon="icon.png",
+    inputs=[hs.HopsNumber("A", "A", "a"), hs.HopsNumber("B", "B", "b", default={index})],
+    outputs=[hs.HopsNumber("R", "R", "r")],
+)
+def comp{index}(a, b={index}):
+    return a + b
+'''
+
+# 在独立进程中运行，保证每次都是冷启动
+RUNNER = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {hops_path!r})
+from flask import Flask
+import ghhops_server as hs
+imported = time.perf_counter()
+app = Flask(__name__)
+hops = hs.Hops(app)
+import components
+registered = time.perf_counter()
+client = app.test_client()
+client.get("/")
+metadata = time.perf_counter()
+body = {{"pointer": "comp0", "values": [
+    {{"ParamName": name, "InnerTree": {{"0": [{{"type": "System.Double", "data": "1.0"}}]}}}}
+    for name in ("A", "B")
+]}}
+client.post("/solve", data=json.dumps(body))
+solved = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "register": registered - imported,
+    "first GET /": metadata - registered,
+    "first solve": solved - metadata,
+    "total": solved - start,
+}}))
+'''
+
+
+def main(count=300, repeat=5):
+    workdir = tempfile.mkdtemp()
+    with open(os.path.join(workdir, 'icon.png'), 'wb') as icon:
+        icon.write(os.urandom(4096))
+    with open(os.path.join(workdir, 'components.py'), 'w') as module:
+        module.write('import __main__\nhs = __main__.hs\nhops = __main__.hops\n')
+        module.write(''.join(COMPONENT.format(index=i) for i in range(count)))
+    with open(os.path.join(workdir, 'runner.py'), 'w') as runner:
+        runner.write(textwrap.dedent(RUNNER.format(hops_path=HOPS_PATH)))
+
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, 'runner.py'], cwd=workdir, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    print(f"{count} components, best of {repeat} cold starts")
+    for stage in runs[0]:
+        print(f"{stage:>12} {min(run[stage] for run in runs) * 1000:>9.1f} ms")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
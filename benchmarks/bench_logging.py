@@ -0,0 +1,54 @@
+"""
+日志开销测试：旧写法（f-string 拼接整个响应）与延迟格式化 + 截断的对比，分别测试 debug 关闭和开启
+用法: python benchmarks/bench_logging.py [每组调用次数]
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ghhops-server-py'))
+from ghhops_server import logger  # noqa: E402
+from ghhops_server.logger import hlogger, truncated  # noqa: E402
+
+
+def make_results(size):
+    # 与求解响应相同结构的 json 字符串
+    count = size // 45
+    items = [{"type": "System.Double", "data": json.dumps(i * 0.5)} for i in range(count)]
+    return json.dumps({"values": [{"ParamName": "R", "InnerTree": {"0": items}}]})
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def main(calls=200):
+    devnull = open(os.devnull, 'w')
+    # 旧配置：同步写出的 handler
+    old_logger = logging.getLogger('HopsOld')
+    old_logger.addHandler(logging.StreamHandler(devnull))
+    old_logger.propagate = False
+    logger.configure_logging(stream=devnull)
+    hlogger.propagate = False
+    res = True
+
+    print(f"{'payload':>9} {'debug':>6} {'f-string':>11} {'lazy':>11}")
+    for size in (100_000, 1_000_000, 10_000_000):
+        results = make_results(size)
+        for level in (logging.INFO, logging.DEBUG):
+            old_logger.setLevel(level)
+            hlogger.setLevel(level)
+            old = per_call(lambda: old_logger.debug(f"{res} : {results}"), calls)
+            new = per_call(lambda: hlogger.debug("%s : %s", res, truncated(results)), calls)
+            logger.flush_logs()
+            debug = 'on' if level == logging.DEBUG else 'off'
+            print(f"{len(results) / 1e6:>7.2f}MB {debug:>6} {old * 1e6:>9.1f}us {new * 1e6:>9.1f}us")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
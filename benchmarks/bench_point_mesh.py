@@ -0,0 +1,37 @@
+"""
+点集三角化耗时测试：cKDTree 合并重合点与 2.5D Delaunay（含 alpha 过滤）
+用法: python benchmarks/bench_point_mesh.py [最大点数]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ghhops-server-py', 'L_system'))
+from meshing import dedupe_points, delaunay_mesh  # noqa: E402
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main(max_count=1_000_000):
+    rng = np.random.default_rng(0)
+    print(f"{'points':>9} {'dedupe s':>9} {'delaunay s':>11} {'alpha s':>8} {'faces':>9}")
+    count = 10_000
+    while count <= max_count:
+        points = rng.random((count, 3))
+        # 约 10% 的点与已有点重合，模拟海龟回到分叉点
+        points = np.concatenate([points, points[: count // 10]])
+        dedupe, _ = timed(dedupe_points, points)
+        delaunay, (_, faces) = timed(delaunay_mesh, points)
+        alpha, _ = timed(delaunay_mesh, points, alpha=2.0 / np.sqrt(count))
+        print(f"{count:>9} {dedupe:>9.2f} {delaunay:>11.2f} {alpha:>8.2f} {len(faces):>9}")
+        count *= 10
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,77 @@
+"""
+多进程共享解码灰度图的测试：每个进程各自解码（默认方式）与共享内存存储对比，统计读取耗时与所有进程的 Pss 内存合计
+只适用于直接读取 png 等图片文件的场景，.npy 图片本身就以内存映射方式共享页缓存
+用法: python benchmarks/bench_shared_store.py [边长像素] [进程数]
+"""
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'ghhops-server-py')]
+import utils  # noqa: E402
+import ghhops_server.sharedmem  # noqa: E402,F401  utils 在启用共享内存时才导入，提前导入以免计入读取耗时
+
+
+def pss_bytes(pid):
+    # 进程按映射进程数分摊后的内存（Linux），共享内存页由所有映射它的进程平分
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def worker(path, shared, queue, done):
+    start = time.perf_counter()
+    if shared:
+        image = utils.open_heightmap(path)
+    else:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    seconds = time.perf_counter() - start
+    int(image.sum())  # 读取每个像素
+    queue.put(seconds)
+    done.wait()
+
+
+def run(path, processes, shared):
+    """逐个启动进程（第一个进程负责解码并发布），全部读取完后统计各进程 Pss 之和"""
+    context = get_context('fork')
+    queue = context.Queue()
+    done = context.Event()
+    workers, seconds = [], []
+    for _ in range(processes):
+        process = context.Process(target=worker, args=(path, shared, queue, done))
+        process.start()
+        seconds.append(queue.get())
+        workers.append(process)
+    pss = sum(pss_bytes(process.pid) for process in workers)
+    done.set()
+    for process in workers:
+        process.join()
+    return seconds, pss
+
+
+def main(size=8192, processes=4):
+    utils.SHARED_MAX_BYTES = 512 << 20  # 共享内存默认不启用
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, size=(size, size), dtype=np.uint8), (31, 31), 0)
+    path = os.path.join(tempfile.mkdtemp(), 'heightmap.png')
+    cv2.imwrite(path, image)
+    print(f"{size}x{size} 灰度图 {image.nbytes / 2 ** 20:.0f} MB, {processes} 个进程")
+    print(f"{'方式':>8} {'首个进程':>10} {'其余进程':>10} {'Pss 合计':>10}")
+    for shared in (False, True):
+        seconds, pss = run(path, processes, shared)
+        mode = '共享内存' if shared else '各自解码'
+        rest = sum(seconds[1:]) / max(len(seconds) - 1, 1)
+        print(f"{mode:>8} {seconds[0] * 1e3:>8.1f}ms {rest * 1e3:>8.1f}ms {pss / 2 ** 20:>8.1f}MB")
+    utils.shared_store().clear()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
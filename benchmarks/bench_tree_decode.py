@@ -0,0 +1,56 @@
+"""
+TREE 输入解码耗时测试：逐项 json.loads 与整分支批量解析对比
+用法: python benchmarks/bench_tree_decode.py [每个分支的项数]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ghhops-server-py'))
+import ghhops_server as hs  # noqa: E402
+
+
+def make_input(count, branch_size):
+    tree = {}
+    for start in range(0, count, branch_size):
+        path = "{0;%d}" % (start // branch_size)
+        tree[path] = [
+            {"type": "System.Double", "data": json.dumps(i * 0.5)}
+            for i in range(start, min(start + branch_size, count))
+        ]
+    return {"ParamName": "N", "InnerTree": tree}
+
+
+def per_item(param, input_data):
+    # 原来的逐项解码
+    return {
+        path: [param._coerce_value(item["type"], item["data"]) for item in items]
+        for path, items in input_data["InnerTree"].items()
+    }
+
+
+def best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(branch_size=1000):
+    param = hs.HopsNumber("N", "N", "numbers", hs.HopsParamAccess.TREE)
+    print(f"System.Double items, {branch_size} per branch")
+    print(f"{'items':>9} {'per item':>10} {'bulk':>10} {'speedup':>8}")
+    for count in (10_000, 100_000, 1_000_000):
+        input_data = make_input(count, branch_size)
+        old, expected = best_of(lambda: per_item(param, input_data))
+        new, result = best_of(lambda: param.from_input(input_data))
+        assert result == expected
+        print(f"{count:>9} {old * 1000:>8.1f}ms {new * 1000:>8.1f}ms {old / new:>8.1f}")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,64 @@
+"""
+求解结果编码与输入解码耗时测试：Grasshopper 的 json（每个值再编码一次 json）与二进制帧 / msgpack 对比
+用法: python benchmarks/bench_wire_formats.py [点数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ghhops-server-py'))
+import rhino3dm  # noqa: E402
+import ghhops_server as hs  # noqa: E402
+from ghhops_server import params, wire  # noqa: E402
+
+LIST = hs.HopsParamAccess.LIST
+
+
+def best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def make_mesh(size):
+    mesh = rhino3dm.Mesh()
+    for row in range(size):
+        for col in range(size):
+            mesh.Vertices.Add(col, row, (row * col) % 7)
+    for row in range(size - 1):
+        for col in range(size - 1):
+            a = row * size + col
+            mesh.Faces.AddFace(a, a + 1, a + size + 1, a + size)
+    return mesh
+
+
+def main(count=100_000):
+    hops = hs.Hops()
+    params._ensure_init()
+    comp_args = dict(
+        inputs=[hs.HopsNumber("N", "N", "numbers", LIST), hs.HopsPoint("P", "P", "points", LIST), hs.HopsMesh("M", "M", "mesh")],
+        outputs=[hs.HopsNumber("N", "N", "numbers", LIST), hs.HopsPoint("P", "P", "points", LIST), hs.HopsMesh("M", "M", "mesh")],
+    )
+    hops.component("/echo", **comp_args)(lambda numbers, points, mesh: (numbers, points, mesh))
+    comp = hops._components["/echo"]
+    numbers = [i * 0.5 for i in range(count)]
+    points = [rhino3dm.Point3d(i, i * 0.5, 1.0) for i in range(count)]
+    returns = (numbers, points, make_mesh(100))
+
+    formats = [wire.JSON] + wire.available_formats()
+    print(f"{count} 个数值 + {count} 个点 + 100x100 网格")
+    print(f"{'格式':>26} {'大小':>9} {'编码':>9} {'解码':>9}")
+    for media_type in formats:
+        encode, (_, body) = best_of(lambda: hops._prepare_outputs(comp, returns, media_type))
+        # 输出与输入结构相同，直接作为请求解码
+        decode, (res, inputs) = best_of(lambda: hops._prepare_inputs(comp, body, media_type))
+        assert res and len(inputs[1]) == count
+        print(f"{media_type:>26} {len(body) / 2 ** 20:>7.1f}MB {encode * 1e3:>7.1f}ms {decode * 1e3:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
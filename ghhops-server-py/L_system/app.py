@@ -6,35 +6,58 @@ from flask import Flask
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import ghhops_server as hs
 
+import numpy as np
 import rhino3dm
+from ghhops_server.decimate import decimate_mesh
 from l_system import *
+from grammar import cancel_scope
+from meshing import dedupe_graph, delaunay_mesh, DEFAULT_TOLERANCE
 
 
 # register hops app as middleware
 app = Flask(__name__)
 hops: hs.HopsFlask = hs.Hops(app)
 
+
+def graph_outputs(points, edges, radius, sides, max_faces):
+    # 海龟回到走过的位置时会产生重合节点与重复边
+    points, edges = dedupe_graph(points, edges)
+    curves = polylines_to_curves(points, graph_to_polylines(points, edges))
+    mesh = buffers_to_mesh(*graph_to_tubes(points, edges, radius, sides))
+    # max_faces 为 0 时不简化，只统计面数
+    mesh, report = decimate_mesh(mesh, max(max_faces, 0))
+    return graph_to_points(points), curves, mesh, report.faces_in, report.faces_out, report.error
+
+
 @hops.component(
     "/lsystem",
     name="LSystem",
     description="Create mesh based on L-System",
     inputs=[
-        hs.HopsNumber("N", "Iterations","iterations for l_system", default=4),
+        hs.HopsInteger("N", "Iterations","iterations for l_system", default=4),
         hs.HopsNumber("A","Angle","angle for l_system", default=25),
-        hs.HopsNumber("S","Step","step length for l_system", default=1.0)
+        hs.HopsNumber("S","Step","step length for l_system", default=1.0),
+        hs.HopsNumber("R","Radius","tube radius for the mesh", default=0.1),
+        hs.HopsInteger("Sd","Sides","number of sides of the tube section", default=6),
+        hs.HopsInteger("F","Faces","face budget for the mesh, 0 keeps every face", default=0),
+        hs.HopsString("X","Axiom","axiom for l_system, symbols may carry parameters like F(1)", default="F"),
+        hs.HopsString("Rl","Rules","rules for l_system, one per line or separated by ';'", default="F -> FF+[+F-F-F]-[-F+F+F]"),
+        hs.HopsInteger("Se","Seed","random seed for stochastic rules", default=0)
     ],
     outputs=[
         hs.HopsPoint("Points","P","Point based on l_system"),
-        hs.HopsMesh("Mesh", "M", "Mesh based on l_system"),
+        hs.HopsCurve("Curves","C","Branch polylines based on l_system"),
+        hs.HopsMesh("Mesh", "M", "Tube mesh based on l_system"),
+        hs.HopsInteger("Faces In","Fi","Triangle count before decimation"),
+        hs.HopsInteger("Faces Out","Fo","Triangle count of the output mesh"),
+        hs.HopsNumber("Error","E","Largest quadric error accepted by decimation, 0 when no face was removed"),
     ]
 )
-def l_system_mesh(iterations, angle, step):
-    axiom = "F"
-    rules = {"F": "FF+[+F-F-F]-[-F+F+F]"}
-    lstring = l_system(axiom, rules, iterations)
-    pts = lsystem_to_paths(lstring, angle, step)
-    mesh = points_to_mesh(pts)
-    return pts, mesh
+def l_system_mesh(iterations, angle, step, radius=0.1, sides=6, max_faces=0,
+                  axiom="F", rules="F -> FF+[+F-F-F]-[-F+F+F]", seed=0):
+    with cancel_scope(event=hs.cancel_event()):
+        points, edges = rules_graph(axiom, rules, iterations, seed, math.radians(angle), step)
+    return graph_outputs(points, edges, radius, sides, max_faces)
 
 
 @hops.component(
@@ -42,22 +65,91 @@ def l_system_mesh(iterations, angle, step):
     name="LSystem3D",
     description="Create points based on L-System",
     inputs=[
-        hs.HopsNumber("N", "Iterations","iterations for l_system", default=4),
+        hs.HopsInteger("N", "Iterations","iterations for l_system", default=4),
         hs.HopsNumber("A","Angle","angle for l_system", default=math.pi /6),
-        hs.HopsNumber("S","Step","step length for l_system", default=1.0)
+        hs.HopsNumber("S","Step","step length for l_system", default=1.0),
+        hs.HopsNumber("R","Radius","tube radius for the mesh", default=0.1),
+        hs.HopsInteger("Sd","Sides","number of sides of the tube section", default=6),
+        hs.HopsInteger("F","Faces","face budget for the mesh, 0 keeps every face", default=0),
+        hs.HopsString("X","Axiom","axiom for l_system, symbols may carry parameters like F(1)", default="F"),
+        hs.HopsString("Rl","Rules","rules for l_system, one per line or separated by ';'", default="F -> F[+F][-F]^F[&F]"),
+        hs.HopsInteger("Se","Seed","random seed for stochastic rules", default=0)
     ],
     outputs=[
         hs.HopsPoint("Points", "P", "Points based on l_system"),
-        hs.HopsMesh("Mesh","M","Mesh based on l_system")
+        hs.HopsCurve("Curves","C","Branch polylines based on l_system"),
+        hs.HopsMesh("Mesh","M","Tube mesh based on l_system"),
+        hs.HopsInteger("Faces In","Fi","Triangle count before decimation"),
+        hs.HopsInteger("Faces Out","Fo","Triangle count of the output mesh"),
+        hs.HopsNumber("Error","E","Largest quadric error accepted by decimation, 0 when no face was removed"),
+    ]
+)
+def l_system_mesh3d(iterations, angle, step, radius=0.1, sides=6, max_faces=0,
+                    axiom="F", rules="F -> F[+F][-F]^F[&F]", seed=0):
+    with cancel_scope(event=hs.cancel_event()):
+        points, edges = rules_graph(axiom, rules, iterations, seed, angle, step, heading=(1, 0, 0))
+    return graph_outputs(points, edges, radius, sides, max_faces)
+
+
+def delaunay_outputs(points, alpha, tolerance, max_faces):
+    vertices, faces = delaunay_mesh(points, alpha, tolerance)
+    mesh = buffers_to_mesh(vertices, faces)
+    mesh, report = decimate_mesh(mesh, max(max_faces, 0))
+    return mesh, graph_to_points(vertices), report.faces_in, report.faces_out, report.error
+
+
+@hops.component(
+    "/pointmesh",
+    name="PointMesh",
+    description="Triangulate points with a 2.5D Delaunay mesh",
+    inputs=[
+        hs.HopsPoint("P","Points","points to triangulate in the XY plane, Z is kept", hs.HopsParamAccess.LIST),
+        hs.HopsNumber("Al","Alpha","drop triangles with a circumradius above alpha, 0 keeps the convex hull", default=0.0),
+        hs.HopsNumber("T","Tolerance","points closer than this are merged", default=DEFAULT_TOLERANCE),
+        hs.HopsInteger("F","Faces","face budget for the mesh, 0 keeps every face", default=0)
+    ],
+    outputs=[
+        hs.HopsMesh("Mesh","M","Delaunay mesh of the points"),
+        hs.HopsPoint("Points","P","Points with coincident ones merged"),
+        hs.HopsInteger("Faces In","Fi","Triangle count before decimation"),
+        hs.HopsInteger("Faces Out","Fo","Triangle count of the output mesh"),
+        hs.HopsNumber("Error","E","Largest quadric error accepted by decimation, 0 when no face was removed"),
+    ]
+)
+def point_mesh(points, alpha=0.0, tolerance=DEFAULT_TOLERANCE, max_faces=0):
+    coords = np.array([(p.X, p.Y, p.Z) for p in points], dtype=np.float64)
+    return delaunay_outputs(coords, alpha, tolerance, max_faces)
+
+
+@hops.component(
+    "/lsystemmesh",
+    name="LSystemDelaunay",
+    description="Triangulate the points of an L-System with a 2.5D Delaunay mesh",
+    inputs=[
+        hs.HopsInteger("N", "Iterations","iterations for l_system", default=4),
+        hs.HopsNumber("A","Angle","angle for l_system", default=25),
+        hs.HopsNumber("S","Step","step length for l_system", default=1.0),
+        hs.HopsString("X","Axiom","axiom for l_system, symbols may carry parameters like F(1)", default="F"),
+        hs.HopsString("Rl","Rules","rules for l_system, one per line or separated by ';'", default="F -> FF+[+F-F-F]-[-F+F+F]"),
+        hs.HopsInteger("Se","Seed","random seed for stochastic rules", default=0),
+        hs.HopsNumber("Al","Alpha","drop triangles with a circumradius above alpha, 0 keeps the convex hull", default=0.0),
+        hs.HopsNumber("T","Tolerance","points closer than this are merged", default=DEFAULT_TOLERANCE),
+        hs.HopsInteger("F","Faces","face budget for the mesh, 0 keeps every face", default=0)
+    ],
+    outputs=[
+        hs.HopsMesh("Mesh","M","Delaunay mesh of the l_system points"),
+        hs.HopsPoint("Points","P","l_system points with coincident ones merged"),
+        hs.HopsInteger("Faces In","Fi","Triangle count before decimation"),
+        hs.HopsInteger("Faces Out","Fo","Triangle count of the output mesh"),
+        hs.HopsNumber("Error","E","Largest quadric error accepted by decimation, 0 when no face was removed"),
     ]
 )
-def l_system_mesh3d(iterations, angle, step):
-    axiom = "F"
-    rules = {"F": "F[+F][-F]^F[&F]"}
-    pts = l_system_3d(axiom, rules, iterations, angle, step)
-    mesh = points_to_mesh(pts)
-    return pts, mesh
+def l_system_delaunay(iterations, angle, step, axiom="F", rules="F -> FF+[+F-F-F]-[-F+F+F]", seed=0,
+                      alpha=0.0, tolerance=DEFAULT_TOLERANCE, max_faces=0):
+    with cancel_scope(event=hs.cancel_event()):
+        points, _ = rules_graph(axiom, rules, iterations, seed, math.radians(angle), step)
+    return delaunay_outputs(points, alpha, tolerance, max_faces)
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
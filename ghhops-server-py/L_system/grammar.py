@@ -0,0 +1,409 @@
+"""
+L-system 规则的解析、编译与展开
+
+规则文本每行（或以 ; 分隔）一条产生式，语法为:
+
+    [左上下文 <] 符号[(形参, ...)] [> 右上下文] [: 概率] -> 后继
+
+    F -> FF+[+F-F-F]-[-F+F+F]          确定性规则
+    F : 0.6 -> F[+F]F                   随机规则，同一前驱的多条规则按概率选择
+    F : 0.4 -> F[-F]F
+    F(l) -> F(l*0.5)[+F(l*0.7)]F(l)     参数化规则，后继参数为形参的算术表达式
+    A < B > C -> BB                     上下文相关规则，上下文跳过 +-&^[] 等海龟指令
+
+规则编译为整数符号表，展开时整个符号串以 NumPy 整数数组一次性改写，不再逐字符拼接字符串。
+
+展开前由规则的增长矩阵预估每次迭代后的符号数与节点数，超出预算时拒绝（或自动降低迭代次数）；
+展开与海龟解释过程中会检查 cancel_scope 设置的超时/取消事件，失控的展开可以在不结束进程的情况下中止。
+"""
+import ast
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+# 上下文匹配时跳过的海龟指令
+CONTEXT_IGNORED = '+-&^[]'
+# 展开结果缓存的条目数
+EXPAND_CACHE_SIZE = 32
+# 展开后符号数与节点数的上限
+MAX_SYMBOLS = int(os.environ.get('LSYSTEM_MAX_SYMBOLS', 5_000_000))
+MAX_POINTS = int(os.environ.get('LSYSTEM_MAX_POINTS', 100_000))
+# 超出上限时的处理方式: refuse 拒绝请求, cap 自动降低迭代次数
+BUDGET_MODE = os.environ.get('LSYSTEM_BUDGET_MODE', 'refuse')
+# 单次展开与海龟解释的默认超时（秒），0 表示不限制
+DEFAULT_TIMEOUT = float(os.environ.get('LSYSTEM_TIMEOUT', 30))
+
+
+class ExpansionBudgetError(ValueError):
+    """预估的展开规模超出预算"""
+
+
+class ExpansionCancelled(RuntimeError):
+    """展开因超时或取消事件而中止"""
+
+
+_scope = threading.local()
+
+
+@contextmanager
+def cancel_scope(timeout=DEFAULT_TIMEOUT, event=None):
+    """
+    为当前线程内的展开与海龟解释设置超时和取消事件
+    :param timeout: 超时秒数，0 或 None 表示不限制
+    :param event: threading.Event，被设置后展开在下一个检查点中止
+    """
+    previous = getattr(_scope, 'value', None)
+    deadline = time.monotonic() + timeout if timeout else None
+    _scope.value = (deadline, event)
+    try:
+        yield
+    finally:
+        _scope.value = previous
+
+
+def check_cancelled():
+    """在循环的检查点调用，超时或被取消时抛出 ExpansionCancelled"""
+    scope = getattr(_scope, 'value', None)
+    if scope is None:
+        return
+    deadline, event = scope
+    if event is not None and event.is_set():
+        raise ExpansionCancelled("L-system 展开已被取消")
+    if deadline is not None and time.monotonic() > deadline:
+        raise ExpansionCancelled("L-system 展开超时")
+
+Production = namedtuple('Production', ['pred', 'left', 'right', 'formals', 'prob', 'successor'])
+
+_PRED_PATTERN = re.compile(
+    r'^\s*(?:(?P<left>\S)\s*<\s*)?(?P<pred>[^\s(<>:])\s*(?:\((?P<formals>[^)]*)\))?'
+    r'\s*(?:>\s*(?P<right>\S)\s*)?(?::\s*(?P<prob>[0-9.eE+-]+)\s*)?$'
+)
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.USub, ast.UAdd,
+)
+
+
+def _compile_expression(expr, formals):
+    """
+    编译后继参数表达式，只允许数字、形参和算术运算
+    数字常量一律转为浮点数，避免 9**9**99 之类的整数幂运算长时间占用进程，浮点溢出时直接报错
+    """
+    tree = ast.parse(expr.strip(), mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"参数表达式中不支持的语法: {expr}")
+        if isinstance(node, ast.Name) and node.id not in formals:
+            raise ValueError(f"参数表达式中未定义的形参 {node.id}: {expr}")
+        if isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                raise ValueError(f"参数表达式中只允许数字常量: {expr}")
+            try:
+                node.value = float(node.value)
+            except OverflowError:
+                raise ValueError(f"参数表达式中的数字过大: {expr}")
+    return compile(tree, '<l-system>', 'eval')
+
+
+def _evaluate(code, scope):
+    """求参数表达式的值，溢出与除零等算术错误转为 ValueError"""
+    try:
+        return eval(code, scope)
+    except ArithmeticError as ex:
+        raise ValueError(f"参数表达式求值失败: {ex}")
+
+
+def _split_args(text):
+    """按括号外的逗号切分参数列表"""
+    args, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            args.append(text[start:i].strip())
+            start = i + 1
+    args.append(text[start:].strip())
+    return args if text.strip() else []
+
+
+def _closing_paren(text, start):
+    """text[start] 为 '('，返回与之匹配的 ')' 的位置"""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError(f"参数括号未闭合: {text}")
+
+
+def parse_word(text, formals=()):
+    """
+    解析符号串，符号后可以跟括号参数，如 F(l*0.5)[+F]
+    :return: [(符号, [已编译参数表达式, ...]), ...]
+    """
+    word = []
+    i = 0
+    text = text.strip()
+    while i < len(text):
+        char = text[i]
+        i += 1
+        if char.isspace():
+            continue
+        args = []
+        if i < len(text) and text[i] == '(':
+            end = _closing_paren(text, i)
+            args = [_compile_expression(arg, formals) for arg in _split_args(text[i + 1:end])]
+            i = end + 1
+        word.append((char, args))
+    return word
+
+
+def parse_rules(text):
+    """将规则文本解析为 Production 列表"""
+    productions = []
+    for line in re.split(r'[;\n]', text):
+        if not line.strip():
+            continue
+        if '->' not in line:
+            raise ValueError(f"规则缺少 '->': {line}")
+        head, successor = line.split('->', 1)
+        match = _PRED_PATTERN.match(head)
+        if not match:
+            raise ValueError(f"无法解析的规则前驱: {head}")
+        formals = tuple(_split_args(match.group('formals') or ''))
+        prob = float(match.group('prob')) if match.group('prob') else 1.0
+        productions.append(Production(
+            match.group('pred'), match.group('left'), match.group('right'),
+            formals, prob, parse_word(successor, formals),
+        ))
+    return productions
+
+
+class RuleTable:
+    """
+    编译后的规则表
+    同一 (前驱, 左上下文, 右上下文) 的产生式组成一个组，组内按概率随机选择
+    没有规则的符号编译为保持自身（及参数）不变的隐式产生式
+    """
+
+    def __init__(self, axiom, rules_text):
+        productions = parse_rules(rules_text)
+        axiom_word = parse_word(axiom)
+
+        chars = []
+        for char, _ in axiom_word:
+            chars.append(char)
+        for prod in productions:
+            chars.extend(c for c in (prod.pred, prod.left, prod.right) if c)
+            chars.extend(char for char, _ in prod.successor)
+        self.chars = list(dict.fromkeys(chars))
+        self.ids = {char: index for index, char in enumerate(self.chars)}
+        self.char_array = np.array(self.chars)
+        self.param_count = max(
+            [len(args) for _, args in axiom_word]
+            + [len(prod.formals) for prod in productions]
+            + [len(args) for prod in productions for _, args in prod.successor],
+            default=0,
+        )
+
+        # 分组
+        groups = {}
+        for prod in productions:
+            groups.setdefault((prod.pred, prod.left, prod.right), []).append(prod)
+        for char in self.chars:
+            groups.setdefault((char, None, None), [None])  # 隐式恒等产生式
+
+        self.productions = []
+        production_preds = []
+        group_first, group_size, group_bounds, default_group, contexts = [], [], [], {}, []
+        for (pred, left, right), alternatives in groups.items():
+            group = len(group_first)
+            group_first.append(len(self.productions))
+            group_size.append(len(alternatives))
+            self.productions.extend(alternatives)
+            production_preds.extend([pred] * len(alternatives))
+            probs = np.array([1.0 if prod is None else prod.prob for prod in alternatives])
+            if (probs <= 0).any():
+                raise ValueError(f"规则概率必须大于 0: {pred}")
+            group_bounds.append(np.cumsum(probs / probs.sum())[:-1])
+            if left is None and right is None:
+                default_group[self.ids[pred]] = group
+            else:
+                contexts.append((group, self.ids[pred], self.ids.get(left, -1), self.ids.get(right, -1)))
+
+        self.group_first = np.array(group_first, dtype=np.int32)
+        self.group_size = np.array(group_size, dtype=np.int32)
+        width = max(len(bounds) for bounds in group_bounds)
+        self.group_bounds = np.full((len(group_bounds), max(width, 1)), np.inf)
+        for group, bounds in enumerate(group_bounds):
+            self.group_bounds[group, :len(bounds)] = bounds
+        self.default_group = np.array([default_group[i] for i in range(len(self.chars))], dtype=np.int32)
+        # 两侧都有上下文的规则优先于单侧上下文规则
+        self.contexts = sorted(contexts, key=lambda c: (c[2] < 0) + (c[3] < 0))
+        self.ignored = np.isin(self.char_array, list(CONTEXT_IGNORED))
+
+        succ_start, succ_len, succ_flat = [], [], []
+        for index, prod in enumerate(self.productions):
+            word = [(production_preds[index], None)] if prod is None else prod.successor
+            succ_start.append(len(succ_flat))
+            succ_len.append(len(word))
+            succ_flat.extend(self.ids[char] for char, _ in word)
+        self.succ_start = np.array(succ_start, dtype=np.int32)
+        self.succ_len = np.array(succ_len, dtype=np.int32)
+        self.succ_flat = np.array(succ_flat, dtype=np.int32)
+
+        # 增长矩阵: growth[i, j] 为符号 i 的所有产生式后继中符号 j 个数的最大值，
+        # 对随机与上下文相关规则给出展开规模的上界
+        self.growth = np.zeros((len(self.chars), len(self.chars)))
+        for index, prod in enumerate(self.productions):
+            pred = self.ids[production_preds[index]]
+            counts = np.bincount(self.succ_flat[succ_start[index]:succ_start[index] + succ_len[index]],
+                                 minlength=len(self.chars))
+            np.maximum(self.growth[pred], counts, out=self.growth[pred])
+
+        self.axiom_symbols = np.array([self.ids[char] for char, _ in axiom_word], dtype=np.int32)
+        self.axiom_params = np.full((len(axiom_word), self.param_count), np.nan)
+        for index, (_, args) in enumerate(axiom_word):
+            for slot, code in enumerate(args):
+                self.axiom_params[index, slot] = _evaluate(code, {'__builtins__': {}})
+
+    def _neighbours(self, symbols):
+        """每个位置左右两侧最近的非海龟指令符号，没有则为 -1"""
+        positions = np.arange(len(symbols))
+        counted = ~self.ignored[symbols]
+        left = np.where(counted, positions, -1)
+        left = np.maximum.accumulate(np.concatenate([[-1], left[:-1]]))
+        right = np.where(counted, positions, len(symbols))
+        right = np.minimum.accumulate(np.concatenate([right[1:], [len(symbols)]])[::-1])[::-1]
+        padded = np.concatenate([symbols, [-1]])
+        return padded[left], padded[right]
+
+    def rewrite(self, symbols, params, rng):
+        """对整个符号数组做一次并行改写"""
+        group = self.default_group[symbols]
+        if self.contexts:
+            left, right = self._neighbours(symbols)
+            assigned = np.zeros(len(symbols), dtype=bool)
+            for context_group, pred, left_id, right_id in self.contexts:
+                mask = (symbols == pred) & ~assigned
+                if left_id >= 0:
+                    mask &= left == left_id
+                if right_id >= 0:
+                    mask &= right == right_id
+                group[mask] = context_group
+                assigned |= mask
+
+        production = self.group_first[group]
+        stochastic = np.flatnonzero(self.group_size[group] > 1)
+        if len(stochastic):
+            draws = rng.random(len(stochastic))
+            production[stochastic] += (draws[:, None] >= self.group_bounds[group[stochastic]]).sum(axis=1)
+
+        lengths = self.succ_len[production]
+        out_start = np.cumsum(lengths) - lengths
+        # 第 k 个输出符号取自其产生式后继的第 (k - out_start) 个符号
+        gather = np.repeat(self.succ_start[production] - out_start, lengths)
+        gather += np.arange(len(gather), dtype=gather.dtype)
+        new_symbols = self.succ_flat[gather]
+        if not self.param_count:
+            return new_symbols, None
+
+        new_params = np.full((len(new_symbols), self.param_count), np.nan)
+        for index in np.unique(production).tolist():
+            prod = self.productions[index]
+            positions = np.flatnonzero(production == index)
+            if prod is None:
+                new_params[out_start[positions]] = params[positions]
+                continue
+            scope = {name: params[positions, i] for i, name in enumerate(prod.formals)}
+            scope['__builtins__'] = {}
+            for offset, (_, args) in enumerate(prod.successor):
+                for param_slot, code in enumerate(args):
+                    new_params[out_start[positions] + offset, param_slot] = _evaluate(code, scope)
+        return new_symbols, new_params
+
+    def estimate(self, iterations):
+        """
+        由增长矩阵预估每次迭代后的规模上界
+        :return: (符号数数组, 节点数数组)，下标为迭代次数 0..iterations
+        """
+        counts = np.bincount(self.axiom_symbols, minlength=len(self.chars)).astype(np.float64)
+        history = [counts]
+        for _ in range(int(iterations)):
+            counts = counts @ self.growth
+            history.append(counts)
+        history = np.array(history)
+        forward = self.ids.get('F')
+        points = 1 + (history[:, forward] if forward is not None else 0)
+        return history.sum(axis=1), points
+
+    def expand(self, iterations, seed=0):
+        """
+        从公理开始展开 iterations 次
+        :return: (符号序号数组, 参数数组或 None)
+        """
+        rng = np.random.default_rng(seed)
+        symbols = self.axiom_symbols
+        params = self.axiom_params if self.param_count else None
+        for _ in range(int(iterations)):
+            check_cancelled()
+            symbols, params = self.rewrite(symbols, params, rng)
+        return symbols, params
+
+    def to_string(self, symbols):
+        """符号序号数组还原为字符串（不含参数）"""
+        return ''.join(self.char_array[symbols].tolist())
+
+
+@lru_cache(maxsize=EXPAND_CACHE_SIZE)
+def compile_rules(axiom, rules_text):
+    """编译规则表，同一组公理与规则只编译一次"""
+    return RuleTable(axiom, rules_text)
+
+
+@lru_cache(maxsize=EXPAND_CACHE_SIZE)
+def expand(axiom, rules_text, iterations, seed=0):
+    """
+    按 (公理, 规则, 迭代次数, 随机种子) 缓存的展开结果
+    返回的数组是只读的，多个请求共享同一份结果
+    :return: (RuleTable, 符号序号数组, 参数数组或 None)
+    """
+    table = compile_rules(axiom, rules_text)
+    symbols, params = table.expand(iterations, seed)
+    symbols.flags.writeable = False
+    if params is not None:
+        params.flags.writeable = False
+    return table, symbols, params
+
+
+def plan_iterations(axiom, rules_text, iterations, max_symbols=MAX_SYMBOLS, max_points=MAX_POINTS, mode=BUDGET_MODE):
+    """
+    展开前检查预估规模是否在预算内
+    :param mode: refuse 超出预算时抛出 ExpansionBudgetError，cap 返回预算内最大的迭代次数
+    :return: 实际使用的迭代次数
+    """
+    iterations = int(iterations)
+    if iterations < 0:
+        raise ValueError(f"迭代次数不能为负数: {iterations}")
+    symbols, points = compile_rules(axiom, rules_text).estimate(iterations)
+    within = (symbols <= max_symbols) & (points <= max_points)
+    if within.all():
+        return iterations
+    if mode == 'cap' and within[0]:
+        # 取第一次超出预算之前的迭代次数
+        return int(np.argmin(within)) - 1
+    raise ExpansionBudgetError(
+        f"迭代 {iterations} 次预计生成 {symbols[-1]:.3g} 个符号、{points[-1]:.3g} 个节点，"
+        f"超出上限（{max_symbols} 个符号、{max_points} 个节点），请减少迭代次数"
+    )
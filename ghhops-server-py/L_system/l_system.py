@@ -1,5 +1,18 @@
 import rhino3dm
 import math
+from functools import lru_cache
+from itertools import repeat
+import numpy as np
+from grammar import expand, plan_iterations, check_cancelled
+
+# 单位步长海龟结果的缓存条目数
+GRAPH_CACHE_SIZE = 32
+# 共享内存中线段图的总大小上限
+SHARED_MAX_BYTES = 256 << 20
+# 海龟解释每处理这么多个符号检查一次超时/取消
+CANCEL_CHECK_INTERVAL = 1 << 16
+
+_shared_store = None
 
 def unitize_vector(vector):
     length = math.sqrt(vector.X**2 + vector.Y**2 + vector.Z**2)
@@ -79,14 +92,6 @@ def lsystem_to_paths(lstring, angle, step_length):
             points.append(position)  # 确保路径连续
     return points
 
-def points_to_mesh(points):
-    mesh = rhino3dm.Mesh()
-    for i, pt in enumerate(points):
-        mesh.Vertices.Add(pt.X, pt.Y, pt.Z)
-        if i > 0 and i < len(points) -1:
-            mesh.Faces.AddFace(i - 1, i, (i + 1) % len(points))
-    return mesh
-
 def l_system_3d(axiom, rules, iterations, angle, distance):
     """
     基于 L-system 生成三维几何体
@@ -140,4 +145,206 @@ def l_system_3d(axiom, rules, iterations, angle, distance):
         elif char == ']':
             # 恢复保存的状态
             current_position, current_direction = stack.pop()
-    return points
\ No newline at end of file
+    return points
+
+def _rotation_matrix(axis, angle):
+    """
+    绕任意轴旋转的 3x3 矩阵（Rodrigues 公式）
+    :param axis: 旋转轴，长度不能为零
+    :param angle: 旋转角度（弧度）
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    length = np.linalg.norm(axis)
+    if length == 0:
+        raise ValueError("向量的长度为零，不能归一化")
+    x, y, z = axis / length
+    k = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    return np.eye(3) + math.sin(angle) * k + (1 - math.cos(angle)) * (k @ k)
+
+
+def lsystem_graph(lstring, angle, step_length, heading=(0, 1, 0), up=(0, 0, 1), scales=None):
+    """
+    海龟解释 L-system 字符串，记录真实的线段拓扑
+    每个 F 生成一个新节点和一条 父节点->子节点 的边，] 只恢复当前节点，不会重复添加点
+    :param lstring: 展开后的 L-system 字符串（或单字符序列）
+    :param angle: 旋转角度（弧度）
+    :param step_length: 每次前进的距离
+    :param heading: 初始方向
+    :param up: 上方向，+/- 绕它旋转，&/^ 绕 heading x up 旋转
+    :param scales: 与 lstring 等长的参数序列，参数化符号 F(l)、+(a) 的步长/角度乘以该值
+    :return: (n, 3) 节点坐标数组, (m, 2) 边数组（父节点序号, 子节点序号）
+    """
+    up = np.asarray(up, dtype=np.float64)
+    turn_left = _rotation_matrix(up, angle)
+    turn_right = _rotation_matrix(up, -angle)
+    heading = np.asarray(heading, dtype=np.float64)
+    position = np.zeros(3)
+    current = 0
+    points = [position]
+    edges = []
+    stack = []
+
+    for index, (char, scale) in enumerate(zip(lstring, repeat(1.0) if scales is None else scales)):
+        if not index % CANCEL_CHECK_INTERVAL:
+            check_cancelled()
+        if char == 'F':
+            position = position + heading * (step_length * scale)
+            points.append(position)
+            edges.append((current, len(points) - 1))
+            current = len(points) - 1
+        elif char == '+':
+            heading = (turn_left if scale == 1.0 else _rotation_matrix(up, angle * scale)) @ heading
+        elif char == '-':
+            heading = (turn_right if scale == 1.0 else _rotation_matrix(up, -angle * scale)) @ heading
+        elif char == '&':
+            heading = _rotation_matrix(np.cross(heading, up), angle * scale) @ heading
+        elif char == '^':
+            heading = _rotation_matrix(np.cross(heading, up), -angle * scale) @ heading
+        elif char == '[':
+            stack.append((current, position, heading))
+        elif char == ']':
+            current, position, heading = stack.pop()
+    return np.array(points), np.array(edges, dtype=np.int64).reshape(-1, 2)
+
+
+def graph_to_polylines(points, edges):
+    """
+    将线段图拆分为尽量少的折线：在只有一条入边和一条出边的节点处延续，在分叉、汇合处断开
+    合并重合点后的图可能带环，环上没有断点时从任意一条边开始，回到起点时结束
+    :return: 折线节点序号数组的列表
+    """
+    child_count = np.bincount(edges[:, 0], minlength=len(points))
+    parent_count = np.bincount(edges[:, 1], minlength=len(points))
+    # 只有一个子节点的节点 -> 通往该子节点的边
+    next_edge = np.full(len(points), -1, dtype=np.int64)
+    single = child_count[edges[:, 0]] == 1
+    next_edge[edges[single, 0]] = np.flatnonzero(single)
+    # 折线只穿过一进一出的节点，根节点、分叉与汇合节点出发的边各自开始一条新折线
+    through = (child_count == 1) & (parent_count == 1)
+    # 之后剩下的边都在没有断点的环上
+    starts = np.argsort(through[edges[:, 0]], kind='stable')
+
+    # 逐节点的循环用 Python 列表，避免 NumPy 标量索引的开销
+    through, next_edge, pairs = through.tolist(), next_edge.tolist(), edges.tolist()
+    used = [False] * len(pairs)
+    polylines = []
+    for edge in starts.tolist():
+        if used[edge]:
+            continue
+        used[edge] = True
+        chain = list(pairs[edge])
+        node = chain[-1]
+        while through[node] and not used[next_edge[node]]:
+            used[next_edge[node]] = True
+            node = pairs[next_edge[node]][1]
+            chain.append(node)
+        polylines.append(np.array(chain, dtype=np.int64))
+    return polylines
+
+
+def polylines_to_curves(points, polylines):
+    """将折线节点序号转换为 rhino3dm.PolylineCurve 列表"""
+    curves = []
+    for chain in polylines:
+        polyline = rhino3dm.Polyline(len(chain))
+        for x, y, z in points[chain].tolist():
+            polyline.Add(x, y, z)
+        curves.append(polyline.ToPolylineCurve())
+    return curves
+
+
+def graph_to_tubes(points, edges, radius, sides):
+    """
+    沿每条边批量生成圆管网格
+    :param radius: 圆管半径
+    :param sides: 圆管截面边数（至少为 3）
+    :return: (m * 2 * sides, 3) 顶点数组, (m * sides, 4) 四边面数组
+    """
+    sides = max(int(sides), 3)
+    start, end = points[edges[:, 0]], points[edges[:, 1]]
+    direction = end - start
+    length = np.linalg.norm(direction, axis=1, keepdims=True)
+    direction = np.divide(direction, length, out=np.tile([0.0, 0.0, 1.0], (len(edges), 1)), where=length > 0)
+    # 与方向不平行的辅助轴，用来构造截面平面的两个正交轴
+    helper = np.where(np.abs(direction[:, 2:3]) < 0.9, [[0.0, 0.0, 1.0]], [[1.0, 0.0, 0.0]])
+    u = np.cross(direction, helper)
+    u /= np.linalg.norm(u, axis=1, keepdims=True)
+    v = np.cross(direction, u)
+
+    theta = np.arange(sides) * (2 * math.pi / sides)
+    ring = radius * (np.cos(theta)[None, :, None] * u[:, None, :] + np.sin(theta)[None, :, None] * v[:, None, :])
+    vertices = np.stack([start[:, None, :] + ring, end[:, None, :] + ring], axis=1)
+
+    base = (np.arange(len(edges)) * 2 * sides)[:, None]
+    k = np.arange(sides)[None, :]
+    a = base + k
+    b = base + (k + 1) % sides
+    faces = np.stack([a, b, b + sides, a + sides], axis=-1)
+    return vertices.reshape(-1, 3), faces.reshape(-1, 4)
+
+
+def buffers_to_mesh(vertices, faces):
+    """将顶点数组与三角/四边面数组批量写入 rhino3dm.Mesh"""
+    mesh = rhino3dm.Mesh()
+    add_vertex = mesh.Vertices.Add
+    for x, y, z in vertices.tolist():
+        add_vertex(x, y, z)
+    add_face = mesh.Faces.AddFace
+    for face in faces.tolist():
+        add_face(*face)
+    return mesh
+
+
+def graph_to_points(points):
+    """节点坐标数组转换为 rhino3dm.Point3d 列表"""
+    return [rhino3dm.Point3d(x, y, z) for x, y, z in points.tolist()]
+
+
+def expanded_graph(table, symbols, params, angle, step_length, heading=(0, 1, 0)):
+    """
+    对编译规则展开得到的符号数组做海龟解释
+    :param table: grammar.RuleTable
+    :param symbols: 符号序号数组
+    :param params: 参数数组或 None，取第一个参数作为步长/角度的缩放
+    """
+    scales = None
+    if params is not None:
+        scales = np.where(np.isnan(params[:, 0]), 1.0, params[:, 0]).tolist()
+    return lsystem_graph(table.char_array[symbols].tolist(), angle, step_length, heading, scales=scales)
+
+
+def shared_store():
+    """各 worker 进程共用的共享内存存储，线段图只由第一个需要它的进程构建"""
+    global _shared_store
+    if _shared_store is None:
+        # 在用到时才导入，单独 import l_system 不需要把 ghhops-server-py 加入 sys.path
+        from ghhops_server.sharedmem import SharedArrayStore
+        _shared_store = SharedArrayStore('lsystem', SHARED_MAX_BYTES)
+    return _shared_store
+
+
+@lru_cache(maxsize=GRAPH_CACHE_SIZE)
+def unit_graph(axiom, rules_text, iterations, seed, angle, heading=(0, 1, 0)):
+    """
+    按 (公理, 规则, 迭代次数, 随机种子, 角度, 初始方向) 缓存的单位步长线段图
+    结果发布到共享内存，其他 worker 进程直接映射同一份数组，不再重复展开
+    符号串的展开本身由 grammar.expand 按 (公理, 规则, 迭代次数, 随机种子) 缓存，只改角度时只重新运行海龟
+    :return: 只读的 (n, 3) 单位步长节点坐标, (m, 2) 边数组
+    """
+    def build():
+        table, symbols, params = expand(axiom, rules_text, iterations, seed)
+        return expanded_graph(table, symbols, params, angle, 1.0, heading)
+
+    key = ('unit_graph', axiom, rules_text, iterations, seed, angle, heading)
+    return shared_store().get_or_create(key, build)
+
+
+def rules_graph(axiom, rules_text, iterations, seed, angle, step_length, heading=(0, 1, 0)):
+    """
+    规则展开并做海龟解释，节点坐标与步长成正比，只改步长时只对缓存的单位步长坐标做一次数乘
+    展开前按增长矩阵预估规模，超出预算时拒绝或降低迭代次数（见 grammar.plan_iterations）
+    :return: (n, 3) 节点坐标数组, (m, 2) 边数组
+    """
+    iterations = plan_iterations(axiom, rules_text, iterations)
+    points, edges = unit_graph(axiom, rules_text, iterations, int(seed), float(angle), tuple(heading))
+    return points * step_length, edges
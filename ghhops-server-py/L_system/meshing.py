@@ -0,0 +1,92 @@
+"""
+点集三角化：cKDTree 合并重合点，scipy Delaunay 做 2.5D 三角剖分，可选按外接圆半径过滤（alpha shape）
+
+所有步骤都是对整个点集的 NumPy/scipy 批量运算，百万级点集在数秒内完成。
+"""
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree, Delaunay, QhullError
+
+# 默认的重合点合并距离
+DEFAULT_TOLERANCE = 1e-6
+
+
+def dedupe_points(points, tolerance=DEFAULT_TOLERANCE):
+    """
+    合并距离不超过 tolerance 的点（按传递关系成组），每组保留第一个点
+    :param points: (n, 3) 点坐标数组
+    :param tolerance: 合并距离，小于等于 0 时只合并完全重合的点
+    :return: (k, 3) 去重后的点, (n,) 每个原始点对应的新序号
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return points, np.zeros(0, dtype=np.int64)
+    if tolerance <= 0:
+        _, first, inverse = np.unique(points, axis=0, return_index=True, return_inverse=True)
+    else:
+        pairs = cKDTree(points).query_pairs(tolerance, output_type='ndarray')
+        graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                           shape=(len(points), len(points)))
+        _, labels = connected_components(graph, directed=False)
+        _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    # 按每组第一个点在原数组中的顺序编号，保持点的原有次序
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return points[first[order]], rank[inverse.reshape(-1)]
+
+
+def dedupe_graph(points, edges, tolerance=DEFAULT_TOLERANCE):
+    """
+    合并线段图中的重合节点，并去掉由此产生的零长度边与重复边
+    :return: (k, 3) 节点坐标, (m', 2) 边数组
+    """
+    points, index = dedupe_points(points, tolerance)
+    edges = index[np.asarray(edges, dtype=np.int64).reshape(-1, 2)]
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    _, first = np.unique(np.sort(edges, axis=1), axis=0, return_index=True)
+    return points, edges[np.sort(first)]
+
+
+def circumradius(points, triangles):
+    """
+    三角形在 XY 平面上的外接圆半径，退化三角形为 inf
+    :param points: (n, 2 或 3) 点坐标数组
+    :param triangles: (m, 3) 三角形顶点序号
+    """
+    a, b, c = (points[triangles[:, i], :2] for i in range(3))
+    ab = np.linalg.norm(b - a, axis=1)
+    bc = np.linalg.norm(c - b, axis=1)
+    ca = np.linalg.norm(a - c, axis=1)
+    area2 = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radius = ab * bc * ca / (2 * area2)
+    return np.where(area2 > 0, radius, np.inf)
+
+
+def delaunay_mesh(points, alpha=0.0, tolerance=DEFAULT_TOLERANCE):
+    """
+    2.5D Delaunay 三角化：在 XY 平面上剖分，保留每个点的 Z 坐标
+    :param points: (n, 3) 点坐标数组
+    :param alpha: 大于 0 时删除外接圆半径超过 alpha 的三角形（alpha shape），得到凹边界和孔洞
+    :param tolerance: 三角化前合并 XY 坐标重合点的距离，Z 不同的重合点只保留第一个
+    :return: (k, 3) 顶点数组, (m, 3) 三角面数组（逆时针朝向 +Z）
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    # 按 XY 去重，否则同一 XY 上的其余点不会被任何三角形引用
+    _, index = dedupe_points(points * [1.0, 1.0, 0.0], tolerance)
+    vertices = points[np.unique(index, return_index=True)[1]]
+    if len(vertices) < 3:
+        return vertices, np.zeros((0, 3), dtype=np.int64)
+    try:
+        triangles = Delaunay(vertices[:, :2]).simplices.astype(np.int64)
+    except QhullError:
+        raise ValueError("点在 XY 平面上共线，无法三角化")
+    if alpha > 0:
+        triangles = triangles[circumradius(vertices, triangles) <= alpha]
+    # 统一为逆时针，法线朝向 +Z
+    a, b, c = (vertices[triangles[:, i], :2] for i in range(3))
+    clockwise = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]) < 0
+    triangles[clockwise] = triangles[clockwise][:, [0, 2, 1]]
+    return vertices, triangles
@@ -2,11 +2,20 @@
 import importlib
 import ghhops_server.base as base
 import ghhops_server.middlewares as hmw
+from typing import TYPE_CHECKING
 from ghhops_server import params
-from ghhops_server.logger import logging, hlogger
+from ghhops_server.logger import logging, hlogger, configure_logging
+from ghhops_server import logger
+from ghhops_server.execution import cancel_event, SolveTimeout, SolveCancelled
+from ghhops_server.admission import SolveRejected
+from ghhops_server.cache import SolveCache
+from ghhops_server.params import GeometryCache
+from ghhops_server.jobs import JobQueue, report_progress
 
-# import all supported servers for easy typehinting
-from ghhops_server.middlewares import *  # noqa
+# supported servers are imported on first use, since each pulls in its
+# http stack. import them here for easy typehinting
+if TYPE_CHECKING:
+    from ghhops_server.middlewares import *  # noqa
 
 # import all supported parameter types for easy access
 from ghhops_server.params import *  # noqa
@@ -21,21 +30,22 @@ class Hops(base.HopsBase):
 
     def __new__(cls, app=None, debug=False, *args, **kwargs) -> base.HopsBase:
         # set logger level
+        logger._ensure_handler()
         hlogger.setLevel(logging.DEBUG if debug else logging.INFO)
 
         # determine the correct middleware base on the source app being wrapped
         # when running standalone with no source apps
         if app is None:
             hlogger.debug("Using Hops default http server")
-            params._init_rhino3dm()
-            return hmw.HopsDefault()
+            params._defer_init(params._init_rhino3dm)
+            return hmw.HopsDefault(*args, **kwargs)
 
         # if wrapping another app
         app_type = repr(app)
         # if app is Flask
         if app_type.startswith("<Flask"):
             hlogger.debug("Using Hops Flask middleware")
-            params._init_rhino3dm()
+            params._defer_init(params._init_rhino3dm)
             return hmw.HopsFlask(app, *args, **kwargs)
 
         # if wrapping rhinoinside
@@ -60,3 +70,10 @@ class Hops(base.HopsBase):
             return ri_core is not None
         except Exception:
             return False
+
+
+def __getattr__(name):
+    # lazy access to hs.HopsDefault, hs.HopsFlask
+    if name in hmw.__all__:
+        return getattr(hmw, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
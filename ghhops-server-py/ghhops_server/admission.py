@@ -0,0 +1,165 @@
+"""Admission control for Hops solves"""
+import threading
+import time
+from contextlib import contextmanager
+
+# default number of solves allowed to wait for a free slot
+DEFAULT_MAX_QUEUE = 32
+
+
+class SolveRejected(Exception):
+    """Solve was not admitted because the server is at capacity"""
+
+
+class _Gate:
+    # concurrency limit and counters of one component (or the server)
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        # abandoned solves still holding a slot, and all abandoned so far
+        self.orphaned = 0
+        self.abandoned = 0
+
+    def has_room(self):
+        return not self.limit or self.active < self.limit
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "orphaned": self.orphaned,
+            "abandoned": self.abandoned,
+        }
+
+
+class AdmissionControl:
+    """Global and per-component concurrency caps with a bounded wait queue
+
+    A solve runs when both the server and its component have a free slot.
+    Otherwise it waits in a queue shared by all components. When the queue
+    is full, or the wait is longer than queue_timeout seconds, the solve
+    is rejected with SolveRejected right away instead of piling up.
+
+    A solve given up on with an exception carrying its still running
+    worker thread (see execution.run_in_thread) keeps its slot until that
+    thread finishes, so abandoned handlers count against the limits.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=None,
+        max_queue=DEFAULT_MAX_QUEUE,
+        queue_timeout=None,
+    ):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._server = _Gate(max_concurrent)
+        self._gates = {}
+
+    def _reject(self, gate, reason):
+        gate.rejected += 1
+        self._server.rejected += 1
+        raise SolveRejected(reason)
+
+    @contextmanager
+    def admit(self, key, limit=None, blocking=False):
+        """Hold a solve slot of component key (with limit) while in context
+
+        With blocking the solve waits for a slot however long it takes,
+        regardless of max_queue and queue_timeout. Async jobs wait so, the
+        job pool already bounds how many of them there are.
+        """
+        with self._cond:
+            gate = self._gates.get(key)
+            if gate is None:
+                gate = self._gates[key] = _Gate(limit)
+
+            def has_room():
+                return self._server.has_room() and gate.has_room()
+
+            if not has_room():
+                if (
+                    not blocking
+                    and self.max_queue is not None
+                    and self._server.queued >= self.max_queue
+                ):
+                    self._reject(gate, "Server busy, solve queue is full")
+                gate.queued += 1
+                self._server.queued += 1
+                gate.peak_queued = max(gate.peak_queued, gate.queued)
+                self._server.peak_queued = max(
+                    self._server.peak_queued, self._server.queued
+                )
+                start = time.monotonic()
+                try:
+                    admitted = self._cond.wait_for(
+                        has_room, None if blocking else self.queue_timeout
+                    )
+                finally:
+                    gate.queued -= 1
+                    self._server.queued -= 1
+                if not admitted:
+                    waited = time.monotonic() - start
+                    self._reject(
+                        gate, f"Server busy, no solve slot after {waited:.1f}s"
+                    )
+            gate.active += 1
+            gate.admitted += 1
+            self._server.active += 1
+            self._server.admitted += 1
+        worker = None
+        try:
+            yield
+        except BaseException as ex:
+            worker = getattr(ex, "worker", None)
+            raise
+        finally:
+            if worker is not None and worker.is_alive():
+                self._orphan(gate, worker)
+            else:
+                self._release(gate)
+
+    def _release(self, gate):
+        with self._cond:
+            gate.active -= 1
+            self._server.active -= 1
+            self._cond.notify_all()
+
+    def _orphan(self, gate, worker):
+        # the slot is freed once the abandoned worker thread finishes
+        with self._cond:
+            for counted in (gate, self._server):
+                counted.orphaned += 1
+                counted.abandoned += 1
+
+        def release():
+            worker.join()
+            with self._cond:
+                gate.orphaned -= 1
+                self._server.orphaned -= 1
+            self._release(gate)
+
+        threading.Thread(
+            target=release, name="hops-orphan", daemon=True
+        ).start()
+
+    def stats(self):
+        """Queue depth, active solves and rejection counters"""
+        with self._cond:
+            return {
+                "server": dict(
+                    self._server.stats(), max_queue=self.max_queue
+                ),
+                "components": {
+                    key: gate.stats() for key, gate in self._gates.items()
+                },
+            }
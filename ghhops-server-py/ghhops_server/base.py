@@ -6,23 +6,47 @@ import os.path as op
 import inspect
 import json
 import base64
+import logging
+import time
+from functools import partial
 from typing import Tuple
 
-from ghhops_server.logger import hlogger
+from ghhops_server.logger import hlogger, truncated
 from ghhops_server.component import HopsComponent
+from ghhops_server import execution
+from ghhops_server import compression
+from ghhops_server import wire
+from ghhops_server.cache import SolveCache, CachedFile
+from ghhops_server.jobs import JobQueue, ACTIVE_STATES, CANCELLED
+from ghhops_server.admission import (
+    AdmissionControl,
+    SolveRejected,
+    DEFAULT_MAX_QUEUE,
+)
 
 
 DEFAULT_CATEGORY = "Hops"
 DEFAULT_SUBCATEGORY = "Hops Python"
 
+_PACKAGE_DIR = op.dirname(op.abspath(__file__))
+
+# request and response format of Grasshopper solves
+JSON_FORMATS = (wire.JSON, wire.JSON)
+
 
 class HopsBase:
     """Base class for all Hops middleware implementations"""
 
     ROOT_ROUTE = "/"
     SOLVE_ROUTE = "/solve"
+    METRICS_ROUTE = "/metrics"
+    # async job routes, served when jobs are enabled
+    JOBS_ROUTE = "/jobs"
+
+    BUILTIN_ROUTES = [ROOT_ROUTE, SOLVE_ROUTE, METRICS_ROUTE]
 
-    BUILTIN_ROUTES = [ROOT_ROUTE, SOLVE_ROUTE]
+    # seconds a rejected client is asked to wait before retrying
+    RETRY_AFTER = 1
 
     ERROR_PAGE_405 = """<!doctype html>
 <html lang=en>
@@ -30,16 +54,59 @@ class HopsBase:
 <h1>Method Not Allowed</h1>
 <p>The method is not allowed for the requested URL.</p>"""
 
-    def __init__(self, app):
+    def __init__(
+        self,
+        app,
+        timeout=None,
+        max_concurrent=None,
+        max_queue=DEFAULT_MAX_QUEUE,
+        queue_timeout=None,
+        cache=None,
+        compress_min_size=compression.DEFAULT_MIN_SIZE,
+        compress_level=None,
+        max_body_size=compression.DEFAULT_MAX_BODY_SIZE,
+        geometry_cache=None,
+        jobs=None,
+    ):
         self.app = app
+        # default solve deadline in seconds for components without their own
+        self.timeout = timeout
+        # solves beyond max_concurrent wait in a queue of max_queue,
+        # metadata requests are never queued
+        self.admission = AdmissionControl(
+            max_concurrent, max_queue, queue_timeout
+        )
+        # optional disk cache of solve results, a SolveCache or its root dir
+        self.cache = SolveCache(cache) if isinstance(cache, str) else cache
+        # responses of at least this many bytes are compressed for clients
+        # sending Accept-Encoding, None disables response compression
+        self.compress_min_size = compress_min_size
+        # None uses the default level of the negotiated encoding
+        self.compress_level = compress_level
+        # compressed request bodies decoding to more bytes are refused with
+        # 413, None removes the limit
+        self.max_body_size = max_body_size
+        # optional async job queue, True for one with default settings
+        self.jobs = JobQueue() if jobs is True else jobs
+        # replaces the process wide cache of decoded input geometry
+        if geometry_cache is not None:
+            from ghhops_server import params
+
+            params.GEOMETRY_CACHE = geometry_cache
         # components dict store each components two times under
         # two keys get uri and solve uri, for faster lookups in query and solve
         # it is assumed that uri and solve uri and both unique to the component
         self._components: dict[str, HopsComponent] = {}
 
     def handles(self, request):
-        uri = request.path
-        return uri in HopsBase.BUILTIN_ROUTES or uri in self._components
+        return self._handles_uri(request.path)
+
+    def _handles_uri(self, uri):
+        return (
+            uri in self._components
+            or uri in HopsBase.BUILTIN_ROUTES
+            or self._is_job_uri(uri)
+        )
 
     def handle_HEAD(self, _):
         return self._prep_response(200, "Success")
@@ -51,11 +118,14 @@ class HopsBase:
         if self._is_solve_uri(uri):
             return self._return_method_not_allowed()
 
+        if self._is_job_uri(uri):
+            return self._job_response(request, *self.job_request("GET", uri))
+
         # if component exists, return component data
         res, results = self.query(uri=uri)
         if res:
             response = self._prep_response()
-            response.data = results
+            self._set_body(request, response, results)
 
         # otherwise return 404
         else:
@@ -70,12 +140,52 @@ class HopsBase:
         if self._is_comp_uri(uri):
             return self._return_method_not_allowed()
 
+        # POST /jobs/<id> is not a thing
+        if self._is_job_uri(uri) and uri != HopsBase.JOBS_ROUTE:
+            return self._return_method_not_allowed()
+
         # otherwise try to solve with payload
-        data = request.data
-        res, results = self.solve(uri=uri, payload=data)
+        try:
+            data = self.request_body(
+                request.data, request.headers.get("Content-Encoding")
+            )
+        except compression.BodyTooLarge as ex:
+            response = self._prep_response(413, "Content Too Large")
+            response.data = self._return_with_err(str(ex)).encode("utf_8")
+            return response
+        except ValueError as ex:
+            response = self._prep_response(400, "Bad Request")
+            response.data = self._return_with_err(str(ex)).encode("utf_8")
+            return response
+        try:
+            formats = self.wire_formats(
+                request.headers.get("Content-Type"),
+                request.headers.get("Accept"),
+            )
+        except ValueError as ex:
+            response = self._prep_response(415, "Unsupported Media Type")
+            response.data = self._return_with_err(str(ex)).encode("utf_8")
+            return response
+        try:
+            if self.wants_job(uri, request.headers.get("Prefer")):
+                return self._job_response(
+                    request, *self.submit_job(uri, data, formats)
+                )
+            res, results = self.solve_result(
+                uri=uri,
+                payload=data,
+                disconnected=self._disconnect_check(request),
+                formats=formats,
+            )
+        except SolveRejected as ex:
+            response = self._prep_response(503, "Service Unavailable")
+            response.headers["Retry-After"] = str(HopsBase.RETRY_AFTER)
+            response.data = self._return_with_err(str(ex)).encode("utf_8")
+            return response
+
         if res:
             response = self._prep_response()
-            response.data = results.encode(encoding="utf_8")
+            self._set_body(request, response, results, formats[1])
 
         # otherwise return 404
         else:
@@ -84,14 +194,104 @@ class HopsBase:
 
         return response
 
+    def handle_DELETE(self, request):
+        uri = request.path
+        if not self._is_job_uri(uri):
+            return self._return_method_not_allowed()
+        return self._job_response(request, *self.job_request("DELETE", uri))
+
+    def _job_response(self, request, status, msg, headers, body):
+        if status == 405:
+            return self._return_method_not_allowed()
+        response = self._prep_response(status, msg)
+        response.headers.update(headers)
+        self._set_body(request, response, body)
+        return response
+
+    def _set_body(self, request, response, body, content_type=None):
+        if content_type:
+            response.headers["Content-Type"] = content_type
+        encoding = self.response_encoding(
+            request.headers.get("Accept-Encoding"), body
+        )
+        if encoding:
+            response.response = self.compressed_body(body, encoding)
+            # length of the compressed stream is not known upfront
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = encoding
+            response.headers["Vary"] = "Accept-Encoding"
+        elif isinstance(body, CachedFile):
+            self._send_file(request, response, body)
+        elif isinstance(body, bytes):
+            response.data = body
+        else:
+            response.data = body.encode(encoding="utf_8")
+
+    def _send_file(self, request, response, cached):
+        # middlewares that can stream files from disk override this
+        response.data = cached.read().encode(encoding="utf_8")
+
+    def request_body(self, data, content_encoding):
+        """Decode a request body
+
+        Raises compression.BodyTooLarge past max_body_size, and ValueError on
+        bad encodings.
+        """
+        return compression.decompress(
+            data, content_encoding, self.max_body_size
+        )
+
+    def wire_formats(self, content_type, accept):
+        """Request and response format of a solve, see ghhops_server.wire
+
+        Grasshopper gets json. Clients accepting or sending a binary format
+        get their solve results in it. Raises ValueError for request bodies
+        in a format this server can not read.
+        """
+        request_type = wire.request_format(content_type)
+        return request_type, wire.response_format(accept, request_type)
+
+    def response_encoding(self, accept_encoding, body):
+        """Encoding to compress a response body with, None to send as is"""
+        if self.compress_min_size is None:
+            return None
+        size = body.size if isinstance(body, CachedFile) else len(body)
+        if size < self.compress_min_size:
+            return None
+        return compression.negotiate(accept_encoding)
+
+    def compressed_body(self, body, encoding):
+        """Compressed chunks of a str, bytes or CachedFile response body"""
+        if isinstance(body, CachedFile):
+            chunks = compression.iter_file(body.file)
+        elif isinstance(body, bytes):
+            chunks = compression.iter_bytes(body)
+        else:
+            chunks = compression.iter_text(body)
+        return compression.compress(chunks, encoding, self.compress_level)
+
+    def _disconnect_check(self, request):
+        # callable reporting whether the client of request went away,
+        # or None when the server can not tell
+        return None
+
     def _is_solve_uri(self, uri):
         return uri == HopsBase.SOLVE_ROUTE
 
     def _is_comp_uri(self, uri):
         return uri in self._components
 
+    def _is_job_uri(self, uri):
+        return self.jobs is not None and (
+            uri == HopsBase.JOBS_ROUTE
+            or uri.startswith(HopsBase.JOBS_ROUTE + "/")
+        )
+
     def query(self, uri) -> Tuple[bool, str]:
         """Get information on given uri"""
+        if uri == HopsBase.METRICS_ROUTE:
+            return True, json.dumps(self.metrics())
+
         # try to find a component registered for this uri
         # returns one object {}
         comp = self._components.get(uri, None)
@@ -108,30 +308,177 @@ class HopsBase:
 
         return False, self._return_with_err("Unknown Hops url")
 
-    def solve(self, uri, payload) -> Tuple[bool, str]:
-        """Perform Solve on given uri"""
+    def metrics(self):
+        """Solve admission and cache counters, for sizing servers"""
+        from ghhops_server import params
+
+        metrics = {"admission": self.admission.stats()}
+        if self.cache is not None:
+            metrics["cache"] = self.cache.stats()
+        metrics["geometry_cache"] = params.GEOMETRY_CACHE.stats()
+        if self.jobs is not None:
+            metrics["jobs"] = self.jobs.stats()
+        return metrics
+
+    def solve(self, uri, payload, disconnected=None) -> Tuple[bool, str]:
+        """Perform Solve on given uri
+
+        disconnected is an optional callable that returns True once the
+        client has gone away, the solve is then cancelled like a timeout.
+        Raises SolveRejected when the server is at capacity.
+        """
+        res, results = self.solve_result(uri, payload, disconnected)
+        if isinstance(results, CachedFile):
+            results = results.read()
+        return res, results
+
+    def solve_result(
+        self, uri, payload, disconnected=None, formats=JSON_FORMATS
+    ):
+        """Like solve, but large cached results come back as a CachedFile
+
+        The caller owns the open file and should stream it to the client.
+        formats are the request and response format from wire_formats,
+        results in a binary format come back as bytes.
+        """
         if uri == HopsBase.ROOT_ROUTE:
             hlogger.debug("Nothing to solve on root")
             return False, self._return_with_err("Nothing to solve on root")
 
+        comp = self._component_for(uri, payload, formats[0])
+        if comp:
+            return self._process_solve_request(
+                comp, payload, disconnected, formats
+            )
+        return False, self._return_with_err("Unknown Hops component url")
+
+    def _component_for(self, uri, payload, request_type=wire.JSON):
+        # component solved by a POST of payload to uri, or None
         # FIXME: remove support for legacy solve behaviour
-        elif uri == HopsBase.SOLVE_ROUTE:
-            data = json.loads(payload)
-            comp_uri = data["pointer"]
+        if uri in (HopsBase.SOLVE_ROUTE, HopsBase.JOBS_ROUTE):
+            if request_type == wire.JSON:
+                comp_uri = json.loads(payload)["pointer"]
+            else:
+                comp_uri = wire.pointer(payload, request_type)
             if not comp_uri.startswith(HopsBase.ROOT_ROUTE):
                 comp_uri = HopsBase.ROOT_ROUTE + comp_uri
             for comp in self._components.values():
                 if comp_uri == comp.uri:
-                    hlogger.info("Solving using legacy API: %s", comp)
-                    return self._process_solve_request(comp, payload)
+                    hlogger.debug("Solving using legacy API: %s", comp)
+                    return comp
 
         # FIXME: test this new api
         else:
             comp = self._components.get(uri, None)
             if comp:
-                hlogger.info("Solving: %s", comp)
-                return self._process_solve_request(comp, payload)
-        return False, self._return_with_err("Unknown Hops component url")
+                hlogger.debug("Solving: %s", comp)
+                return comp
+        return None
+
+    def wants_job(self, uri, prefer=None):
+        """Whether a POST to uri should be queued as an async job
+
+        That is POST /jobs, or POST /solve with a Prefer: respond-async
+        header, when jobs are enabled.
+        """
+        if self.jobs is None:
+            return False
+        if uri == HopsBase.JOBS_ROUTE:
+            return True
+        return uri == HopsBase.SOLVE_ROUTE and "respond-async" in (
+            prefer or ""
+        )
+
+    def submit_job(self, uri, payload, formats=JSON_FORMATS):
+        """Queue a solve as an async job
+
+        Answers 202 with the job status and its url in Location. Solves
+        with the same inputs as a queued or running job attach to it.
+        Jobs take json payloads only. Raises SolveRejected when the job
+        queue is full. Returns status code, reason, headers and body.
+        """
+        if formats != JSON_FORMATS:
+            return (
+                415,
+                "Unsupported Media Type",
+                {},
+                self._return_with_err("Async jobs take json payloads"),
+            )
+        comp = self._component_for(uri, payload)
+        if comp is None:
+            return (
+                404,
+                "Unknown URI",
+                {},
+                self._return_with_err("Unknown Hops component url"),
+            )
+        key = SolveCache.key(comp.uri, comp.version, payload)
+        job, attached = self.jobs.submit(
+            key, comp.uri, partial(self._run_job, comp, payload), comp.cache
+        )
+        hlogger.info(
+            "%s job %s: %s",
+            "Attached to" if attached else "Queued",
+            job.id,
+            comp,
+        )
+        _, position = self.jobs.get(job.id)
+        return (
+            202,
+            "Accepted",
+            {"Location": f"{HopsBase.JOBS_ROUTE}/{job.id}"},
+            json.dumps(job.status(position)),
+        )
+
+    def job_request(self, method, uri):
+        """Serve GET|DELETE /jobs/<id> and GET /jobs/<id>/result
+
+        The status route reports state, progress and queue position. The
+        result route answers 202 with the status until the job finished,
+        then the solve result. DELETE cancels the job. Returns status
+        code, reason, headers and body.
+        """
+        parts = uri[len(HopsBase.JOBS_ROUTE) + 1 :].split("/")
+        job_id = parts[0]
+        result = parts[1:] == ["result"]
+        if not job_id or (len(parts) > 1 and not result):
+            return 404, "Unknown URI", {}, self._return_with_err("Unknown job")
+        if method == "GET":
+            job, position = self.jobs.get(job_id)
+        elif method == "DELETE" and not result:
+            job, position = self.jobs.cancel(job_id), None
+        else:
+            return 405, "Method Not Allowed", {}, ""
+        if job is None:
+            return 404, "Unknown Job", {}, self._return_with_err("Unknown job")
+
+        if result and job.state not in ACTIVE_STATES:
+            if job.res:
+                return 200, "Success", {}, job.result
+            if job.state == CANCELLED:
+                error = self._return_with_err("Job cancelled")
+            else:
+                error = job.result or self._return_with_err(
+                    job.message or "Job failed"
+                )
+            return 500, "Execution Error", {}, error
+        headers = {"Retry-After": str(HopsBase.RETRY_AFTER)} if result else {}
+        return (
+            202 if result else 200,
+            "Accepted" if result else "Success",
+            headers,
+            json.dumps(job.status(position)),
+        )
+
+    def _run_job(self, comp, payload, job):
+        # body of an async job, cancelling it stops the solve like a
+        # client disconnect would
+        res, results = self._process_solve_request(
+            comp, payload, job.cancel_event.is_set, job=True
+        )
+        if isinstance(results, CachedFile):
+            results = results.read()
+        return res, results
 
     def _return_with_err(self, err_msg, res_dict=None):
         err_res = res_dict
@@ -163,53 +510,109 @@ class HopsBase:
         # return json formatted string of component metadata
         return json.dumps(comp, cls=_HopsEncoder)
 
-    def _prepare_icon(self, resource_path, icon_file_path):
-        # return icon data in base64 for embedding in http results
-        # determine possible icon paths
-        possible_icon_paths = []
-        if op.isabs(icon_file_path):
-            possible_icon_paths.append(icon_file_path)
-        else:
-            process_icon_file_path = op.join(os.getcwd(), icon_file_path)
-            possible_icon_paths.append(process_icon_file_path)
-            if resource_path:
-                sidecar_icon_file_path = op.join(resource_path, icon_file_path)
-                possible_icon_paths.append(sidecar_icon_file_path)
-
-        for icon_path in possible_icon_paths:
-            if op.exists(icon_path):
-                with open(icon_path, "rb") as image_file:
-                    base64_bytes = base64.b64encode(image_file.read())
-                    return base64_bytes.decode("ascii")
-
-        hlogger.error(
-            "Can not find icon file at %s",
-            ", ".join(possible_icon_paths)
+    def _solve_timeout(self, comp):
+        # component timeout wins over the global one, 0 disables it
+        return comp.timeout if comp.timeout is not None else self.timeout
+
+    def _process_solve_request(
+        self, comp, payload, disconnected=None, formats=JSON_FORMATS, job=False
+    ) -> Tuple[bool, str]:
+        # jobs run under the job queue deadline and wait for their slot
+        # without the admission queue bounds
+        timeout = self.jobs.timeout if job else self._solve_timeout(comp)
+        cache_key = None
+        # the cache holds grasshopper json results only
+        if self.cache is not None and comp.cache and formats == JSON_FORMATS:
+            cache_key = self.cache.key(comp.uri, comp.version, payload)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                hlogger.debug("Solve cache hit: %s", comp)
+                return True, cached
+
+        try:
+            # a solve given up on keeps its slot until its handler returns
+            with self.admission.admit(
+                comp.uri, comp.concurrency, blocking=job
+            ):
+                res, results = self._run_solve_request(
+                    comp, payload, timeout, disconnected, formats
+                )
+        except (execution.SolveTimeout, execution.SolveCancelled) as ex:
+            hlogger.warning("%s: %s", comp, ex)
+            return False, self._return_with_err(str(ex))
+        if res and cache_key is not None:
+            self.cache.put(cache_key, results)
+        return res, results
+
+    def _run_solve_request(
+        self,
+        comp,
+        payload,
+        timeout=None,
+        disconnected=None,
+        formats=JSON_FORMATS,
+    ) -> Tuple[bool, str]:
+        if comp.process:
+            # run the whole request in a child process that can be
+            # terminated, inputs and outputs cross it serialized
+            return execution.run_in_process(
+                _solve_in_process,
+                (comp, payload, formats),
+                timeout,
+                disconnected,
+            )
+        return self._solve_request(
+            comp, payload, timeout, disconnected, formats
         )
 
-    def _process_solve_request(self, comp, payload) -> Tuple[bool, str]:
+    def _solve_request(
+        self,
+        comp,
+        payload,
+        timeout=None,
+        disconnected=None,
+        formats=JSON_FORMATS,
+    ) -> Tuple[bool, str]:
+        # geometry backend is loaded on first solve
+        from ghhops_server import params
+
+        params._ensure_init()
+
         # parse payload for inputs
-        res, inputs = self._prepare_inputs(comp, payload)
+        started = time.perf_counter()
+        res, inputs = self._prepare_inputs(comp, payload, formats[0])
         if not res:
-            hlogger.debug("Bad inputs: %s", inputs)
+            hlogger.debug("Bad inputs: %s", truncated(inputs))
             return res, self._return_with_err("Bad inputs")
 
         # run
         try:
-            solve_returned = self._solve(comp, inputs)
-            hlogger.debug("Return data: %s", solve_returned)
-            res, outputs = self._prepare_outputs(comp, solve_returned)
+            parsed = time.perf_counter()
+            solve_returned = execution.run_in_thread(
+                self._solve, (comp, inputs), timeout, disconnected
+            )
+            solved = time.perf_counter()
+            hlogger.debug("Return data: %s", truncated(solve_returned))
+            res, outputs = self._prepare_outputs(
+                comp, solve_returned, formats[1]
+            )
+            if res and hlogger.isEnabledFor(logging.INFO):
+                _log_solve(comp, payload, outputs, started, parsed, solved)
             return (
                 res,
                 outputs if res else self._return_with_err("Bad outputs"),
             )
+        except (execution.SolveTimeout, execution.SolveCancelled):
+            raise
         except Exception as solve_ex:
             # try to grab traceback data and create err msg
             _, _, exc_traceback = sys.exc_info()
             try:
-                fmt_tb = traceback.format_tb(exc_traceback)
-                # FIXME: can we safely assume we are only 2 levels in stack?
-                ex_msg = "\n".join(fmt_tb[2:])
+                # skip the hops frames leading into the handler
+                frames = traceback.extract_tb(exc_traceback)
+                while frames and frames[0].filename.startswith(_PACKAGE_DIR):
+                    frames.pop(0)
+                ex_msg = "\n".join(traceback.format_list(frames))
                 ex_msg = str(solve_ex) + f"\n{ex_msg}"
             except Exception:
                 # otherwise use exception str as msg
@@ -220,9 +623,15 @@ class HopsBase:
                 "Exception occured in handler:\n%s" % ex_msg
             )
 
-    def _prepare_inputs(self, comp, payload) -> Tuple[bool, list]:
-        # parse input payload
-        data = json.loads(payload)
+    def _prepare_inputs(
+        self, comp, payload, request_type=wire.JSON
+    ) -> Tuple[bool, list]:
+        # parse input payload. binary formats have the same structure, with
+        # packed branches the input params decode as well
+        if request_type == wire.JSON:
+            data = json.loads(payload)
+        else:
+            data = wire.loads(payload, request_type)
 
         # grab input param data and value items
         # FIXME: this works on a single branch only? ["0"][0]
@@ -252,15 +661,23 @@ class HopsBase:
     def _solve(self, comp, inputs):
         return comp.handler(*inputs)
 
-    def _prepare_outputs(self, comp, returns) -> Tuple[bool, str]:
+    def _prepare_outputs(
+        self, comp, returns, response_type=wire.JSON
+    ) -> Tuple[bool, str]:
         outputs = []
         if not isinstance(returns, tuple):
             returns = (returns,)
+        packed = response_type != wire.JSON
         for out_param, out_result in zip(comp.outputs, returns):
-            output_data = out_param.from_result(out_result)
+            if packed:
+                output_data = out_param.from_result(out_result, packed=True)
+            else:
+                output_data = out_param.from_result(out_result)
             outputs.append(output_data)
         payload = {"values": outputs}
-        hlogger.debug("Return payload: %s", payload)
+        hlogger.debug("Return payload: %s", truncated(payload))
+        if packed:
+            return True, wire.dumps(payload, response_type)
         return True, json.dumps(payload, cls=_HopsEncoder)
 
     def component(
@@ -274,17 +691,27 @@ class HopsBase:
         icon=None,
         inputs=None,
         outputs=None,
+        timeout=None,
+        process=False,
+        concurrency=None,
+        version=None,
+        cache=True,
     ):
-        """Decorator for Hops middleware"""
+        """Decorator for Hops middleware
+
+        timeout overrides the server wide solve deadline (seconds, 0 for
+        none). With process=True each solve runs in a child process that
+        is terminated when it runs over its deadline. concurrency caps the
+        number of solves of this component running at once. Results are
+        kept in the server solve cache under version unless cache=False,
+        e.g. for handlers that are not deterministic.
+        """
 
         def __func_wrapper__(comp_func):
             # determine path of the caller file
             # this is used for resource resolution
-            frame = inspect.stack()[1]
-            module = inspect.getmodule(frame[0])
-            resource_path = None
-            if module and module.__file__:
-                resource_path = op.dirname(module.__file__)
+            caller_file = sys._getframe(1).f_globals.get("__file__")
+            resource_path = op.dirname(caller_file) if caller_file else None
 
             # register python func as Hops component
             if inputs:
@@ -306,10 +733,10 @@ class HopsBase:
             # determine name, and uri
             comp_name = name or comp_func.__qualname__
             uri = rule or f"/{comp_name}"
-            # grab icon data
+            # icon data is read on the first metadata request
             icon_data = None
             if icon:
-                icon_data = self._prepare_icon(resource_path, icon)
+                icon_data = partial(_prepare_icon, resource_path, icon)
             # create component instance
             comp = HopsComponent(
                 uri=uri,
@@ -322,6 +749,11 @@ class HopsBase:
                 inputs=inputs or [],
                 outputs=outputs or [],
                 handler=comp_func,
+                timeout=timeout,
+                process=process,
+                concurrency=concurrency,
+                version=version,
+                cache=cache,
             )
             hlogger.debug("Component registered: %s", comp)
             # register by uri and solve uri, for fast lookup on query and solve
@@ -332,6 +764,65 @@ class HopsBase:
         return __func_wrapper__
 
 
+def _prepare_icon(resource_path, icon_file_path):
+    # return icon data in base64 for embedding in http results
+    # determine possible icon paths
+    possible_icon_paths = []
+    if op.isabs(icon_file_path):
+        possible_icon_paths.append(icon_file_path)
+    else:
+        process_icon_file_path = op.join(os.getcwd(), icon_file_path)
+        possible_icon_paths.append(process_icon_file_path)
+        if resource_path:
+            sidecar_icon_file_path = op.join(resource_path, icon_file_path)
+            possible_icon_paths.append(sidecar_icon_file_path)
+
+    for icon_path in possible_icon_paths:
+        if op.exists(icon_path):
+            with open(icon_path, "rb") as image_file:
+                base64_bytes = base64.b64encode(image_file.read())
+                return base64_bytes.decode("ascii")
+
+    hlogger.error(
+        "Can not find icon file at %s", ", ".join(possible_icon_paths)
+    )
+
+
+def _log_solve(comp, payload, outputs, started, parsed, solved):
+    # one structured record per solve, fields are kept on record.hops
+    finished = time.perf_counter()
+    fields = {
+        "component": comp.uri,
+        "inputs_ms": (parsed - started) * 1000,
+        "solve_ms": (solved - parsed) * 1000,
+        "outputs_ms": (finished - solved) * 1000,
+        "total_ms": (finished - started) * 1000,
+        "request_bytes": len(payload),
+        "response_bytes": len(outputs),
+    }
+    hlogger.info(
+        "Solved %s in %.1f ms (inputs %.1f, solve %.1f, outputs %.1f ms), "
+        "%d bytes in, %d bytes out",
+        comp.uri,
+        fields["total_ms"],
+        fields["inputs_ms"],
+        fields["solve_ms"],
+        fields["outputs_ms"],
+        fields["request_bytes"],
+        fields["response_bytes"],
+        extra={"hops": fields},
+    )
+
+
+def _solve_in_process(comp, payload, formats=JSON_FORMATS):
+    # entry point of process backed solves
+    from ghhops_server import params
+
+    if params.RHINO_GEOM is None:
+        params._defer_init(params._init_rhino3dm)
+    return HopsBase(None)._solve_request(comp, payload, formats=formats)
+
+
 class _HopsEncoder(json.JSONEncoder):
     """Custom json encoder to properly encode RhinoCommon and Hops types"""
 
@@ -0,0 +1,195 @@
+"""Disk backed cache of Hops solve results"""
+import hashlib
+import json
+import os
+import os.path as op
+import threading
+import time
+
+from ghhops_server.logger import hlogger
+
+# total size of cached results before least recently used ones are evicted
+DEFAULT_MAX_BYTES = 1 << 30
+# results larger than this are kept as files next to the database and
+# streamed from disk, smaller ones are stored inline in sqlite
+INLINE_MAX_BYTES = 64 << 10
+# seconds to wait on a database locked by another process
+BUSY_TIMEOUT = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    data BLOB
+)
+"""
+
+
+def canonical_input_hash(payload):
+    """Hash of a solve payload that ignores key and input order
+
+    The pointer is left out as it only names the component, which is
+    already part of the cache key.
+    """
+    data = json.loads(payload)
+    data.pop("pointer", None)
+    values = data.get("values")
+    if isinstance(values, list):
+        data["values"] = sorted(values, key=lambda v: v.get("ParamName", ""))
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf_8")).hexdigest()
+
+
+class CachedFile:
+    """Open cached result file to be streamed back to the client"""
+
+    def __init__(self, file, size):
+        self.file = file
+        self.size = size
+
+    def read(self):
+        with self.file:
+            return self.file.read().decode("utf_8")
+
+
+class SolveCache:
+    """Solve results on disk, shared by all workers using the same root
+
+    Entries are keyed by component uri, component version and the
+    canonical input hash. Index and small results live in a sqlite
+    database in WAL mode, large results in files written atomically
+    next to it, so concurrent processes can read and write safely.
+    The cache is bounded to max_bytes by evicting the least recently
+    used entries.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        os.makedirs(op.join(root, "blobs"), exist_ok=True)
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+
+    def _connect(self):
+        # one connection per thread and process
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            import sqlite3
+
+            db = sqlite3.connect(
+                op.join(self.root, "cache.sqlite"),
+                timeout=BUSY_TIMEOUT,
+                isolation_level=None,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _blob_path(self, key):
+        return op.join(self.root, "blobs", key + ".json")
+
+    @staticmethod
+    def key(uri, version, payload):
+        """Cache key of a solve of component uri at version with payload"""
+        ident = f"{uri}\0{version or ''}\0{canonical_input_hash(payload)}"
+        return hashlib.sha256(ident.encode("utf_8")).hexdigest()
+
+    def get(self, key):
+        """Cached result as str, CachedFile for large results, or None"""
+        db = self._connect()
+        row = db.execute(
+            "SELECT data FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        result = None
+        if row is not None:
+            if row[0] is not None:
+                result = row[0].decode("utf_8")
+            else:
+                try:
+                    path = self._blob_path(key)
+                    result = CachedFile(open(path, "rb"), op.getsize(path))
+                except OSError:
+                    # evicted by another worker in between
+                    result = None
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        db.execute(
+            "UPDATE results SET accessed = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        return result
+
+    def put(self, key, result):
+        """Store a successful solve result and evict down to max_bytes"""
+        data = result.encode("utf_8")
+        inline = len(data) <= INLINE_MAX_BYTES
+        if not inline:
+            path = self._blob_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as blob:
+                blob.write(data)
+            os.replace(tmp_path, path)
+
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, len(data), time.time(), data if inline else None),
+            )
+            evicted = self._evict(db)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        for old_key in evicted:
+            try:
+                os.remove(self._blob_path(old_key))
+            except OSError:
+                pass
+
+    def _evict(self, db):
+        # drop least recently used entries until under max_bytes,
+        # returns keys of evicted entries stored as files
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results")
+        excess = total.fetchone()[0] - self.max_bytes
+        evicted = []
+        if excess <= 0:
+            return evicted
+        rows = db.execute(
+            "SELECT key, size, data IS NULL FROM results ORDER BY accessed"
+        )
+        count = 0
+        for key, size, is_file in rows.fetchall():
+            if excess <= 0:
+                break
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+            excess -= size
+            count += 1
+            if is_file:
+                evicted.append(key)
+        hlogger.debug("Evicted %d cached solve results", count)
+        return evicted
+
+    def stats(self):
+        """Entry count, size on disk and hit counters of this process"""
+        entries, size = (
+            self._connect()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results")
+            .fetchone()
+        )
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,518 @@
+"""Client for calling Hops components from python scripts
+
+HopsClient reads the metadata of a component from its GET route, served
+by HopsBase.query, and builds its input and output params with the same
+classes the server uses. Payloads are therefore encoded exactly as the
+server decodes them, in json or one of the binary wire formats.
+
+    with HopsClient("http://localhost:5000", connections=8) as client:
+        lsystem = client.component("/lsystem3d")
+        points, curves, mesh = lsystem(N=5, A=0.4)
+        for points, curves, mesh in lsystem.map({"N": n} for n in range(8)):
+            ...
+
+Solves go through a pool of keep-alive connections, each with one
+request in flight. Requests are not pipelined on a connection, since the
+builtin and werkzeug servers answer them one at a time. Instead payloads
+are encoded in the calling thread while the connections are busy, and up
+to max_pending solves are queued ahead of them. Once that many are in
+flight submit blocks, and solves the server rejects with 503 are retried
+after its Retry-After, so a sweep runs at the pace of the server.
+"""
+import http.client
+import inspect
+import json
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ghhops_server import compression
+from ghhops_server import params
+from ghhops_server import wire
+from ghhops_server.admission import SolveRejected
+from ghhops_server.base import HopsBase
+
+DEFAULT_CONNECTIONS = 8
+# times a solve rejected with 503 is retried before giving up
+DEFAULT_RETRIES = 10
+# seconds to wait for a server that rejects or defers without Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+
+# errors of a request on a kept-alive connection the server has closed
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+_MISSING = object()
+
+
+class HopsError(Exception):
+    """Error response of a Hops server"""
+
+    def __init__(self, message, status=None):
+        super(HopsError, self).__init__(message)
+        self.status = status
+
+
+# param classes by the ParamType of their metadata
+_PARAM_CLASSES = {
+    getattr(params, name).param_type: getattr(params, name)
+    for name in params.__all__
+    if getattr(getattr(params, name), "param_type", None)
+}
+
+
+def _param(metadata):
+    # param of metadata encoded by _GHParam.encode
+    param_class = _PARAM_CLASSES.get(metadata["ParamType"])
+    if param_class is None:
+        raise ValueError(f"Unsupported param type {metadata['ParamType']}")
+    if metadata.get("AtMost") == 1:
+        access = params.HopsParamAccess.ITEM
+    elif metadata.get("AtLeast") == -1:
+        access = params.HopsParamAccess.TREE
+    else:
+        access = params.HopsParamAccess.LIST
+    param = param_class(
+        metadata["Name"],
+        metadata.get("Nickname"),
+        metadata.get("Description"),
+        access,
+    )
+    if "Default" in metadata:
+        param.default = metadata["Default"]
+    return param
+
+
+def _output_branch(param, branch):
+    # decoded output branch. geometry skips the input geometry cache,
+    # results are rarely seen twice
+    if isinstance(branch, dict):
+        items = branch.get("items")
+        if items and params._coercer(type(param), branch["type"]) is True:
+            return [params._geometry_from_packed(item) for item in items]
+    elif branch and all(
+        params._coercer(type(param), item["type"]) is True for item in branch
+    ):
+        return [params.RHINO_FROMJSON(json.loads(i["data"])) for i in branch]
+    return param._coerce_branch(branch)
+
+
+def _output(param, data):
+    # value of an output, branches of more than one item come back as
+    # lists whatever the access, since handlers often return lists to
+    # item outputs
+    if data is None:
+        return None
+    tree = {
+        path: _output_branch(param, branch)
+        for path, branch in data["InnerTree"].items()
+    }
+    if param.access == params.HopsParamAccess.TREE:
+        return tree
+    items = tree.get("0", [])
+    if param.access == params.HopsParamAccess.ITEM and len(items) == 1:
+        return items[0]
+    return items
+
+
+def _error(data):
+    # message of a Hops error response
+    try:
+        errors = json.loads(data).get("errors")
+    except (ValueError, AttributeError):
+        errors = None
+    if errors:
+        return "\n".join(errors)
+    return bytes(data[:200]).decode("utf_8", "replace")
+
+
+def _retry_after(headers):
+    try:
+        return max(float(headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def _outcome(future, return_exceptions):
+    if return_exceptions:
+        exception = future.exception()
+        if exception is not None:
+            return exception
+    return future.result()
+
+
+class RemoteComponent:
+    """Component of a Hops server, called like its handler
+
+    Inputs are passed by position, by name or by nickname, missing ones
+    take the default of their param. Calls return the outputs like the
+    handler did, one value or a tuple of them.
+    """
+
+    def __init__(self, client, metadata):
+        self.client = client
+        self.metadata = metadata
+        self.uri = metadata["Uri"]
+        self.name = metadata.get("Name")
+        self.inputs = [_param(m) for m in metadata["Inputs"]]
+        self.outputs = [_param(m) for m in metadata["Outputs"]]
+        # names win over nicknames that happen to match another name
+        self._indices = {}
+        for index, param in reversed(list(enumerate(self.inputs))):
+            if param.nickname:
+                self._indices[param.nickname] = index
+        for index, param in enumerate(self.inputs):
+            self._indices[param.name] = index
+
+    def __repr__(self):
+        inputs_repr = ",".join([x.name for x in self.inputs])
+        outputs_repr = ",".join([x.name for x in self.outputs])
+        return (
+            f"<{self.__class__.__name__} "
+            f"{self.uri} "
+            f"[{inputs_repr} -> {self.name} -> {outputs_repr}] >"
+        )
+
+    def bind(self, args, kwargs):
+        """Input values of a call in the order of the inputs"""
+        if len(args) > len(self.inputs):
+            raise TypeError(
+                f"{self.uri} takes {len(self.inputs)} inputs, "
+                f"{len(args)} given"
+            )
+        values = list(args) + [_MISSING] * (len(self.inputs) - len(args))
+        for name, value in kwargs.items():
+            index = self._indices.get(name)
+            if index is None:
+                raise TypeError(f"{self.uri} has no input {name!r}")
+            if values[index] is not _MISSING:
+                raise TypeError(f"Multiple values for input {name!r}")
+            values[index] = value
+        for index, param in enumerate(self.inputs):
+            if values[index] is _MISSING:
+                if param.default is inspect.Parameter.empty:
+                    raise TypeError(f"Missing value for input {param.name}")
+                values[index] = param.default
+        return values
+
+    def payload(self, values, media_type=wire.JSON):
+        """Solve request body of bound input values"""
+        packed = media_type != wire.JSON
+        data = {
+            "pointer": self.uri,
+            "values": [
+                param.from_result(value, packed=packed)
+                for param, value in zip(self.inputs, values)
+            ],
+        }
+        if packed:
+            return wire.dumps(data, media_type)
+        return json.dumps(data).encode("utf_8")
+
+    def results(self, body, media_type=wire.JSON):
+        """Outputs of a solve response body, like the handler returned"""
+        if media_type == wire.JSON:
+            data = json.loads(body)
+        else:
+            data = wire.loads(body, media_type)
+        values = {item["ParamName"]: item for item in data["values"]}
+        # outputs the handler did not return are None
+        outputs = tuple(
+            _output(param, values.get(param.name)) for param in self.outputs
+        )
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def __call__(self, *args, **kwargs):
+        """Solve and wait for the outputs"""
+        media_type = self.client.media_type
+        body = self.payload(self.bind(args, kwargs), media_type)
+        return self.client._solve(self, body, media_type)
+
+    def submit(self, *args, **kwargs):
+        """Solve in the background, returns a Future of the outputs
+
+        Blocks while max_pending solves of the client are in flight.
+        """
+        media_type = self.client.media_type
+        body = self.payload(self.bind(args, kwargs), media_type)
+        return self.client._submit(self, body, media_type)
+
+    def map(self, inputs, return_exceptions=False):
+        """Solve each item of inputs, yields their outputs in order
+
+        Items are dicts of input values by name or sequences of them by
+        position. inputs is read lazily and at most max_pending solves are
+        in flight, so sweeps of any length run in constant memory. Failed
+        solves raise, or are yielded as their exception with
+        return_exceptions.
+        """
+        window = deque()
+        max_pending = self.client.max_pending
+        try:
+            for item in inputs:
+                try:
+                    if isinstance(item, dict):
+                        future = self.submit(**item)
+                    else:
+                        future = self.submit(*item)
+                except Exception as ex:
+                    if not return_exceptions:
+                        raise
+                    future = Future()
+                    future.set_exception(ex)
+                window.append(future)
+                while window and (
+                    window[0].done() or len(window) >= max_pending
+                ):
+                    yield _outcome(window.popleft(), return_exceptions)
+            while window:
+                yield _outcome(window.popleft(), return_exceptions)
+        finally:
+            for future in window:
+                future.cancel()
+
+    def submit_job(self, *args, **kwargs):
+        """Queue the solve as an async job, see HopsBase.submit_job
+
+        Jobs take json payloads. Returns a RemoteJob.
+        """
+        body = self.payload(self.bind(args, kwargs))
+        status, _, data = self.client._post(
+            HopsBase.JOBS_ROUTE, body, {"Content-Type": wire.JSON}
+        )
+        if status != 202:
+            raise HopsError(_error(data), status)
+        return RemoteJob(self, json.loads(data))
+
+
+class RemoteJob:
+    """Async job of a Hops server, see HopsBase.job_request"""
+
+    def __init__(self, component, status):
+        self.component = component
+        self.id = status["Id"]
+        self.last_status = status
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} {self.id} "
+            f"{self.component.uri} {self.last_status['State']}>"
+        )
+
+    @property
+    def uri(self):
+        return f"{HopsBase.JOBS_ROUTE}/{self.id}"
+
+    def status(self):
+        """State, progress and queue position of the job"""
+        return self._status("GET")
+
+    def cancel(self):
+        """Cancel the job, returns its status"""
+        return self._status("DELETE")
+
+    def _status(self, method):
+        status, _, data = self.component.client.request(method, self.uri)
+        if status != 200:
+            raise HopsError(_error(data), status)
+        self.last_status = json.loads(data)
+        return self.last_status
+
+    def result(self, timeout=None):
+        """Wait for the job to finish and return its outputs
+
+        Polls the result route as often as its Retry-After asks. Raises
+        TimeoutError when the job is still running after timeout seconds.
+        """
+        client = self.component.client
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status, headers, data = client.request("GET", self.uri + "/result")
+            if status == 200:
+                return self.component.results(data)
+            if status != 202:
+                raise HopsError(_error(data), status)
+            self.last_status = json.loads(data)
+            wait = _retry_after(headers)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Job {self.id} did not finish")
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class HopsClient:
+    """Pooled client of a Hops server
+
+    url is the root of the server (or of its Hops routes). connections is
+    the size of the keep-alive connection pool and of the thread pool
+    running background solves, max_pending the number of solves submit
+    queues ahead of them (twice connections by default). Solves use
+    media_type, the json or binary wire format, and are retried up to
+    retries times while the server answers 503. compress asks the server
+    to compress responses, which only pays off over slow networks.
+    """
+
+    def __init__(
+        self,
+        url="http://localhost:5000",
+        connections=DEFAULT_CONNECTIONS,
+        max_pending=None,
+        timeout=None,
+        media_type=wire.FRAME,
+        retries=DEFAULT_RETRIES,
+        compress=False,
+    ):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == "https":
+            self._connection_class = http.client.HTTPSConnection
+        elif parts.scheme == "http":
+            self._connection_class = http.client.HTTPConnection
+        else:
+            raise ValueError(f"Unsupported url {url}")
+        self._address = (parts.hostname, parts.port)
+        self._prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.media_type = wire.request_format(media_type)
+        self.max_pending = max_pending or 2 * connections
+        self.retries = retries
+        self._headers = {}
+        if compress:
+            self._headers["Accept-Encoding"] = ", ".join(
+                compression.available_encodings()
+            )
+        self._lock = threading.Lock()
+        self._idle = []
+        self._connections = threading.BoundedSemaphore(connections)
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._executor = ThreadPoolExecutor(
+            connections, thread_name_prefix="hops-client"
+        )
+        self._components = {}
+        # params encode inputs and decode outputs with the same backend
+        # as the server
+        if params.RHINO_GEOM is None:
+            params._defer_init(params._init_rhino3dm)
+        params._ensure_init()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Wait for background solves and close all connections"""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def component(self, uri):
+        """Component served at uri, built from its metadata"""
+        uri = HopsBase.ROOT_ROUTE + uri.lstrip("/")
+        with self._lock:
+            component = self._components.get(uri)
+        if component is not None:
+            return component
+        status, _, data = self.request("GET", uri)
+        if status != 200:
+            raise HopsError(f"Unknown Hops component {uri}", status)
+        metadata = json.loads(data)
+        # uris that are a prefix of others list all of them
+        if isinstance(metadata, list):
+            metadata = next((m for m in metadata if m["Uri"] == uri), None)
+            if metadata is None:
+                raise HopsError(f"Unknown Hops component {uri}", status)
+        component = RemoteComponent(self, metadata)
+        with self._lock:
+            self._components[uri] = component
+        return component
+
+    def request(self, method, path, body=None, headers=None):
+        """Status, headers and body of one request on a pooled connection
+
+        Waits for a free connection. Requests on a kept-alive connection
+        the server has closed meanwhile are sent again on a new one.
+        """
+        headers = dict(self._headers, **(headers or {}))
+        with self._connections:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = self._connection_class(
+                    *self._address, timeout=self.timeout
+                )
+            try:
+                while True:
+                    reused = connection.sock is not None
+                    try:
+                        connection.request(
+                            method, self._prefix + path, body, headers
+                        )
+                        response = connection.getresponse()
+                        data = response.read()
+                        break
+                    except _STALE_ERRORS:
+                        connection.close()
+                        if not reused:
+                            raise
+            except BaseException:
+                connection.close()
+                raise
+            finally:
+                # closed connections reconnect on their next request
+                with self._lock:
+                    self._idle.append(connection)
+        try:
+            data = compression.decompress(
+                data, response.getheader("Content-Encoding")
+            )
+        except ValueError as ex:
+            raise HopsError(str(ex), response.status)
+        return response.status, response.headers, data
+
+    def _post(self, path, body, headers):
+        # post, retrying while the server is at capacity
+        for attempt in range(self.retries + 1):
+            status, response_headers, data = self.request(
+                "POST", path, body, headers
+            )
+            if status != 503:
+                break
+            if attempt == self.retries:
+                raise SolveRejected(_error(data))
+            time.sleep(_retry_after(response_headers))
+        return status, response_headers, data
+
+    def _solve(self, component, body, media_type):
+        status, headers, data = self._post(
+            HopsBase.SOLVE_ROUTE,
+            body,
+            {"Content-Type": media_type, "Accept": media_type},
+        )
+        if status != 200:
+            raise HopsError(_error(data), status)
+        # the server may answer in another format than requested
+        response_type = wire.request_format(headers.get("Content-Type"))
+        return component.results(data, response_type)
+
+    def _submit(self, component, body, media_type):
+        # backpressure for callers submitting faster than solves finish
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(
+                self._solve, component, body, media_type
+            )
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
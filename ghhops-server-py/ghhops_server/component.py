@@ -1,3 +1,57 @@
+"""Hops component"""
+import hashlib
+import inspect
+import sys
+import types
+
+
+def _canonical(const):
+    # repr that does not depend on the hash seed, frozensets (compiled from
+    # `x in {...}`) list their elements in hash order
+    if isinstance(const, (frozenset, set)):
+        items = sorted(_canonical(item) for item in const)
+        return f"{type(const).__name__}({{{', '.join(items)}}})"
+    if isinstance(const, tuple):
+        return f"({''.join(_canonical(item) + ', ' for item in const)})"
+    return repr(const)
+
+
+def _hash_code(code, digest):
+    # bytecode, names and constants, but not file names or line numbers,
+    # so moving a handler around its module keeps its fingerprint
+    digest.update(code.co_code)
+    digest.update(repr((code.co_names, code.co_varnames)).encode("utf_8"))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, digest)
+        else:
+            digest.update(_canonical(const).encode("utf_8"))
+
+
+def fingerprint(handler, inputs, outputs):
+    """Version fingerprint of a component
+
+    Hash of the handler bytecode (source when there is no bytecode), its
+    default arguments and the input/output param definitions. It changes
+    whenever any of them changes, and stays the same across deploys
+    otherwise.
+    """
+    digest = hashlib.sha256(sys.version.encode("utf_8"))
+    code = getattr(handler, "__code__", None)
+    if code is not None:
+        _hash_code(code, digest)
+        digest.update(_canonical(handler.__defaults__).encode("utf_8"))
+    else:
+        try:
+            digest.update(inspect.getsource(handler).encode("utf_8"))
+        except (OSError, TypeError):
+            digest.update(repr(handler).encode("utf_8"))
+    for param in list(inputs) + list(outputs):
+        param_def = sorted(vars(param).items())
+        digest.update(f"{type(param).__name__}{param_def}".encode("utf_8"))
+    return digest.hexdigest()[:16]
+
+
 class HopsComponent:
     """Hops Component"""
 
@@ -13,6 +67,11 @@ class HopsComponent:
         inputs,
         outputs,
         handler,
+        timeout=None,
+        process=False,
+        concurrency=None,
+        version=None,
+        cache=True,
     ):
         self.uri = uri
         # TODO: customize solve uri?
@@ -22,10 +81,33 @@ class HopsComponent:
         self.description = desc
         self.category = cat
         self.subcategory = subcat
-        self.icon = icon
+        # icon data, or a callable loading it on first use
+        self._icon = icon
         self.inputs = inputs or []
         self.outputs = outputs or []
         self.handler = handler
+        self.timeout = timeout
+        self.process = process
+        self.concurrency = concurrency
+        # user version (if any) plus fingerprint, part of every cache key
+        self.fingerprint = fingerprint(handler, self.inputs, self.outputs)
+        self.version = (
+            f"{version}+{self.fingerprint}" if version else self.fingerprint
+        )
+        self.cache = cache
+
+    def __getstate__(self):
+        # process backed solves pickle the component, the icon is metadata
+        # only and may still be a loader
+        state = self.__dict__.copy()
+        state["_icon"] = None
+        return state
+
+    @property
+    def icon(self):
+        if callable(self._icon):
+            self._icon = self._icon()
+        return self._icon
 
     def __str__(self):
         return repr(self)
@@ -50,6 +132,7 @@ class HopsComponent:
             "Subcategory": self.subcategory,
             "Inputs": self.inputs,
             "Outputs": self.outputs,
+            "Version": self.version,
         }
         if self.icon:
             metadata["Icon"] = self.icon
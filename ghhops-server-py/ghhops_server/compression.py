@@ -0,0 +1,183 @@
+"""Content-Encoding negotiation and streaming compression"""
+import zlib
+
+# optional encoders, used when installed
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# responses smaller than this many bytes are sent as is
+DEFAULT_MIN_SIZE = 1024
+# size of the pieces fed to the compressor
+CHUNK_SIZE = 64 << 10
+# largest decoded request body, a few kilobytes of gzip can expand to
+# gigabytes
+DEFAULT_MAX_BODY_SIZE = 256 << 20
+
+# default level and valid range of each encoding, best first. Meshes are
+# base64 encoded and compress poorly, so defaults favour speed over ratio
+_LEVELS = {
+    "zstd": (3, 1, 22),
+    "br": (4, 0, 11),
+    "gzip": (1, 1, 9),
+}
+
+
+class BodyTooLarge(ValueError):
+    """Decoded request body exceeds the allowed size"""
+
+
+def available_encodings():
+    """Encodings this server can produce, best first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate(accept_encoding):
+    """Pick the best available encoding allowed by an Accept-Encoding"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in available_encodings():
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def _compressor(encoding, level):
+    default, low, high = _LEVELS[encoding]
+    level = default if level is None else max(low, min(high, level))
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        return compressor.compress, compressor.flush
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def iter_text(text):
+    """utf-8 bytes of text, a chunk at a time"""
+    for start in range(0, len(text), CHUNK_SIZE):
+        yield text[start : start + CHUNK_SIZE].encode("utf_8")
+
+
+def iter_bytes(data):
+    """data, a chunk at a time"""
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield data[start : start + CHUNK_SIZE]
+
+
+def iter_file(file):
+    """Contents of a binary file, a chunk at a time, closing it at the end"""
+    with file:
+        chunk = file.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = file.read(CHUNK_SIZE)
+
+
+def compress(chunks, encoding, level=None):
+    """Compress an iterable of byte chunks, yielding compressed chunks"""
+    feed, flush = _compressor(encoding, level)
+    for chunk in chunks:
+        out = feed(chunk)
+        if out:
+            yield out
+    yield flush()
+
+
+def _inflate(data, wbits):
+    decoder = zlib.decompressobj(wbits)
+    while not decoder.eof:
+        chunk = decoder.decompress(data, CHUNK_SIZE)
+        data = decoder.unconsumed_tail
+        if not chunk and not data:
+            break
+        yield chunk
+    if not decoder.eof:
+        raise ValueError("Truncated stream")
+
+
+def _unzstd(data):
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        chunk = reader.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = reader.read(CHUNK_SIZE)
+
+
+def _unbrotli(data):
+    decoder = brotli.Decompressor()
+    chunk = decoder.process(data, output_buffer_limit=CHUNK_SIZE)
+    # input past the limit is kept by the decoder, drained with empty feeds
+    while chunk:
+        yield chunk
+        if decoder.is_finished():
+            break
+        chunk = decoder.process(b"", output_buffer_limit=CHUNK_SIZE)
+    if not decoder.is_finished():
+        raise ValueError("Truncated stream")
+
+
+def _decoder(encoding):
+    # decoders yield the decoded body a chunk at a time
+    if encoding in ("gzip", "x-gzip"):
+        return lambda data: _inflate(data, 47)
+    if encoding == "deflate":
+        return lambda data: _inflate(data, zlib.MAX_WBITS)
+    if encoding == "zstd" and zstandard is not None:
+        return _unzstd
+    if encoding == "br" and brotli is not None:
+        return _unbrotli
+    raise ValueError(f"Unsupported Content-Encoding {encoding}")
+
+
+def decompress(data, encoding, max_size=None):
+    """Decode a request body sent with Content-Encoding
+
+    The body is decoded a chunk at a time and given up on once it grows
+    past max_size bytes, raising BodyTooLarge. Raises ValueError for
+    unsupported encodings and corrupt bodies.
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return data
+    decoder = _decoder(encoding)
+    chunks = []
+    size = 0
+    try:
+        for chunk in decoder(data):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise BodyTooLarge(
+                    f"Decoded request body exceeds {max_size} bytes"
+                )
+            chunks.append(chunk)
+    except BodyTooLarge:
+        raise
+    except Exception as ex:
+        raise ValueError(f"Invalid {encoding} request body: {ex}")
+    return b"".join(chunks)
@@ -0,0 +1,305 @@
+"""Quadric edge-collapse decimation for Hops mesh outputs"""
+
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from ghhops_server.logger import hlogger
+
+# quadric weight of the planes that pin open mesh boundaries in place
+BOUNDARY_WEIGHT = 1000.0
+# rounds of edge selection per collapse pass
+MATCHING_ROUNDS = 8
+
+# error is the largest quadric error of an applied collapse, roughly the
+# squared distance (area weighted) a vertex moved off its original planes
+DecimationReport = namedtuple(
+    "DecimationReport",
+    ["faces_in", "faces_out", "ratio", "error", "seconds"],
+)
+
+
+def _plane_quadrics(normals, points, weights):
+    # fundamental error quadric K = p * p^T of plane p = (n, -n.p0)
+    planes = np.empty((len(normals), 4))
+    planes[:, :3] = normals
+    planes[:, 3] = -np.einsum("ij,ij->i", normals, points)
+    return planes[:, :, None] * planes[:, None, :] * weights[:, None, None]
+
+
+def _accumulate(quadrics, vertex_count, indices, per_item):
+    # sum per-item quadrics onto vertices, one bincount per matrix entry
+    flat = per_item.reshape(len(per_item), 16)
+    for column in range(16):
+        quadrics[:, column] += np.bincount(
+            indices, weights=flat[:, column], minlength=vertex_count
+        )
+
+
+def _face_normals(vertices, faces):
+    p0 = vertices[faces[:, 0]]
+    return np.cross(vertices[faces[:, 1]] - p0, vertices[faces[:, 2]] - p0)
+
+
+def _vertex_quadrics(vertices, faces):
+    vertex_count = len(vertices)
+    quadrics = np.zeros((vertex_count, 16))
+
+    # area weighted planes of all faces
+    normals = _face_normals(vertices, faces)
+    areas = np.linalg.norm(normals, axis=1)
+    unit = np.divide(
+        normals,
+        areas[:, None],
+        out=np.zeros_like(normals),
+        where=areas[:, None] > 0,
+    )
+    face_quadrics = _plane_quadrics(unit, vertices[faces[:, 0]], areas / 2)
+    _accumulate(
+        quadrics,
+        vertex_count,
+        faces.ravel(),
+        np.repeat(face_quadrics, 3, axis=0),
+    )
+
+    # boundary edges (used by a single face) get a heavily weighted plane
+    # perpendicular to their face so open borders do not shrink
+    half_edges = np.concatenate(
+        [faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]
+    )
+    owner = np.tile(np.arange(len(faces)), 3)
+    keys = np.sort(half_edges, axis=1)
+    keys = keys[:, 0] * vertex_count + keys[:, 1]
+    _, inverse, counts = np.unique(
+        keys, return_inverse=True, return_counts=True
+    )
+    boundary = counts[inverse] == 1
+    if boundary.any():
+        a, b = half_edges[boundary].T
+        direction = vertices[b] - vertices[a]
+        side = np.cross(direction, unit[owner[boundary]])
+        lengths = np.linalg.norm(side, axis=1)
+        side = np.divide(
+            side,
+            lengths[:, None],
+            out=np.zeros_like(side),
+            where=lengths[:, None] > 0,
+        )
+        edge_quadrics = _plane_quadrics(
+            side,
+            vertices[a],
+            BOUNDARY_WEIGHT * np.einsum("ij,ij->i", direction, direction),
+        )
+        _accumulate(
+            quadrics,
+            vertex_count,
+            np.concatenate([a, b]),
+            np.concatenate([edge_quadrics, edge_quadrics]),
+        )
+    return quadrics.reshape(vertex_count, 4, 4)
+
+
+def _quadric_error(quadrics, points):
+    homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    return np.einsum("ei,eij,ej->e", homogeneous, quadrics, homogeneous)
+
+
+def _flipped_collapses(vertices, faces, a, b, positions):
+    # indices of the (a, b) -> position collapses that flip a face
+    # surviving the collapse, faces that collapse to a line are ignored
+    moved = vertices.copy()
+    moved[a] = positions
+    moved[b] = positions
+    collapse_of = np.full(len(vertices), -1, dtype=np.int64)
+    collapse_of[a] = np.arange(len(a))
+    collapse_of[b] = np.arange(len(a))
+    corner_collapse = collapse_of[faces]
+    touched = (corner_collapse >= 0).any(axis=1)
+    touched_faces = faces[touched]
+    remap = np.arange(len(vertices))
+    remap[b] = a
+    collapsed = remap[touched_faces]
+    degenerate = (
+        (collapsed[:, 0] == collapsed[:, 1])
+        | (collapsed[:, 1] == collapsed[:, 2])
+        | (collapsed[:, 2] == collapsed[:, 0])
+    )
+    before = _face_normals(vertices, touched_faces)
+    after = _face_normals(moved, touched_faces)
+    flipped = (np.einsum("ij,ij->i", before, after) <= 0) & ~degenerate
+    bad = corner_collapse[touched][flipped]
+    return np.unique(bad[bad >= 0])
+
+
+def decimate(vertices, faces, target_faces):
+    """Reduce triangle count of vertex/face buffers to target_faces
+
+    Each pass collapses a batch of independent edges (no two sharing a
+    vertex), cheapest quadric error first, so the work stays vectorized.
+    Collapses that would flip a neighbouring face are skipped, so the
+    result can stay slightly above the target when no valid collapse is
+    left. Returns new (vertices, faces) buffers with unused vertices
+    removed, and the largest quadric error of the applied collapses.
+    """
+    vertices = np.array(vertices, dtype=np.float64)
+    faces = np.array(faces, dtype=np.int64).reshape(-1, 3)
+    target_faces = max(int(target_faces), 1)
+    vertex_count = len(vertices)
+    quadrics = _vertex_quadrics(vertices, faces)
+    blocked = np.empty(0, dtype=np.int64)
+    error = 0.0
+
+    while len(faces) > target_faces:
+        # unique undirected edges
+        edges = np.sort(
+            np.concatenate(
+                [faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]
+            ),
+            axis=1,
+        )
+        keys = np.unique(edges[:, 0] * vertex_count + edges[:, 1])
+        a, b = keys // vertex_count, keys % vertex_count
+
+        # best collapse target among both endpoints and the midpoint
+        edge_quadrics = quadrics[a] + quadrics[b]
+        candidates = np.stack(
+            [vertices[a], vertices[b], (vertices[a] + vertices[b]) / 2]
+        )
+        errors = np.stack(
+            [_quadric_error(edge_quadrics, c) for c in candidates]
+        )
+        best = errors.argmin(axis=0)
+        cost = errors[best, np.arange(len(keys))]
+        position = candidates[best, np.arange(len(keys))]
+
+        # pick a matching (no two edges share a vertex) in rounds: an edge
+        # is taken when it is the cheapest available edge of both of its
+        # endpoints, then edges touching taken vertices drop out
+        rank = np.empty(len(keys), dtype=np.int64)
+        rank[np.argsort(cost, kind="stable")] = np.arange(len(keys))
+        available = ~np.isin(keys, blocked)
+        used = np.zeros(vertex_count, dtype=bool)
+        rounds = []
+        for _ in range(MATCHING_ROUNDS):
+            candidates_idx = np.flatnonzero(available)
+            vertex_best = np.full(vertex_count, len(keys), dtype=np.int64)
+            np.minimum.at(vertex_best, a[candidates_idx], rank[candidates_idx])
+            np.minimum.at(vertex_best, b[candidates_idx], rank[candidates_idx])
+            taken = candidates_idx[
+                (vertex_best[a[candidates_idx]] == rank[candidates_idx])
+                & (vertex_best[b[candidates_idx]] == rank[candidates_idx])
+            ]
+            if not len(taken):
+                break
+            rounds.append(taken)
+            used[a[taken]] = True
+            used[b[taken]] = True
+            available &= ~(used[a] | used[b])
+        if not rounds:
+            break
+        selected = np.concatenate(rounds)
+        # each interior collapse removes two faces
+        needed = max((len(faces) - target_faces + 1) // 2, 1)
+        selected = selected[np.argsort(rank[selected])][:needed]
+
+        # reject collapses that would flip any surviving face, repeat since
+        # dropping a collapse changes where its neighbours end up
+        while len(selected):
+            flipped_collapses = _flipped_collapses(
+                vertices, faces, a[selected], b[selected], position[selected]
+            )
+            if not len(flipped_collapses):
+                break
+            # do not retry the same collapse in later passes
+            blocked = np.union1d(blocked, keys[selected[flipped_collapses]])
+            selected = np.delete(selected, flipped_collapses)
+        if not len(selected):
+            continue
+
+        # apply collapses: b merges into a at the optimal position
+        a_sel, b_sel = a[selected], b[selected]
+        error = max(error, float(cost[selected].max()))
+        vertices[a_sel] = position[selected]
+        quadrics[a_sel] = edge_quadrics[selected]
+        remap = np.arange(vertex_count)
+        remap[b_sel] = a_sel
+        faces = remap[faces]
+        faces = faces[
+            (faces[:, 0] != faces[:, 1])
+            & (faces[:, 1] != faces[:, 2])
+            & (faces[:, 2] != faces[:, 0])
+        ]
+
+    # drop vertices no longer referenced by any face
+    used = np.unique(faces)
+    reindex = np.zeros(vertex_count, dtype=np.int64)
+    reindex[used] = np.arange(len(used))
+    return vertices[used], reindex[faces], error
+
+
+def mesh_to_buffers(mesh):
+    """Extract (vertices, triangle faces) buffers from a mesh"""
+    vertices = np.array(
+        [(p.X, p.Y, p.Z) for p in mesh.Vertices], dtype=np.float64
+    )
+    faces = []
+    for index in range(mesh.Faces.Count):
+        face = mesh.Faces[index]
+        if not isinstance(face, tuple):
+            # RhinoCommon MeshFace
+            face = (face.A, face.B, face.C, face.D)
+        a, b, c, d = face[:4]
+        faces.append((a, b, c))
+        if c != d:
+            faces.append((a, c, d))
+    return vertices, np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+
+def buffers_to_mesh(mesh_type, vertices, faces):
+    """Build a new mesh_type instance from vertex/face buffers"""
+    mesh = mesh_type()
+    add_vertex = mesh.Vertices.Add
+    for x, y, z in vertices.tolist():
+        add_vertex(x, y, z)
+    add_face = mesh.Faces.AddFace
+    for a, b, c in faces.tolist():
+        add_face(a, b, c)
+    return mesh
+
+
+def _triangle_count(mesh):
+    # faces as triangles, quads count twice
+    return mesh.Faces.TriangleCount + 2 * mesh.Faces.QuadCount
+
+
+def decimate_mesh(mesh, target_faces):
+    """Decimate mesh down to (about) target_faces triangles
+
+    Returns the decimated mesh (or the original when already within
+    budget) and a DecimationReport, for components to pass on to their
+    caller. Vertex normals are recomputed when the source mesh had them.
+    """
+    start = time.perf_counter()
+    faces_in = _triangle_count(mesh)
+    if not target_faces or faces_in <= target_faces:
+        return mesh, DecimationReport(faces_in, faces_in, 1.0, 0.0, 0.0)
+
+    vertices, faces = mesh_to_buffers(mesh)
+    vertices, faces, error = decimate(vertices, faces, target_faces)
+    result = buffers_to_mesh(type(mesh), vertices, faces)
+    if len(mesh.Normals):
+        result.Normals.ComputeNormals()
+    seconds = time.perf_counter() - start
+    report = DecimationReport(
+        faces_in, len(faces), len(faces) / faces_in, error, seconds
+    )
+    hlogger.info(
+        "Decimated mesh %d -> %d faces (%.1f%%, error %.3g) in %.3fs",
+        report.faces_in,
+        report.faces_out,
+        report.ratio * 100,
+        report.error,
+        report.seconds,
+    )
+    return result, report
@@ -0,0 +1,157 @@
+"""Deadlines and cancellation for Hops solves"""
+import contextvars
+import select
+import socket
+import threading
+import time
+import traceback
+
+# seconds between deadline and client disconnect checks while waiting
+POLL_INTERVAL = 0.05
+
+
+class SolveTimeout(Exception):
+    """Solve did not finish before its deadline"""
+
+
+class SolveCancelled(Exception):
+    """Solve was cancelled because the client went away"""
+
+
+_local = threading.local()
+
+
+def cancel_event():
+    """Event that is set when the running solve times out or is cancelled
+
+    Handlers can poll this (or pass it on to long running loops) to stop
+    early, e.g. once the client went away or the async job was deleted.
+    Returns None outside of a solve.
+    """
+    return getattr(_local, "event", None)
+
+
+def _readable(sock):
+    # poll has no limit on fd numbers, select is the fallback for windows
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+
+def socket_disconnected(sock):
+    """Check whether the peer of a connected socket has closed it"""
+    if sock.fileno() < 0:
+        return True
+    try:
+        if not _readable(sock):
+            return False
+        # readable with no data means the peer closed the connection,
+        # pipelined request bytes are left untouched by MSG_PEEK
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except OSError:
+        return True
+
+
+def _wait(is_done, wait, timeout, disconnected):
+    # block until is_done() or raise on deadline/disconnect
+    deadline = time.monotonic() + timeout if timeout else None
+    while not is_done():
+        remaining = POLL_INTERVAL
+        if deadline is not None:
+            remaining = min(remaining, deadline - time.monotonic())
+            if remaining <= 0:
+                raise SolveTimeout(f"Solve timed out after {timeout:g}s")
+        if disconnected is not None and disconnected():
+            raise SolveCancelled("Solve cancelled, client disconnected")
+        wait(remaining)
+
+
+def run_in_thread(func, args, timeout=None, disconnected=None):
+    """Run func(*args) with a deadline and disconnect check
+
+    func runs on a worker thread while the caller watches the deadline
+    (none when timeout is falsy) and disconnected. Python threads can not
+    be killed, so on timeout or cancellation the calling thread returns
+    right away while func keeps running in the background until it checks
+    cancel_event(). The raised SolveTimeout or SolveCancelled carries that
+    thread as its worker attribute.
+    """
+    event = threading.Event()
+    outcome = {}
+
+    def target():
+        _local.event = event
+        try:
+            outcome["result"] = func(*args)
+        except BaseException as ex:
+            outcome["error"] = ex
+
+    # handlers keep the context of the caller, e.g. the running job
+    context = contextvars.copy_context()
+    worker = threading.Thread(
+        target=context.run, args=(target,), name="hops-solve", daemon=True
+    )
+    worker.start()
+    try:
+        _wait(
+            lambda: not worker.is_alive(), worker.join, timeout, disconnected
+        )
+    except (SolveTimeout, SolveCancelled) as ex:
+        event.set()
+        ex.worker = worker
+        raise
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def _process_target(conn, func, args):
+    try:
+        conn.send((True, func(*args)))
+    except BaseException as ex:
+        conn.send((False, "".join(traceback.format_exception(ex))))
+    finally:
+        conn.close()
+
+
+def _context():
+    # fork keeps registered components and initialized rhino3dm,
+    # other platforms fall back to their default start method
+    import multiprocessing
+
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else None)
+
+
+def run_in_process(func, args, timeout=None, disconnected=None):
+    """Run func(*args) in a child process with a deadline
+
+    func, args and the returned value must be picklable. The child is
+    terminated when the deadline passes or the client disconnects.
+    """
+    context = _context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_process_target, args=(sender, func, args), daemon=True
+    )
+    process.start()
+    sender.close()
+    try:
+        _wait(receiver.poll, receiver.poll, timeout, disconnected)
+        ok, result = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(
+            f"Solve process exited with code {process.exitcode}"
+        )
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+    if not ok:
+        raise RuntimeError(result)
+    return result
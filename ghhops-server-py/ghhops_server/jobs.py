@@ -0,0 +1,279 @@
+"""Asynchronous solve jobs for solves that outlive an http request"""
+
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from ghhops_server.admission import SolveRejected
+from ghhops_server.logger import hlogger
+
+# solves running at once in the job pool
+DEFAULT_WORKERS = 2
+# queued and running jobs before new submissions are rejected
+DEFAULT_MAX_PENDING = 64
+# finished jobs kept for their results, oldest are dropped first
+DEFAULT_MAX_RESULTS = 128
+DEFAULT_MAX_BYTES = 256 << 20
+# seconds a finished job is kept
+DEFAULT_TTL = 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+_current_job = contextvars.ContextVar("hops_job", default=None)
+
+
+def report_progress(progress=None, message=None):
+    """Report progress of the running job, shown by its status route
+
+    progress is a fraction between 0 and 1. Does nothing when the handler
+    is not running as a job.
+    """
+    job = _current_job.get()
+    if job is not None:
+        if progress is not None:
+            job.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            job.message = str(message)
+
+
+class Job:
+    """One queued solve and, once finished, its result"""
+
+    def __init__(self, job_id, uri, key):
+        self.id = job_id
+        self.uri = uri
+        self.key = key
+        self.state = QUEUED
+        self.progress = None
+        self.message = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # solve outcome, as returned by HopsBase.solve
+        self.res = None
+        self.result = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def size(self):
+        return len(self.result) if self.result else 0
+
+    def status(self, position=None):
+        """Json serializable status of this job"""
+        status = {
+            "Id": self.id,
+            "Uri": self.uri,
+            "State": self.state,
+            "Progress": self.progress,
+            "Message": self.message,
+            "Submitted": self.submitted,
+            "Started": self.started,
+            "Finished": self.finished,
+        }
+        if position is not None:
+            status["Position"] = position
+        return status
+
+
+class JobQueue:
+    """Bounded queue of solve jobs run by a pool of threads
+
+    Jobs with the same key (component, version and input hash) are
+    deduplicated, a repeat submission attaches to the queued or running
+    job, or to a finished one when its results are reusable. Finished jobs
+    are kept until ttl seconds pass or the max_results/max_bytes bounds
+    push them out. Jobs live in the process that queued them. Running
+    jobs are not bound by the server solve deadline, timeout (seconds,
+    None for none) sets their own.
+    """
+
+    def __init__(
+        self,
+        workers=DEFAULT_WORKERS,
+        max_pending=DEFAULT_MAX_PENDING,
+        max_results=DEFAULT_MAX_RESULTS,
+        max_bytes=DEFAULT_MAX_BYTES,
+        ttl=DEFAULT_TTL,
+        timeout=None,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # all jobs by id, in submission order
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._pending = []
+        self._running = 0
+        self._bytes = 0
+        self._counts = {"submitted": 0, "attached": 0, "rejected": 0}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._threads = []
+        self._pid = None
+
+    def submit(self, key, uri, run, reuse_done=True):
+        """Queue run(job) under key, or attach to a job with the same key
+
+        run returns a (bool, str) solve outcome. Returns the job and
+        whether it was attached to an existing one. Raises SolveRejected
+        when max_pending jobs are already waiting or running.
+        """
+        with self._lock:
+            self._expire()
+            job = self._by_key.get(key)
+            if job is not None and (
+                job.state in ACTIVE_STATES
+                or (reuse_done and job.state == DONE)
+            ):
+                self._counts["attached"] += 1
+                return job, True
+            if len(self._pending) + self._running >= self.max_pending:
+                self._counts["rejected"] += 1
+                raise SolveRejected(
+                    f"Job queue is full ({self.max_pending} jobs pending)"
+                )
+            job = Job(uuid.uuid4().hex, uri, key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._pending.append((job, run))
+            self._counts["submitted"] += 1
+            self._start_workers()
+            self._ready.notify()
+        return job, False
+
+    def _start_workers(self):
+        # threads do not survive a fork, so every process starts its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._threads = []
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, name="hops-job", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._ready.wait()
+                job, run = self._pending.pop(0)
+                job.state = RUNNING
+                job.started = time.time()
+                self._running += 1
+            self._run(job, run)
+
+    def _run(self, job, run):
+        token = _current_job.set(job)
+        try:
+            res, result = run(job)
+        except Exception as ex:
+            hlogger.exception("Job %s failed", job.id)
+            res, result = False, None
+            job.message = str(ex)
+        finally:
+            _current_job.reset(token)
+        with self._lock:
+            self._running -= 1
+            job.res = res
+            job.result = result
+            job.finished = time.time()
+            if res:
+                job.state = DONE
+                job.progress = 1.0
+            else:
+                job.state = CANCELLED if job.cancel_event.is_set() else FAILED
+            self._bytes += job.size
+            self._evict()
+
+    def get(self, job_id):
+        """Job with job_id and its queue position, (None, None) if unknown"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None, None
+            return job, self._position(job)
+
+    def _position(self, job):
+        if job.state != QUEUED:
+            return None
+        for position, (pending, _) in enumerate(self._pending):
+            if pending is job:
+                return position
+        return None
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returns it or None if unknown
+
+        Queued jobs are dropped right away. Running jobs have their cancel
+        event set, which stops the solve like a client disconnect.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.state == QUEUED:
+                self._pending = [p for p in self._pending if p[0] is not job]
+                job.state = CANCELLED
+                job.finished = time.time()
+            job.cancel_event.set()
+            return job
+
+    def _drop(self, job):
+        del self._jobs[job.id]
+        self._bytes -= job.size
+        if self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _finished(self):
+        return [
+            job
+            for job in self._jobs.values()
+            if job.state not in ACTIVE_STATES
+        ]
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        for job in self._finished():
+            if job.finished < deadline:
+                self._drop(job)
+
+    def _evict(self):
+        finished = self._finished()
+        finished.sort(key=lambda job: job.finished)
+        while finished and (
+            len(finished) > self.max_results or self._bytes > self.max_bytes
+        ):
+            self._drop(finished.pop(0))
+
+    def stats(self):
+        """Job counts by state and queue counters"""
+        with self._lock:
+            states = dict.fromkeys(
+                (QUEUED, RUNNING, DONE, FAILED, CANCELLED), 0
+            )
+            for job in self._jobs.values():
+                states[job.state] += 1
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "bytes": self._bytes,
+                **states,
+                **self._counts,
+            }
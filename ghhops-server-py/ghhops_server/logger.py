@@ -1,4 +1,183 @@
+"""Hops logging
+
+Records are handed to a listener thread through a queue, so request
+threads never wait on log io. Payloads passed through truncated() are
+only formatted when a record is actually emitted, and then only up to
+MAX_CHARS characters.
+"""
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+import reprlib
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.DEBUG)
 hlogger = logging.getLogger("Hops")
+
+TEXT_FORMAT = "[%(levelname)s] %(message)s"
+# longest payload text written to a log record
+MAX_CHARS = 2000
+
+_repr = reprlib.Repr()
+_repr.maxstring = MAX_CHARS
+_repr.maxother = 200
+# formats tracebacks before records are queued
+_exc_formatter = logging.Formatter()
+
+
+class _Truncated:
+    # formats its value on demand, cut to MAX_CHARS
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        value = self.value
+        if not isinstance(value, str):
+            value = _repr.repr(value)
+        if len(value) > MAX_CHARS:
+            return f"{value[:MAX_CHARS]}... ({len(value)} chars)"
+        return value
+
+
+def truncated(value):
+    """Log argument showing at most MAX_CHARS characters of value
+
+    Nothing is formatted unless the record is emitted, so large payloads
+    cost nothing while their log level is disabled.
+    """
+    return _Truncated(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """One json object per record, with the structured fields of the
+    record's "hops" extra merged in"""
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "hops", None) or {})
+        if record.exc_info:
+            entry["exception"] = record.exc_text or self.formatException(
+                record.exc_info
+            )
+        return json.dumps(entry, default=str)
+
+
+class _SampleFilter(logging.Filter):
+    # passes a sample_rate fraction of debug records and all others
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        return (
+            record.levelno > logging.DEBUG
+            or self.sample_rate >= 1.0
+            or random.random() < self.sample_rate
+        )
+
+
+class _AsyncHandler(QueueHandler):
+    # queues records for a listener thread writing them to the handlers.
+    # threads do not survive a fork, so each process starts its own
+    def __init__(self, handlers):
+        super().__init__(None)
+        self.handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        # QueueHandler.prepare folds the traceback into the message and
+        # drops exc_info, keep them apart so JsonFormatter can emit it. The
+        # message and traceback are still formatted on the calling thread
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        self.queue.put_nowait(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self._listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def flush(self):
+        """Write out all queued records"""
+        if self._pid == os.getpid() and self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+_handler = None
+
+
+def configure_logging(
+    level=None, json_format=False, sample_rate=1.0, max_chars=None, stream=None
+):
+    """Set up the Hops log sink
+
+    json_format writes one json object per record including structured
+    fields (component, phase timings, byte sizes). sample_rate keeps that
+    fraction of debug records. max_chars bounds logged payloads. Records
+    go to stream (stderr by default) from a background thread.
+    """
+    global _handler, MAX_CHARS
+    if _handler is not None:
+        hlogger.removeHandler(_handler)
+        _handler.close()
+    if max_chars is not None:
+        MAX_CHARS = max_chars
+        _repr.maxstring = max_chars
+    sink = logging.StreamHandler(stream or sys.stderr)
+    sink.setFormatter(
+        JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    )
+    _handler = _AsyncHandler([sink])
+    _handler.addFilter(_SampleFilter(sample_rate))
+    hlogger.addHandler(_handler)
+    if level is not None:
+        hlogger.setLevel(level)
+
+
+def _ensure_handler():
+    # default sink, unless the app set up hops or root logging already
+    if _handler is None and not hlogger.handlers and not logging.root.handlers:
+        configure_logging()
+
+
+def flush_logs():
+    """Write out queued records, e.g. before a worker exits"""
+    if _handler is not None:
+        _handler.flush()
+
+
+atexit.register(flush_logs)
@@ -1,4 +1,17 @@
 """Hops middleware implementations"""
 # flake8: noqa
-from ghhops_server.middlewares.hopsdefault import HopsDefault
-from ghhops_server.middlewares.hopsflask import HopsFlask
+import importlib
+
+__all__ = ["HopsDefault", "HopsFlask"]
+
+_MODULES = {
+    "HopsDefault": "ghhops_server.middlewares.hopsdefault",
+    "HopsFlask": "ghhops_server.middlewares.hopsflask",
+}
+
+
+def __getattr__(name):
+    # import each middleware (and its http stack) only when it is used
+    if name in _MODULES:
+        return getattr(importlib.import_module(_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
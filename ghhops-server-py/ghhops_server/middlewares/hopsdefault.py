@@ -1,63 +1,201 @@
 """Hops builtin HTTP server"""
+import os
+import socket
+
 import ghhops_server.base as base
-from ghhops_server.logger import logging, hlogger
+from ghhops_server import params
+from ghhops_server.admission import SolveRejected
+from ghhops_server.cache import CachedFile
+from ghhops_server.compression import BodyTooLarge
+from ghhops_server.execution import socket_disconnected
+from ghhops_server.logger import (
+    logging,
+    hlogger,
+    truncated,
+    _ensure_handler,
+)
 
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
+# seconds an idle kept-alive connection is held open
+KEEPALIVE_TIMEOUT = 10
+
 
 class HopsDefault(base.HopsBase):
     """Hops builtin HTTP server implementation"""
 
-    def __init__(self):
-        super(HopsDefault, self).__init__(None)
+    def __init__(self, **kwargs):
+        super(HopsDefault, self).__init__(None, **kwargs)
+        # shared metrics directory when running pre-forked workers
+        self._metrics_dir = None
 
-    def start(self, address="localhost", port=5000, debug=False):
-        """Start hops builtin http server on given address:port"""
+    def start(
+        self,
+        address="localhost",
+        port=5000,
+        debug=False,
+        workers=1,
+        max_requests=0,
+        graceful_timeout=30,
+    ):
+        """Start hops builtin http server on given address:port
+
+        With workers > 1 the server pre-forks that many processes sharing
+        the listening socket, after all components are registered. Each
+        worker is replaced after max_requests requests (0 for never).
+        SIGHUP restarts the workers gracefully.
+        """
         # setup logging
+        _ensure_handler()
         hlogger.setLevel(logging.DEBUG if debug else logging.INFO)
         # start ther server
         _HopsHTTPHandler.hops = self
-        httpd = ThreadingHTTPServer((address, port), _HopsHTTPHandler)
-        hlogger.info("Starting hops python server on %s:%s", address, port)
-        httpd.serve_forever()
+        if workers > 1 and not hasattr(os, "fork"):
+            hlogger.warning("Multiple workers need os.fork, using one")
+            workers = 1
+        if workers > 1 and self.jobs is not None:
+            # status requests may land on a worker that does not hold the job
+            hlogger.warning("Async jobs live in one process, use one worker")
+        if workers <= 1:
+            httpd = ThreadingHTTPServer((address, port), _HopsHTTPHandler)
+            hlogger.info("Starting hops python server on %s:%s", address, port)
+            httpd.serve_forever()
+            return
+
+        from ghhops_server.prefork import Supervisor, WorkerHTTPServer
+
+        # pay for backend init once, workers inherit it
+        params._ensure_init()
+        httpd = WorkerHTTPServer(
+            (address, port), _HopsHTTPHandler, max_requests=max_requests
+        )
+        supervisor = Supervisor(self, httpd, workers, graceful_timeout)
+        self._metrics_dir = supervisor.metrics_dir
+        hlogger.info(
+            "Starting hops python server on %s:%s with %d workers",
+            address,
+            port,
+            workers,
+        )
+        supervisor.run()
+
+    def worker_metrics(self):
+        """Metrics of this process only"""
+        return super(HopsDefault, self).metrics()
+
+    def metrics(self):
+        if self._metrics_dir is None:
+            return self.worker_metrics()
+        from ghhops_server.prefork import aggregate_metrics
+
+        return aggregate_metrics(self._metrics_dir)
 
 
 class _HopsHTTPHandler(BaseHTTPRequestHandler):
     hops: HopsDefault = None
+    # keep connections alive for clients sending many requests, responses
+    # without a Content-Length close them
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
 
     def __init__(self, request, client_address, server):
         super(_HopsHTTPHandler, self).__init__(request, client_address, server)
 
     def log_message(self, format, *args):
         """Overriding BaseHTTPRequestHandler.log_message"""
-        hlogger.info(
-            "%s - - [%s] %s"
-            % (
+        if hlogger.isEnabledFor(logging.INFO):
+            hlogger.info(
+                "%s - - [%s] %s",
                 self.address_string(),
                 self.log_date_time_string(),
                 format % args,
             )
-        )
+
+    def setup(self):
+        super(_HopsHTTPHandler, self).setup()
+        # headers and body are separate writes, which nagle would hold
+        # back on kept-alive connections until the client acks
+        try:
+            self.connection.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+            )
+        except OSError:
+            pass
+
+    def log_error(self, format, *args):
+        # idle kept-alive connections timing out are expected
+        if format.startswith("Request timed out"):
+            return
+        super(_HopsHTTPHandler, self).log_error(format, *args)
 
     def _get_comp_uri(self):
         return self.path.split("?")[0]
 
-    def _prep_response(self, status=200, msg=None):
+    def _prep_response(self, status=200, msg=None, headers=None):
+        headers = dict(headers or {})
+        # pre-forked workers count requests and stop after max_requests
+        count_request = getattr(self.server, "count_request", None)
+        if count_request is not None:
+            count_request()
         self.send_response(status, msg if msg else "Success")
-        self.send_header("Content-type", "application/json")
+        self.send_header(
+            "Content-type", headers.pop("Content-Type", "application/json")
+        )
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if "Content-Length" not in headers or getattr(
+            self.server, "stopping", False
+        ):
+            # the body ends when the connection is closed
+            self.send_header("Connection", "close")
         self.end_headers()
 
     def do_HEAD(self):
         self._prep_response()
 
+    def _send_body(self, body, status=200, msg=None, headers=None):
+        # writes a str, bytes or CachedFile body, compressed if the client
+        # accepts
+        headers = dict(headers or {})
+        encoding = self.hops.response_encoding(
+            self.headers.get("Accept-Encoding"), body
+        )
+        if encoding:
+            # the connection is closed after the response, which ends it
+            headers["Content-Encoding"] = encoding
+            headers["Vary"] = "Accept-Encoding"
+            self._prep_response(status, msg, headers)
+            for chunk in self.hops.compressed_body(body, encoding):
+                self.wfile.write(chunk)
+        elif isinstance(body, CachedFile):
+            # stream large cached results straight from disk
+            headers["Content-Length"] = str(body.size)
+            self._prep_response(status, msg, headers)
+            with body.file:
+                self.connection.sendfile(body.file)
+        else:
+            if isinstance(body, str):
+                body = body.encode(encoding="utf_8")
+            headers["Content-Length"] = str(len(body))
+            self._prep_response(status, msg, headers)
+            self.wfile.write(body)
+
+    def _send_job_response(self, status, msg, headers, body):
+        if status == 405:
+            self._prep_response(405, "Method Not Allowed")
+            return
+        self._send_body(body, status, msg, headers)
+
     def do_GET(self):
         # grab the path before url params
         comp_uri = self._get_comp_uri()
+        if self.hops._is_job_uri(comp_uri):
+            self._send_job_response(*self.hops.job_request("GET", comp_uri))
+            return
         res, results = self.hops.query(uri=comp_uri)
-        hlogger.debug(f"{res} : {results}")
+        hlogger.debug("%s : %s", res, truncated(results))
         if res:
-            self._prep_response()
-            self.wfile.write(results.encode(encoding="utf_8"))
+            self._send_body(results)
         else:
             self._prep_response(status=404)
 
@@ -65,13 +203,77 @@ class _HopsHTTPHandler(BaseHTTPRequestHandler):
         # read the message and convert it into a python dictionary
         comp_uri = self._get_comp_uri()
         length = int(self.headers.get("Content-Length"))
-        data = self.rfile.read(length)
-        res, results = self.hops.solve(uri=comp_uri, payload=data)
-        hlogger.debug(f"{res} : {results}")
+        try:
+            data = self.hops.request_body(
+                self.rfile.read(length), self.headers.get("Content-Encoding")
+            )
+        except BodyTooLarge as ex:
+            self._prep_response(413, "Content Too Large")
+            self.wfile.write(
+                self.hops._return_with_err(str(ex)).encode(encoding="utf_8")
+            )
+            return
+        except ValueError as ex:
+            self._prep_response(400, "Bad Request")
+            self.wfile.write(
+                self.hops._return_with_err(str(ex)).encode(encoding="utf_8")
+            )
+            return
+        if (
+            self.hops._is_job_uri(comp_uri)
+            and comp_uri != base.HopsBase.JOBS_ROUTE
+        ):
+            self._prep_response(405, "Method Not Allowed")
+            return
+        try:
+            formats = self.hops.wire_formats(
+                self.headers.get("Content-Type"), self.headers.get("Accept")
+            )
+        except ValueError as ex:
+            self._prep_response(415, "Unsupported Media Type")
+            self.wfile.write(
+                self.hops._return_with_err(str(ex)).encode(encoding="utf_8")
+            )
+            return
+        disconnected = lambda: socket_disconnected(self.connection)  # noqa
+        try:
+            if self.hops.wants_job(comp_uri, self.headers.get("Prefer")):
+                self._send_job_response(
+                    *self.hops.submit_job(comp_uri, data, formats)
+                )
+                return
+            res, results = self.hops.solve_result(
+                uri=comp_uri,
+                payload=data,
+                disconnected=disconnected,
+                formats=formats,
+            )
+        except SolveRejected as ex:
+            self._prep_response(
+                503,
+                "Service Unavailable",
+                {"Retry-After": str(base.HopsBase.RETRY_AFTER)},
+            )
+            self.wfile.write(
+                self.hops._return_with_err(str(ex)).encode(encoding="utf_8")
+            )
+            return
+        # nobody is left to read the response
+        if disconnected():
+            self.close_connection = True
+            if isinstance(results, CachedFile):
+                results.file.close()
+            return
+        hlogger.debug("%s : %s", res, truncated(results))
         if res:
-            self._prep_response()
-            self.wfile.write(results.encode(encoding="utf_8"))
+            self._send_body(results, headers={"Content-Type": formats[1]})
         else:
             # TODO: write proper errors
-            self._prep_response(500, "Execution Error")
-            self.wfile.write(results.encode(encoding="utf_8"))
+            self._send_body(results, 500, "Execution Error")
+
+    def do_DELETE(self):
+        comp_uri = self._get_comp_uri()
+        if not self.hops._is_job_uri(comp_uri):
+            self._prep_response(405, "Method Not Allowed")
+            return
+        self._send_job_response(*self.hops.job_request("DELETE", comp_uri))
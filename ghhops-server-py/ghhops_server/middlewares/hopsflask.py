@@ -1,51 +1,182 @@
 """Hops flask middleware implementation"""
+from http import HTTPStatus
+
 import ghhops_server.base as base
+from ghhops_server.execution import socket_disconnected
+
+from werkzeug.wsgi import wrap_file
+
+
+class _EnvironHeaders:
+    # read-only request header lookup straight from the wsgi environ
+    __slots__ = ("environ",)
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def get(self, name, default=None):
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        return self.environ.get(key, default)
+
+
+class _WSGIRequest:
+    """Minimal request of a Hops route, read from the wsgi environ
+
+    Provides the parts of werkzeug.Request that HopsBase handlers use.
+    The body is read on first access into a buffer of Content-Length.
+    """
+
+    __slots__ = ("environ", "path", "method", "headers", "_data")
+
+    def __init__(self, environ, path, method):
+        self.environ = environ
+        self.path = path
+        self.method = method
+        self.headers = _EnvironHeaders(environ)
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = _read_body(self.environ)
+        return self._data
+
+
+def _read_body(environ):
+    stream = environ["wsgi.input"]
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        # chunked bodies are only readable when the server terminates them
+        if environ.get("wsgi.input_terminated"):
+            return stream.read()
+        return b""
+    readinto = getattr(stream, "readinto", None)
+    if readinto is None:
+        return stream.read(length)
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        count = readinto(view[received:])
+        if not count:
+            break
+        received += count
+    view.release()
+    if received < length:
+        del buffer[received:]
+    return buffer
+
+
+class _WSGIResponse:
+    """Minimal response of a Hops route, called as a wsgi app
+
+    Provides the parts of werkzeug.Response that HopsBase handlers use.
+    response is the wsgi iterable, data sets it to a single bytes body.
+    """
+
+    __slots__ = ("status", "headers", "response", "direct_passthrough")
+
+    def __init__(self, body, status=200):
+        self.status = status
+        self.headers = {"Content-Type": "application/json"}
+        self.direct_passthrough = False
+        self.data = body
 
-from werkzeug.wrappers import Request, Response
+    @property
+    def data(self):
+        return b"".join(self.response)
+
+    @data.setter
+    def data(self, value):
+        if isinstance(value, str):
+            value = value.encode("utf_8")
+        self.response = (value,)
+        self.headers["Content-Length"] = str(len(value))
+
+    @property
+    def content_length(self):
+        return int(self.headers.get("Content-Length", 0))
+
+    @content_length.setter
+    def content_length(self, value):
+        self.headers["Content-Length"] = str(value)
+
+    def __call__(self, environ, start_response):
+        status = HTTPStatus(self.status)
+        start_response(
+            f"{status.value} {status.phrase}", list(self.headers.items())
+        )
+        if environ["REQUEST_METHOD"] == "HEAD":
+            if hasattr(self.response, "close"):
+                self.response.close()
+            return ()
+        return self.response
 
 
 class HopsFlask(base.HopsBase):
-    """Hops Middleware for Flask"""
+    """Hops Middleware for Flask
+
+    Sits in front of the flask wsgi app. Requests to Hops routes are
+    served from the raw wsgi environ, without building werkzeug request
+    and response objects, all others go to flask untouched.
+    """
 
-    def __init__(self, flask_app):
+    def __init__(self, flask_app, **kwargs):
         # keep a ref to original flask app
-        super(HopsFlask, self).__init__(flask_app)
+        super(HopsFlask, self).__init__(flask_app, **kwargs)
         # and and wsgi_app
         self.wsgi_app = flask_app.wsgi_app
         # replace wsgi_app with self, this instance will call the bubble up
         # the unknown/unhandled messages to the original wsgi_app
         flask_app.wsgi_app = self
+        # request method to handler of hops routes
+        self._methods = {
+            "HEAD": self.handle_HEAD,
+            "GET": self.handle_GET,
+            "POST": self.handle_POST,
+            "DELETE": self.handle_DELETE,
+        }
 
     def _prep_response(self, status=200, msg=None):
-        return Response(
-            msg if msg else "Success",
-            mimetype="application/json",
-            status=status,
+        return _WSGIResponse(msg if msg else "Success", status)
+
+    def _send_file(self, request, response, cached):
+        # servers providing wsgi.file_wrapper (e.g. gunicorn) use sendfile
+        response.response = wrap_file(request.environ, cached.file)
+        response.direct_passthrough = True
+        response.content_length = cached.size
+
+    def _disconnect_check(self, request):
+        # werkzeug dev server and gunicorn expose the client socket
+        sock = request.environ.get("werkzeug.socket") or request.environ.get(
+            "gunicorn.socket"
         )
+        if sock is None:
+            return None
+        return lambda: socket_disconnected(sock)
 
     def __call__(self, environ, start_response):
-        request = Request(environ)
-
-        method = request.method
+        path = environ.get("PATH_INFO") or "/"
+        # otherwise ask wapped app to process the call
+        if not self._handles_uri(path):
+            if path.isascii():
+                return self.wsgi_app(environ, start_response)
+            # wsgi passes paths as latin-1, uris are utf-8
+            path = path.encode("latin-1").decode("utf_8", "replace")
+            if not self._handles_uri(path):
+                return self.wsgi_app(environ, start_response)
 
         # if hops app handled this request
-        if self.handles(request):
-            response = None
-
-            if method == "HEAD":
-                response = self.handle_HEAD(request)
-
-            elif method == "GET":
-                response = self.handle_GET(request)
-
-            elif method == "POST":
-                response = self.handle_POST(request)
-
-            if response:
-                return response(environ, start_response)
-
+        method = environ["REQUEST_METHOD"]
+        handler = self._methods.get(method)
+        if handler is None:
             # respond with 405 if method is not valid
-            return self._return_method_not_allowed()
-
-        # otherwise ask wapped app to process the call
-        return self.wsgi_app(environ, start_response)
+            response = self._return_method_not_allowed()
+        else:
+            response = handler(_WSGIRequest(environ, path, method))
+        return response(environ, start_response)
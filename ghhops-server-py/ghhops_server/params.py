@@ -1,6 +1,13 @@
 """Hops Component Parameter wrappers"""
+import base64
+import hashlib
 import json
+import sys
+import threading
+from array import array
+from collections import OrderedDict
 from enum import Enum
+from functools import lru_cache
 import inspect
 from ghhops_server.base import _HopsEncoder
 from ghhops_server.logger import hlogger
@@ -47,6 +54,27 @@ RHINO_TOJSON = None
 RHINO_GEOM = None
 CONVERT_VALUE = None
 
+# backend init to run on first solve, see _defer_init
+_PENDING_INIT = None
+_INIT_LOCK = threading.Lock()
+
+
+def _defer_init(init):
+    """Run backend init function on first use instead of at startup"""
+    global _PENDING_INIT
+    _PENDING_INIT = init
+
+
+def _ensure_init():
+    """Run deferred backend init, if any, exactly once"""
+    global _PENDING_INIT
+    if _PENDING_INIT is None:
+        return
+    with _INIT_LOCK:
+        if _PENDING_INIT is not None:
+            _PENDING_INIT()
+            _PENDING_INIT = None
+
 
 def _init_rhinoinside():
     global RHINO
@@ -126,6 +154,170 @@ def _init_rhino3dm():
     CONVERT_VALUE = convert_value
 
 
+# primitive GH types whose json data is parsed for a whole branch at once
+PRIMITIVE_TYPES = frozenset(
+    ("System.Double", "System.Int32", "System.Boolean", "System.String")
+)
+
+# GH types whose branches the binary wire formats pack into one array:
+# array typecode and the struct fields stored per item
+PACKED_TYPES = {
+    "System.Double": ("d", None),
+    "System.Int32": ("i", None),
+    "System.Boolean": ("B", None),
+    "Rhino.Geometry.Point3d": ("d", ("X", "Y", "Z")),
+    "Rhino.Geometry.Vector3d": ("d", ("X", "Y", "Z")),
+}
+
+
+def _little_endian(values):
+    # packed arrays are little-endian on the wire
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _packed_item(value):
+    # native value of one unpacked branch item, geometry data as raw bytes
+    if isinstance(value, (str, int, float)):
+        return value
+    value = CONVERT_VALUE(value)
+    if hasattr(value, "Encode"):
+        encoded = value.Encode()
+    else:
+        encoded = json.loads(RHINO_TOJSON(value))
+    if (
+        isinstance(encoded, dict)
+        and "archive3dm" in encoded
+        and isinstance(encoded.get("data"), str)
+    ):
+        encoded = dict(encoded, data=base64.b64decode(encoded["data"]))
+    return encoded
+
+
+def _geometry_from_packed(item):
+    # rhino geometry of an encoded object whose data is raw bytes
+    data = base64.b64encode(item["data"]).decode("ascii")
+    return RHINO_FROMJSON(dict(item, data=data))
+
+
+@lru_cache(maxsize=None)
+def _coercer(param_class, param_type):
+    # coercer of param_type data for param_class, or None when the value is
+    # decoded as rhino geometry (True) or passed on as is (False)
+    if isinstance(param_class.coercers, dict):
+        coercer = param_class.coercers.get(param_type, None)
+        if coercer:
+            return coercer
+    elif param_type.startswith("Rhino.Geometry."):
+        return True
+    return False
+
+
+class GeometryCache:
+    """LRU cache of decoded input geometry, keyed by a hash of its json data
+
+    Definitions often post the same heavy Brep, Curve or Mesh many times
+    with different parameters. Cached inputs skip json parsing and
+    decoding. With copy=True handlers get a duplicate of the cached object
+    and may modify it, which is far cheaper than decoding. With copy=False
+    the cached object itself is shared between solves and must be treated
+    as read-only. Sizes are measured on the encoded data, data shorter
+    than min_bytes is decoded without caching.
+    """
+
+    DEFAULT_MAX_BYTES = 256 << 20
+    DEFAULT_MIN_BYTES = 1 << 10
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_MAX_BYTES,
+        copy=True,
+        min_bytes=DEFAULT_MIN_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.copy = copy
+        self.min_bytes = min_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def decode(self, param_data):
+        """Decoded rhino geometry of the json encoded param_data"""
+        if (
+            not isinstance(param_data, str)
+            or len(param_data) < self.min_bytes
+            or len(param_data) > self.max_bytes
+        ):
+            return RHINO_FROMJSON(json.loads(param_data))
+        key = hashlib.sha256(param_data.encode("utf_8")).digest()
+        return self._lookup(
+            key,
+            len(param_data),
+            lambda: RHINO_FROMJSON(json.loads(param_data)),
+        )
+
+    def decode_packed(self, item):
+        """Decoded rhino geometry of a binary format item, an encoded
+        object whose data is raw bytes"""
+        size = len(item["data"])
+        if size < self.min_bytes or size > self.max_bytes:
+            return _geometry_from_packed(item)
+        key = hashlib.sha256(item["data"]).digest()
+        return self._lookup(key, size, lambda: _geometry_from_packed(item))
+
+    def _lookup(self, key, size, decode):
+        with self._lock:
+            geometry = self._entries.get(key)
+            if geometry is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+        if geometry is None:
+            geometry = decode()
+            if geometry is None:
+                return None
+            self._put(key, geometry, size)
+        return geometry.Duplicate() if self.copy else geometry
+
+    def _put(self, key, geometry, size):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = geometry
+            self._sizes[key] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+
+    def clear(self):
+        """Drop all cached geometry"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Entry, size and hit counters"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+# decoded geometry cache used by all geometry params, see GeometryCache
+GEOMETRY_CACHE = GeometryCache()
+
+
 class HopsParamAccess(Enum):
     """GH Item Access"""
 
@@ -156,20 +348,71 @@ class _GHParam:
         self.description = desc
         self.access: HopsParamAccess = access or HopsParamAccess.ITEM
         self.optional = optional
-        self.default = default or inspect.Parameter.empty
+        # falsy defaults like 0 or "" are defaults too
+        self.default = inspect.Parameter.empty if default is None else default
 
     def _coerce_value(self, param_type, param_data):
+        coercer = _coercer(type(self), param_type)
+        if coercer is True:
+            # parsed and decoded by the cache on misses only
+            return GEOMETRY_CACHE.decode(param_data)
         # get data as dict
         data = json.loads(param_data)
         # parse data
-        if isinstance(self.coercers, dict):
-            coercer = self.coercers.get(param_type, None)
-            if coercer:
-                return coercer(data)
-        elif param_type.startswith("Rhino.Geometry."):
-            return RHINO_FROMJSON(data)
+        if coercer:
+            return coercer(data)
         return param_data
 
+    def _coerce_branch(self, items):
+        # decode all items of a branch. branches holding a single primitive
+        # type are parsed with one json.loads call instead of one per item
+        if isinstance(items, dict):
+            return self._coerce_packed(items)
+        if items:
+            param_type = items[0]["type"]
+            coercer = _coercer(type(self), param_type)
+            if (
+                param_type in PRIMITIVE_TYPES
+                and callable(coercer)
+                and all(item["type"] == param_type for item in items)
+            ):
+                try:
+                    values = json.loads(
+                        "[" + ",".join(item["data"] for item in items) + "]"
+                    )
+                except (TypeError, ValueError):
+                    # let the per item path report the bad item
+                    values = None
+                if values is not None and len(values) == len(items):
+                    return list(map(coercer, values))
+        return [
+            self._coerce_value(item["type"], item["data"]) for item in items
+        ]
+
+    def _coerce_packed(self, branch):
+        # decode a branch of the binary formats, {"type", "array"} for
+        # PACKED_TYPES or {"type", "items"} holding native values
+        param_type = branch["type"]
+        coercer = _coercer(type(self), param_type)
+        if "array" in branch:
+            typecode, fields = PACKED_TYPES[param_type]
+            values = array(typecode)
+            values.frombytes(branch["array"])
+            values = _little_endian(values).tolist()
+            if fields:
+                count = len(fields)
+                values = [
+                    dict(zip(fields, values[i : i + count]))
+                    for i in range(0, len(values), count)
+                ]
+        else:
+            values = branch["items"]
+            if coercer is True:
+                return [GEOMETRY_CACHE.decode_packed(item) for item in values]
+        if callable(coercer):
+            return list(map(coercer, values))
+        return list(values)
+
     def encode(self):
         """Parameter serializer"""
         param_def = {
@@ -195,38 +438,24 @@ class _GHParam:
         """Extract parameter data from serialized input"""
         if self.access == HopsParamAccess.TREE:
             paths = input_data["InnerTree"]
-            tree = {}
-            for k, v in paths.items():
-                data = []
-                for param_value_item in v:
-                    param_type = param_value_item["type"]
-                    param_value = param_value_item["data"]
-                    data.append(self._coerce_value(param_type, param_value))
-                tree[k] = data
-            return tree
-
-        data = []
-        for param_value_item in input_data["InnerTree"]["0"]:
-            param_type = param_value_item["type"]
-            param_value = param_value_item["data"]
-            data.append(self._coerce_value(param_type, param_value))
+            return {k: self._coerce_branch(v) for k, v in paths.items()}
+
+        data = self._coerce_branch(input_data["InnerTree"]["0"])
         if self.access == HopsParamAccess.ITEM:
             return data[0]
         return data
 
-    def from_result(self, value):
-        """Serialize parameter with given value for output"""
+    def from_result(self, value, packed=False):
+        """Serialize parameter with given value for output
+
+        packed branches hold arrays and raw bytes for the binary wire
+        formats instead of json strings, see _packed_branch.
+        """
+        branch = self._packed_branch if packed else self._result_branch
         if self.access == HopsParamAccess.TREE and isinstance(value, dict):
             tree = {}
             for key in value.keys():
-                branch_data = [
-                    {
-                        "type": self.result_type,
-                        "data": RHINO_TOJSON(CONVERT_VALUE(v)),
-                    }
-                    for v in value[key]
-                ]
-                tree[key] = branch_data
+                tree[key] = branch(value[key])
             output = {
                 "ParamName": self.name,
                 "InnerTree": tree,
@@ -236,17 +465,41 @@ class _GHParam:
         if not isinstance(value, tuple) and not isinstance(value, list):
             value = (value,)
 
-        output_list = [
-            {"type": self.result_type, "data": RHINO_TOJSON(CONVERT_VALUE(v))}
-            for v in value
-        ]
-
         output = {
             "ParamName": self.name,
-            "InnerTree": {"0": output_list},
+            "InnerTree": {"0": branch(value)},
         }
         return output
 
+    def _result_branch(self, values):
+        return [
+            {"type": self.result_type, "data": RHINO_TOJSON(CONVERT_VALUE(v))}
+            for v in values
+        ]
+
+    def _packed_branch(self, values):
+        # numbers and points as one little-endian array, other values as a
+        # list of native items
+        packing = PACKED_TYPES.get(self.result_type)
+        if packing is not None:
+            typecode, fields = packing
+            try:
+                flat = values
+                if fields:
+                    flat = [getattr(v, f) for v in values for f in fields]
+                data = array(typecode, flat)
+            except (TypeError, AttributeError, OverflowError):
+                pass
+            else:
+                return {
+                    "type": self.result_type,
+                    "array": _little_endian(data).tobytes(),
+                }
+        return {
+            "type": self.result_type,
+            "items": [_packed_item(v) for v in values],
+        }
+
 
 class HopsBoolean(_GHParam):
     """Wrapper for GH_Boolean"""
@@ -325,6 +578,27 @@ class HopsMesh(_GHParam):
     param_type = "Mesh"
     result_type = "Rhino.Geometry.Mesh"
 
+    def __init__(self, *args, max_faces=None, **kwargs):
+        super(HopsMesh, self).__init__(*args, **kwargs)
+        # optional face budget. output meshes above it are decimated
+        self.max_faces = max_faces
+
+    def _decimate(self, value):
+        from ghhops_server.decimate import decimate_mesh
+
+        if isinstance(value, (tuple, list)):
+            return [self._decimate(v) for v in value]
+        mesh, _ = decimate_mesh(value, self.max_faces)
+        return mesh
+
+    def from_result(self, value, packed=False):
+        if self.max_faces:
+            if isinstance(value, dict):
+                value = {k: self._decimate(v) for k, v in value.items()}
+            else:
+                value = self._decimate(value)
+        return super(HopsMesh, self).from_result(value, packed)
+
 
 class HopsNumber(_GHParam):
     """Wrapper for GH Number"""
@@ -0,0 +1,313 @@
+"""Pre-fork multi-process serving for the Hops builtin HTTP server"""
+import json
+import os
+import os.path as op
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from ghhops_server.logger import hlogger, flush_logs
+
+# seconds between supervisor checks for exited workers
+SUPERVISE_INTERVAL = 0.2
+# seconds between metric snapshots written by each worker
+METRICS_INTERVAL = 1.0
+# metrics of shared resources, reported once instead of summed per worker
+SHARED_METRICS = {"cache.entries", "cache.bytes", "cache.max_bytes"}
+# monotonic counters, kept in the totals after their worker exits. Gauges
+# like active solves or cache sizes leave with the worker
+COUNTER_METRICS = {
+    "requests",
+    "admitted",
+    "rejected",
+    "abandoned",
+    "hits",
+    "misses",
+    "submitted",
+    "attached",
+}
+# counters of exited workers, folded in by the supervisor
+RETIRED_FILE = "retired.json"
+
+
+class WorkerHTTPServer(ThreadingHTTPServer):
+    """Threading HTTP server of one worker process
+
+    Request threads are joined on close so a stopping worker finishes the
+    requests it accepted, and closes kept-alive connections after them.
+    After max_requests requests the worker stops accepting and exits, and
+    the supervisor replaces it.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, *args, max_requests=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_requests = max_requests
+        self.handled = 0
+        self._stopping = False
+        self._count_lock = threading.Lock()
+
+    @property
+    def stopping(self):
+        return self._stopping
+
+    def stop(self):
+        """Stop accepting requests, safe to call from any thread or signal"""
+        if not self._stopping:
+            self._stopping = True
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def count_request(self):
+        """Count a request, called by the handler once per response"""
+        with self._count_lock:
+            self.handled += 1
+            handled = self.handled
+        if self.max_requests and handled == self.max_requests:
+            hlogger.info(
+                "Worker %d recycling after %d requests",
+                os.getpid(),
+                handled,
+            )
+            self.stop()
+
+
+def _merge(total, metrics, prefix=""):
+    # sum numeric metrics of all workers, shared ones are taken once
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            _merge(total.setdefault(key, {}), value, f"{prefix}{key}.")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            total.setdefault(key, value)
+        elif prefix + key in SHARED_METRICS:
+            total[key] = max(total.get(key, 0), value)
+        else:
+            total[key] = (total.get(key) or 0) + value
+
+
+def _counters(metrics):
+    # only the counters of a metrics snapshot
+    counters = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            counters[key] = _counters(value)
+        elif key in COUNTER_METRICS:
+            counters[key] = value
+    return counters
+
+
+def _load(path):
+    try:
+        with open(path) as snapshot:
+            return json.load(snapshot)
+    except (OSError, ValueError):
+        # worker exited or is rewriting its snapshot
+        return None
+
+
+def _dump(metrics, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as snapshot:
+        json.dump(metrics, snapshot)
+    os.replace(tmp_path, path)
+
+
+def retire_worker(metrics_dir, pid):
+    """Fold the counters of an exited worker into the retired totals
+
+    The retired file lists the pid, so aggregate_metrics skips a worker
+    snapshot that is folded in already but not yet removed.
+    """
+    path = op.join(metrics_dir, f"worker-{pid}.json")
+    metrics = _load(path)
+    if metrics is not None:
+        retired_path = op.join(metrics_dir, RETIRED_FILE)
+        retired = _load(retired_path) or {"counters": {}}
+        _merge(retired["counters"], _counters(metrics))
+        retired["pids"] = [pid]
+        _dump(retired, retired_path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def aggregate_metrics(metrics_dir):
+    """Combined metrics of all workers sharing metrics_dir
+
+    Gauges are summed over the live workers, counters also include those
+    of workers that exited.
+    """
+    # read before listing the snapshots, see retire_worker
+    retired = _load(op.join(metrics_dir, RETIRED_FILE)) or {}
+    folded = {f"worker-{pid}.json" for pid in retired.get("pids", ())}
+    total = {}
+    workers = 0
+    for name in os.listdir(metrics_dir):
+        if not name.startswith("worker-") or not name.endswith(".json"):
+            continue
+        if name in folded:
+            continue
+        metrics = _load(op.join(metrics_dir, name))
+        if metrics is None:
+            continue
+        _merge(total, metrics)
+        workers += 1
+    _merge(total, retired.get("counters", {}))
+    total["workers"] = workers
+    return total
+
+
+class _MetricsWriter(threading.Thread):
+    # periodically publishes this worker's metrics for aggregation
+    def __init__(self, hops, httpd, metrics_dir):
+        super().__init__(daemon=True)
+        self.hops = hops
+        self.httpd = httpd
+        self.path = op.join(metrics_dir, f"worker-{os.getpid()}.json")
+        self.done = threading.Event()
+
+    def write(self):
+        metrics = self.hops.worker_metrics()
+        metrics["requests"] = self.httpd.handled
+        _dump(metrics, self.path)
+
+    def run(self):
+        while not self.done.wait(METRICS_INTERVAL):
+            self.write()
+
+    def close(self):
+        """Write the final snapshot, the supervisor retires it"""
+        self.done.set()
+        if self.is_alive():
+            self.join()
+        self.write()
+
+
+def _run_worker(hops, httpd, metrics_dir):
+    # body of a forked worker process, never returns
+    signal.signal(signal.SIGTERM, lambda *_: httpd.stop())
+    # the supervisor handles ctrl+c and restarts for the process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    writer = _MetricsWriter(hops, httpd, metrics_dir)
+    code = 0
+    try:
+        writer.write()
+        writer.start()
+        httpd.serve_forever()
+        # wait for accepted requests to finish
+        httpd.server_close()
+    except BaseException:
+        hlogger.exception("Worker %d failed", os.getpid())
+        code = 1
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            hlogger.exception("Worker %d failed to write metrics", os.getpid())
+        # os._exit skips atexit, write out queued records first
+        flush_logs()
+        os._exit(code)
+
+
+class Supervisor:
+    """Forks and supervises workers serving one shared listening socket
+
+    SIGTERM/SIGINT stop all workers gracefully (SIGKILL after
+    graceful_timeout). SIGHUP replaces all workers with fresh ones,
+    starting the new workers before stopping the old. Workers that exit,
+    e.g. after max_requests, are replaced.
+    """
+
+    def __init__(self, hops, httpd, workers, graceful_timeout=30):
+        self.hops = hops
+        self.httpd = httpd
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.metrics_dir = tempfile.mkdtemp(prefix="hops-metrics-")
+        self.children = set()
+        self.retiring = set()
+        self._running = True
+        self._restart = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(self.hops, self.httpd, self.metrics_dir)
+        self.children.add(pid)
+        hlogger.debug("Started worker %d", pid)
+
+    def _stop_signal(self, *_):
+        self._running = False
+
+    def _restart_signal(self, *_):
+        self._restart = True
+
+    def _reap(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            self.children.discard(pid)
+            self.retiring.discard(pid)
+            if os.waitstatus_to_exitcode(status):
+                hlogger.warning(
+                    "Worker %d exited with %d",
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+            # its counters stay in the totals, its gauges leave with it
+            retire_worker(self.metrics_dir, pid)
+
+    def _terminate(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """Serve until stopped, returns after all workers exited"""
+        signal.signal(signal.SIGTERM, self._stop_signal)
+        signal.signal(signal.SIGINT, self._stop_signal)
+        signal.signal(signal.SIGHUP, self._restart_signal)
+        try:
+            while self._running:
+                if self._restart:
+                    self._restart = False
+                    hlogger.info("Restarting %d workers", self.workers)
+                    old = self.children - self.retiring
+                    self.retiring |= old
+                    for _ in range(self.workers):
+                        self._spawn()
+                    self._terminate(old)
+                self._reap()
+                while len(self.children - self.retiring) < self.workers:
+                    self._spawn()
+                time.sleep(SUPERVISE_INTERVAL)
+            self._shutdown()
+        finally:
+            self.httpd.server_close()
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+    def _shutdown(self):
+        hlogger.info("Stopping %d workers", len(self.children))
+        self._terminate(self.children)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(SUPERVISE_INTERVAL)
+        for pid in self.children:
+            hlogger.warning("Killing worker %d", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.children:
+            pid, _ = os.waitpid(-1, 0)
+            self.children.discard(pid)
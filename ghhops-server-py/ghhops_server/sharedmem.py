@@ -0,0 +1,396 @@
+"""Numpy arrays shared by worker processes through named shared memory"""
+
+import hashlib
+import json
+import os
+import os.path as op
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from ghhops_server.logger import hlogger
+
+# total size of published segments before least recently used ones are
+# unlinked
+DEFAULT_MAX_BYTES = 512 << 20
+# seconds to wait on an index locked by another process
+BUSY_TIMEOUT = 10.0
+# marks a segment whose arrays are completely written
+MAGIC = b"HOPSSHM1"
+# segment header: magic, layout length, layout json
+HEADER_SIZE = 4096
+ALIGNMENT = 64
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS segments (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        accessed REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS refs (
+        name TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (name, pid)
+    )
+    """,
+)
+
+
+def _open(name, create=False, size=0):
+    # segments outlive the process that created them, so keep them away
+    # from the resource tracker, which unlinks them when a process exits
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    shm = shared_memory.SharedMemory(name, create, size)
+    if os.name == "posix":
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink(name):
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.unlink()
+    shm.close()
+
+
+def _pid_alive(pid):
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _layout(arrays):
+    # json layout of arrays packed after the header and the segment size
+    layout = []
+    offset = HEADER_SIZE
+    for array in arrays:
+        layout.append([array.dtype.str, list(array.shape), offset])
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    return layout, max(offset, HEADER_SIZE + ALIGNMENT)
+
+
+class _Mapping:
+    # one attached segment, closed once all arrays viewing it are gone
+    __slots__ = ("name", "shm", "live", "arrays")
+
+    def __init__(self, name, shm, count):
+        self.name = name
+        self.shm = shm
+        self.live = count
+        self.arrays = []
+
+
+class SharedArrayStore:
+    """Named shared memory segments holding read-only numpy arrays
+
+    The first process to build an entry publishes it in a segment named
+    after the hash of its key, the others map the segment and get
+    zero-copy read-only arrays viewing it. Segment sizes, access times and
+    the processes holding each segment are kept in a sqlite database under
+    root, shared by every process using the same namespace. Once the
+    published segments exceed max_bytes, the least recently used ones are
+    unlinked, segments no process holds first. Processes holding an
+    unlinked segment keep their arrays, its memory is freed when the last
+    of them is dropped. Segments are not tied to a process, call clear()
+    to remove them all.
+    """
+
+    def __init__(
+        self, namespace="hops", max_bytes=DEFAULT_MAX_BYTES, root=None
+    ):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.root = root or op.join(
+            tempfile.gettempdir(), f"hops-shm-{namespace}"
+        )
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._mapped = {}
+        self._released = []
+        self._pid = os.getpid()
+        os.makedirs(self.root, exist_ok=True)
+        db = self._connect()
+        for statement in _SCHEMA:
+            db.execute(statement)
+
+    def _connect(self):
+        # one connection per thread and process
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            import sqlite3
+
+            db = sqlite3.connect(
+                op.join(self.root, "index.sqlite"),
+                timeout=BUSY_TIMEOUT,
+                isolation_level=None,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _name(self, key):
+        ident = f"{self.namespace}\0{key!r}"
+        # short enough for the 31 character limit of macos
+        return "hops" + hashlib.sha256(ident.encode("utf_8")).hexdigest()[:24]
+
+    def _check_pid(self):
+        # a forked child shares its parent's mappings, but not its refs
+        if self._pid != os.getpid():
+            self._mapped = {}
+            self._released = []
+            self._pid = os.getpid()
+
+    def get(self, key):
+        """Tuple of read-only arrays published under key, or None"""
+        arrays = self._get(self._name(key))
+        if arrays is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return arrays
+
+    def _get(self, name):
+        with self._lock:
+            self._check_pid()
+            mapping = self._mapped.get(name)
+            arrays = None
+            if mapping is not None:
+                arrays = tuple(ref() for ref in mapping.arrays)
+                if any(array is None for array in arrays):
+                    arrays = None
+            if arrays is None:
+                arrays = self._attach(name)
+            if arrays is not None:
+                self._transact(self._touch, name)
+            return arrays
+
+    def _attach(self, name):
+        try:
+            shm = _open(name)
+        except FileNotFoundError:
+            return None
+        buf = shm.buf
+        if len(buf) < HEADER_SIZE or bytes(buf[: len(MAGIC)]) != MAGIC:
+            # not written completely yet, or not a segment of this store
+            del buf
+            shm.close()
+            return None
+        size = int.from_bytes(buf[8:12], "little")
+        layout = json.loads(bytes(buf[12 : 12 + size]))
+        view = buf.toreadonly()
+        del buf
+        arrays = tuple(
+            np.ndarray(shape, np.dtype(dtype), buffer=view, offset=offset)
+            for dtype, shape, offset in layout
+        )
+        del view
+        mapping = _Mapping(name, shm, len(arrays))
+        for array in arrays:
+            mapping.arrays.append(weakref.ref(array))
+            weakref.finalize(array, self._release, mapping).atexit = False
+        self._mapped[name] = mapping
+        self._transact(self._add_ref, name, shm.size)
+        return arrays
+
+    def _release(self, mapping):
+        # runs when an array is garbage collected, possibly inside a
+        # transaction, so the index is only updated on the next one
+        mapping.live -= 1
+        if mapping.live > 0:
+            return
+        try:
+            mapping.shm.close()
+        except BufferError:
+            return
+        if self._pid == os.getpid():
+            self._released.append(mapping.name)
+
+    def put(self, key, arrays):
+        """Publish arrays under key, returns them as read-only arrays
+
+        Returns the published arrays mapped from shared memory, those of
+        another process if it published key first, or arrays themselves
+        made read-only when they can not be shared (larger than max_bytes
+        or holding python objects).
+        """
+        arrays = [np.ascontiguousarray(array) for array in arrays]
+        layout, size = _layout(arrays)
+        header = json.dumps(layout).encode("utf_8")
+        if (
+            size > self.max_bytes
+            or 12 + len(header) > HEADER_SIZE
+            or any(array.dtype.hasobject for array in arrays)
+        ):
+            return self._readonly(arrays)
+
+        name = self._name(key)
+        with self._lock:
+            self._check_pid()
+            try:
+                shm = _open(name, create=True, size=size)
+            except FileExistsError:
+                shared = self._attach(name)
+                return shared if shared is not None else self._readonly(arrays)
+            buf = shm.buf
+            for array, (_, _, offset) in zip(arrays, layout):
+                target = np.ndarray(
+                    array.shape, array.dtype, buffer=buf, offset=offset
+                )
+                target[...] = array
+                del target
+            buf[8:12] = len(header).to_bytes(4, "little")
+            buf[12 : 12 + len(header)] = header
+            # readers only map segments carrying the magic
+            buf[: len(MAGIC)] = MAGIC
+            del buf
+            evicted = self._transact(self._insert, name, size)
+            # attach before closing, windows frees segments without handles
+            shared = self._attach(name)
+            shm.close()
+        for old_name in evicted:
+            _unlink(old_name)
+        if evicted:
+            hlogger.debug("Unlinked %d shared segments", len(evicted))
+        return shared if shared is not None else self._readonly(arrays)
+
+    def get_or_create(self, key, build):
+        """Arrays published under key, build() publishes them if missing
+
+        build returns a sequence of arrays.
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = self.put(key, build())
+        return arrays
+
+    @staticmethod
+    def _readonly(arrays):
+        for array in arrays:
+            array.flags.writeable = False
+        return tuple(arrays)
+
+    def _transact(self, action, *args):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            released, self._released = self._released, []
+            for name in released:
+                self._drop_ref(db, name)
+            result = action(db, *args)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _touch(self, db, name):
+        db.execute(
+            "UPDATE segments SET accessed = ? WHERE name = ?",
+            (time.time(), name),
+        )
+
+    def _add_ref(self, db, name, size):
+        # segments missing from the index, e.g. after it was removed, are
+        # adopted so they are evicted like the others
+        db.execute(
+            "INSERT OR IGNORE INTO segments VALUES (?, ?, ?)",
+            (name, size, time.time()),
+        )
+        db.execute(
+            "INSERT INTO refs VALUES (?, ?, 1) ON CONFLICT (name, pid) "
+            "DO UPDATE SET count = count + 1",
+            (name, os.getpid()),
+        )
+
+    def _drop_ref(self, db, name):
+        pid = os.getpid()
+        db.execute(
+            "UPDATE refs SET count = count - 1 WHERE name = ? AND pid = ?",
+            (name, pid),
+        )
+        db.execute(
+            "DELETE FROM refs WHERE name = ? AND pid = ? AND count <= 0",
+            (name, pid),
+        )
+
+    def _insert(self, db, name, size):
+        db.execute(
+            "INSERT OR REPLACE INTO segments VALUES (?, ?, ?)",
+            (name, size, time.time()),
+        )
+        return self._evict(db, name)
+
+    def _evict(self, db, keep):
+        # drop least recently used segments until under max_bytes,
+        # returns the names to unlink
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM segments")
+        excess = total.fetchone()[0] - self.max_bytes
+        evicted = []
+        if excess <= 0:
+            return evicted
+        for (pid,) in db.execute("SELECT DISTINCT pid FROM refs").fetchall():
+            if not _pid_alive(pid):
+                db.execute("DELETE FROM refs WHERE pid = ?", (pid,))
+        rows = db.execute(
+            "SELECT name, size FROM segments WHERE name != ? ORDER BY "
+            "EXISTS (SELECT 1 FROM refs WHERE refs.name = segments.name), "
+            "accessed",
+            (keep,),
+        )
+        for name, size in rows.fetchall():
+            if excess <= 0:
+                break
+            db.execute("DELETE FROM segments WHERE name = ?", (name,))
+            db.execute("DELETE FROM refs WHERE name = ?", (name,))
+            excess -= size
+            evicted.append(name)
+        return evicted
+
+    def clear(self):
+        """Unlink all segments of this namespace"""
+        names = self._transact(self._clear)
+        for name in names:
+            _unlink(name)
+
+    def _clear(self, db):
+        names = [row[0] for row in db.execute("SELECT name FROM segments")]
+        db.execute("DELETE FROM segments")
+        db.execute("DELETE FROM refs")
+        return names
+
+    def stats(self):
+        """Segment count, published size and hit counters of this process"""
+        entries, size = (
+            self._connect()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments")
+            .fetchone()
+        )
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
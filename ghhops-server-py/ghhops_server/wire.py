@@ -0,0 +1,153 @@
+"""Binary wire formats for clients other than Grasshopper
+
+Grasshopper posts and reads json where every value is itself a json
+string. Clients asking for application/msgpack or application/x-hops-frame
+get the same structure, but with branches of numbers and points packed
+into little-endian arrays and geometry data as raw bytes, see
+_GHParam.from_result. A frame is the magic, the length of a json header,
+the header and the blobs it references:
+
+    b"HOPSFRM1" | uint32 length | header | blobs
+
+Each bytes value is replaced in the header by {"$blob": [offset, length]}
+into the blobs. Frames need nothing beyond the standard library, msgpack
+needs the msgpack package.
+"""
+import json
+
+# optional encoder, used when installed
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FRAME = "application/x-hops-frame"
+
+FRAME_MAGIC = b"HOPSFRM1"
+
+_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def available_formats():
+    """Binary formats this server can read and write"""
+    formats = [FRAME]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    return formats
+
+
+def _media_type(value):
+    media_type = (value or "").partition(";")[0].strip().lower()
+    return _ALIASES.get(media_type, media_type)
+
+
+def request_format(content_type):
+    """Format of a request body sent with Content-Type
+
+    Anything but a binary format is read as json, as Grasshopper sends.
+    Raises ValueError for msgpack bodies when msgpack is not installed.
+    """
+    media_type = _media_type(content_type)
+    if media_type in available_formats():
+        return media_type
+    if media_type == MSGPACK:
+        raise ValueError("msgpack bodies need the msgpack package")
+    return JSON
+
+
+def response_format(accept, request_type=JSON):
+    """Format of a solve response, picked from Accept
+
+    The supported format with the highest quality wins, a binary format
+    over json on a tie. Without an Accept naming a format, responses use
+    the format of the request.
+    """
+    accepted = {}
+    for part in (accept or "").split(","):
+        media_type, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[_media_type(media_type)] = quality
+    best, best_quality = request_type, 0.0
+    for media_type in available_formats() + [JSON]:
+        quality = accepted.get(media_type, 0.0)
+        if quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+def _split(obj, blobs):
+    # obj with bytes values moved into blobs, as a json serializable tree
+    if isinstance(obj, dict):
+        return {key: _split(value, blobs) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_split(value, blobs) for value in obj]
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        offset = blobs[1]
+        blobs[0].append(obj)
+        blobs[1] += len(obj)
+        return {"$blob": [offset, len(obj)]}
+    return obj
+
+
+def dumps(obj, media_type):
+    """bytes of obj in a binary format"""
+    if media_type == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    blobs = [[], 0]
+    header = json.dumps(_split(obj, blobs), separators=(",", ":"))
+    header = header.encode("utf_8")
+    return b"".join(
+        [FRAME_MAGIC, len(header).to_bytes(4, "little"), header, *blobs[0]]
+    )
+
+
+def _frame_parts(data):
+    data = memoryview(data)
+    if bytes(data[: len(FRAME_MAGIC)]) != FRAME_MAGIC:
+        raise ValueError("Not a hops frame")
+    start = len(FRAME_MAGIC) + 4
+    length = int.from_bytes(data[len(FRAME_MAGIC) : start], "little")
+    if start + length > len(data):
+        raise ValueError("Truncated hops frame")
+    return data[start : start + length], data[start + length :]
+
+
+def loads(data, media_type):
+    """Object of a binary format body, bytes values come back as bytes or
+    zero-copy memoryviews of data"""
+    if media_type == MSGPACK:
+        return msgpack.unpackb(data, raw=False)
+    header, blobs = _frame_parts(data)
+
+    def blob(obj):
+        ref = obj.get("$blob")
+        if ref is not None and len(obj) == 1:
+            offset, length = ref
+            return blobs[offset : offset + length]
+        return obj
+
+    return json.loads(bytes(header), object_hook=blob)
+
+
+def pointer(data, media_type):
+    """pointer value of a binary format body, without decoding its inputs"""
+    if media_type == MSGPACK:
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(data)
+        for _ in range(unpacker.read_map_header()):
+            if unpacker.unpack() == "pointer":
+                return unpacker.unpack()
+            unpacker.skip()
+        raise KeyError("pointer")
+    header, _ = _frame_parts(data)
+    # the header is small, only the blobs hold the bulk of the inputs
+    return json.loads(bytes(header))["pointer"]
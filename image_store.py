@@ -0,0 +1,119 @@
+import base64
+import binascii
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+
+DEFAULT_STORE_DIR = os.environ.get('GREYMESH_STORE', 'imgs/store')
+DEFAULT_IMAGES_ROOT = os.environ.get('GREYMESH_IMAGES', 'imgs')  # 求解请求中的图片路径只能指向该目录下的文件
+
+
+def _is_digest(ref):
+    if len(ref) != 64:
+        return False
+    try:
+        int(ref, 16)
+    except ValueError:
+        return False
+    return True
+
+
+class ImageStore:
+    """
+    以内容哈希为键的本地灰度图存储
+    图片只在第一次上传时解码一次，解码结果以 <hash>.npy 保存，之后按哈希直接内存映射读取
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, images_root=DEFAULT_IMAGES_ROOT):
+        self.root = root
+        self.images_root = images_root
+        self._lock = threading.Lock()
+        # (路径, 修改时间, 大小) -> 哈希，避免每次求解都重新读取并哈希同一个文件
+        self._path_hashes = {}
+
+    def _npy_path(self, digest):
+        return os.path.join(self.root, f"{digest}.npy")
+
+    def has(self, digest):
+        return os.path.exists(self._npy_path(digest))
+
+    def put_bytes(self, data):
+        """
+        保存编码后的图片字节
+        :param data: png/jpg 等图片文件字节
+        :return: 图片内容的 sha256 哈希
+        """
+        if not data:
+            raise ValueError("上传的图片为空")
+        digest = hashlib.sha256(data).hexdigest()
+        if self.has(digest):
+            return digest
+        try:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        except cv2.error:
+            image = None
+        if image is None:
+            raise ValueError("无法解码上传的图片")
+        self._save(digest, image)
+        return digest
+
+    def put_file(self, path):
+        """保存本地图片文件，返回其内容哈希"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._path_hashes.get(key)
+        if digest and self.has(digest):
+            return digest
+        with open(path, 'rb') as image_file:
+            digest = self.put_bytes(image_file.read())
+        self._path_hashes[key] = digest
+        return digest
+
+    def _save(self, digest, image):
+        os.makedirs(self.root, exist_ok=True)
+        # 先写临时文件再改名，避免并发求解读到写了一半的文件
+        with self._lock:
+            tmp_path = self._npy_path(digest) + f".{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as npy_file:
+                np.save(npy_file, image)
+            os.replace(tmp_path, self._npy_path(digest))
+
+    def image_path(self, ref):
+        """
+        引用指向 images_root 下（解析符号链接后）的文件时返回其真实路径，否则返回 None
+        请求中的其他路径一律不读取，避免客户端借此读取服务器上的任意文件
+        """
+        if not self.images_root:
+            return None
+        root = os.path.realpath(self.images_root)
+        path = os.path.realpath(ref)
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        return path
+
+    def resolve(self, ref):
+        """
+        将图片引用解析为存储中的哈希
+        :param ref: 已上传图片的哈希、images_root 下的图片路径，或 base64 编码的图片字节（可带 data:image/...;base64, 前缀）
+        :return: (哈希, 解码后 .npy 文件路径)
+        """
+        ref = ref.strip()
+        path = None if _is_digest(ref) else self.image_path(ref)
+        if path is not None:
+            digest = self.put_file(path)
+        elif _is_digest(ref):
+            digest = ref.lower()
+            if not self.has(digest):
+                raise ValueError(f"存储中没有哈希为 {digest} 的图片，请重新上传")
+        else:
+            if ref.startswith('data:'):
+                ref = ref.partition(',')[2]
+            try:
+                data = base64.b64decode(ref, validate=True)
+            except (binascii.Error, ValueError):
+                raise ValueError(f"未知的图片引用: {ref[:64]}")
+            digest = self.put_bytes(data)
+        return digest, self._npy_path(digest)
@@ -1,24 +1,324 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
+import numpy as np
 import rhino3dm
 
-def get_mesh_by_grey_map(height_factor: float, step: int):
-    image = cv2.imread('imgs/img1.png', cv2.IMREAD_GRAYSCALE)
-    # resized_image = cv2.resize(image, (image.shape[1] * scale_factor, image.shape[0] * scale_factor), interpolation=cv2.INTER_CUBIC)
-    height, width = image.shape
-    mesh = rhino3dm.Mesh()
+DEFAULT_IMAGE = 'imgs/img1.png'
+DEFAULT_TILE_SIZE = 256  # 每个分块包含的网格单元数（按采样后的网格计）
+PARALLEL_MIN_VERTICES = 250000  # 采样网格顶点数超过该值时才启用多进程
+SMOOTH_FILTERS = ('none', 'gaussian', 'bilateral')
+BILATERAL_SIGMA_COLOR = 25.0  # 双边滤波的灰度差权重，灰度差明显大于该值的像素几乎不参与平滑（保留边缘）
+SHARED_MIN_VERTICES = 4096  # 窗口顶点数达到该值时三角面数组才放入共享内存，更小的窗口直接计算更快
+SHARED_MAX_BYTES = int(os.environ.get('GREYMESH_SHM_BYTES', 0))  # 共享内存中解码图片与网格缓冲区的总大小上限，0 表示不使用共享内存
+
+_pool = None
+_pool_workers = 0
+_shared_store = None
+
+
+def shared_store():
+    """
+    各 worker 进程共用的共享内存存储，第一个解码图片或构建缓冲区的进程发布结果，其余进程零拷贝映射只读数组
+    只有多个进程反复解码同一张非 .npy 图片时才有收益（见 benchmarks/bench_shared_store.py），
+    /greymesh 的图片都经图片存储转为内存映射的 .npy，因此默认不启用
+    :return: SharedArrayStore，SHARED_MAX_BYTES 为 0 时返回 None
+    """
+    global _shared_store
+    if _shared_store is None and SHARED_MAX_BYTES > 0:
+        # 只在启用时导入，直接 import utils 不需要把 ghhops-server-py 加入 sys.path
+        from ghhops_server.sharedmem import SharedArrayStore
+        _shared_store = SharedArrayStore('greymesh', SHARED_MAX_BYTES)
+    return _shared_store
+
+
+def _read_image(path):
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"无法读取灰度图: {path}")
+    return (image,)
+
+
+def open_heightmap(path):
+    """
+    打开灰度图
+    .npy 文件以只读内存映射方式打开，只有被访问到的窗口才会读入内存，各进程共用系统的页缓存
+    其余图片直接解码；启用共享内存时解码结果发布到共享内存，按 (路径, 修改时间, 大小) 查找，同一张图片在所有进程中只解码一次
+    :param path: 图片或 .npy 文件路径
+    :return: 二维灰度数组（.npy 与共享内存中的数组只读）
+    """
+    if path.lower().endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    store = shared_store()
+    if store is None:
+        return _read_image(path)[0]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise ValueError(f"无法读取灰度图: {path}")
+    key = ('heightmap', os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    return store.get_or_create(key, lambda: _read_image(path))[0]
+
+
+def grid_shape(image, step):
+    """按步长采样后的网格行列数"""
+    height, width = image.shape[:2]
+    return -(-height // step), -(-width // step)
+
+
+def smooth_heights(heights, smooth, radius):
+    """
+    对采样后的灰度值做预滤波，去除像素噪声带来的尖刺
+    :param heights: float32 二维数组
+    :param smooth: 'none'、'gaussian' 或 'bilateral'
+    :param radius: 滤波半径（网格单元数）
+    """
+    if not smooth or smooth == 'none' or radius <= 0:
+        return heights
+    size = 2 * radius + 1
+    if smooth == 'gaussian':
+        return cv2.GaussianBlur(heights, (size, size), 0)
+    if smooth == 'bilateral':
+        return cv2.bilateralFilter(heights, size, BILATERAL_SIGMA_COLOR, radius)
+    raise ValueError(f"未知的滤波方式: {smooth}，可选 {', '.join(SMOOTH_FILTERS)}")
+
+
+def grid_normals(heights, step):
+    """
+    由高度场梯度计算顶点法向量 n = (-dz/dx, -dz/dy, 1) / |n|
+    :param heights: (rows, cols) 高度数组
+    :param step: 网格间距
+    :return: (rows, cols, 3) 单位法向量数组
+    """
+    dz_dy, dz_dx = np.gradient(heights, step)
+    normals = np.empty(heights.shape + (3,), dtype=np.float64)
+    normals[..., 0] = -dz_dx
+    normals[..., 1] = -dz_dy
+    normals[..., 2] = 1.0
+    normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+    return normals
+
+
+def grid_window_buffers(image, height_factor, step, row0, row1, col0, col1,
+                        smooth=None, radius=0, normals=False):
+    """
+    计算采样网格中 [row0, row1] x [col0, col1]（闭区间）窗口的顶点与面
+    滤波和求梯度时会额外读取窗口四周的一圈网格，保证分块接缝两侧的结果与整图计算一致
+    :return: (N, 3) 顶点数组, (M, 3) 以窗口内局部序号表示的三角面数组, (N, 3) 法向量数组或 None
+    """
+    halo = (radius if smooth and smooth != 'none' else 0) + (1 if normals else 0)
+    grid_rows, grid_cols = grid_shape(image, step)
+    halo_row0, halo_col0 = max(row0 - halo, 0), max(col0 - halo, 0)
+    halo_row1, halo_col1 = min(row1 + halo, grid_rows - 1), min(col1 + halo, grid_cols - 1)
+    window = image[halo_row0 * step:halo_row1 * step + 1:step, halo_col0 * step:halo_col1 * step + 1:step]
+    # z为对应像素的灰度值 0-255之间，缩放用作高度
+    heights = smooth_heights(window.astype(np.float32), smooth, radius) * np.float64(height_factor)
+
+    rows, cols = row1 - row0 + 1, col1 - col0 + 1
+    crop = (slice(row0 - halo_row0, row0 - halo_row0 + rows), slice(col0 - halo_col0, col0 - halo_col0 + cols))
+    vertices = np.empty((rows, cols, 3), dtype=np.float64)
+    vertices[..., 0] = (np.arange(col0, col0 + cols) * step)[None, :]
+    vertices[..., 1] = (np.arange(row0, row0 + rows) * step)[:, None]
+    vertices[..., 2] = heights[crop]
+    vertex_normals = grid_normals(heights, step)[crop].reshape(-1, 3) if normals else None
+    return vertices.reshape(-1, 3), window_faces(rows, cols), vertex_normals
+
+
+def window_faces(rows, cols):
+    """
+    rows x cols 窗口以局部序号表示的三角面，只与窗口大小有关
+    启用共享内存时较大的窗口发布到共享内存，各进程、各次求解共用同一份只读数组
+    """
+    store = shared_store()
+    if store is None or rows * cols < SHARED_MIN_VERTICES:
+        return grid_faces(np.arange(rows * cols).reshape(rows, cols))
+    return store.get_or_create(
+        ('window_faces', rows, cols), lambda: (grid_faces(np.arange(rows * cols).reshape(rows, cols)),))[0]
+
+
+def grid_faces(index):
+    """
+    由二维顶点序号网格生成三角面，每个网格单元两个三角形
+    :param index: (rows, cols) 顶点序号数组
+    :return: (2 * (rows - 1) * (cols - 1), 3) 三角面数组
+    """
+    v0 = index[:-1, :-1].ravel()
+    v1 = index[:-1, 1:].ravel()
+    v2 = index[1:, :-1].ravel()
+    v3 = index[1:, 1:].ravel()
+    faces = np.empty((v0.size * 2, 3), dtype=np.int64)
+    faces[0::2, 0] = v0
+    faces[0::2, 1] = v1
+    faces[0::2, 2] = v3
+    faces[1::2, 0] = v0
+    faces[1::2, 1] = v3
+    faces[1::2, 2] = v2
+    return faces
 
-    for y in range(0, height, step):
-        for x in range(0, width, step):
-            z = image[y, x] *height_factor  # z为对应像素的灰度值 0-255之间，缩放用作高度
-            mesh.Vertices.Add(x, y, z)
-
-    for y in range(0, height - step, step):
-        for x in range(0, width - step, step):
-            v0 = (y // step) * (width // step) + (x // step)
-            v1 = v0 + 1
-            v2 = ((y + step) // step) * (width // step) + (x // step)
-            v3 = v2 + 1
-            
-            mesh.Faces.AddFace(v0, v1, v3)
-            mesh.Faces.AddFace(v0, v3, v2)
-    return mesh
\ No newline at end of file
+
+def add_buffers_to_mesh(mesh, vertices, faces, normals=None):
+    """将顶点、面（以及可选的顶点法向量）数组批量写入 rhino3dm.Mesh"""
+    add_vertex = mesh.Vertices.Add
+    for x, y, z in vertices.tolist():
+        add_vertex(x, y, z)
+    if normals is not None:
+        add_normal = mesh.Normals.Add
+        for x, y, z in normals.tolist():
+            add_normal(x, y, z)
+    add_face = mesh.Faces.AddFace
+    for a, b, c in faces.tolist():
+        add_face(a, b, c)
+    return mesh
+
+
+def iter_tiles(rows, cols, tile_size):
+    """
+    按行优先顺序遍历分块，相邻分块共享接缝处的一行/一列网格顶点
+    :return: (tile_row, tile_col, row0, row1, col0, col1) 闭区间
+    """
+    tile_size = max(int(tile_size), 1)
+    row_starts = range(0, max(rows - 1, 1), tile_size)
+    col_starts = range(0, max(cols - 1, 1), tile_size)
+    for ti, row0 in enumerate(row_starts):
+        row1 = min(row0 + tile_size, rows - 1)
+        for tj, col0 in enumerate(col_starts):
+            col1 = min(col0 + tile_size, cols - 1)
+            yield ti, tj, row0, row1, col0, col1
+
+
+def _get_pool(workers):
+    """复用进程池，避免每次求解都重新创建进程"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def _window_buffers(path, height_factor, step, row0, row1, col0, col1, stages):
+    """
+    在子进程中计算一个窗口的顶点、面与法向量数组
+    只返回 NumPy 数组（pickle 接近内存拷贝），rhino3dm 网格由主进程构建，避免 Encode/Decode 整个网格
+    """
+    image = open_heightmap(path)
+    return grid_window_buffers(image, height_factor, step, row0, row1, col0, col1, **stages)
+
+
+def iter_bands(rows, count):
+    """将采样网格按行均分为 count 个行带，相邻行带共享接缝行，返回 (row0, row1) 闭区间"""
+    count = max(min(count, rows - 1), 1)
+    edges = np.linspace(0, max(rows - 1, 0), count + 1).round().astype(int)
+    for row0, row1 in zip(edges[:-1], edges[1:]):
+        yield int(row0), int(row1)
+
+
+def stitch_bands(bands, cols):
+    """
+    按序号拼接行带缓冲区：后一个行带的第一行就是前一个行带的最后一行，丢弃这一行顶点，
+    面序号整体偏移后第一行正好指向前一个行带最后一行的顶点，不需要按坐标焊接
+    :param bands: [(顶点, 局部序号的面, 法向量或 None), ...]，按行顺序排列
+    :param cols: 采样网格列数
+    :return: 合并后的 (顶点, 面, 法向量或 None)
+    """
+    vertices, faces, normals = [], [], []
+    count = 0
+    for index, (band_vertices, band_faces, band_normals) in enumerate(bands):
+        shared = cols if index else 0
+        vertices.append(band_vertices[shared:])
+        faces.append(band_faces + (count - shared))
+        if band_normals is not None:
+            normals.append(band_normals[shared:])
+        count += len(band_vertices) - shared
+    return np.concatenate(vertices), np.concatenate(faces), np.concatenate(normals) if normals else None
+
+
+def get_mesh_by_grey_map_parallel(height_factor, step, tile_size, split, path, workers, stages):
+    """
+    多进程版本：每个子进程读取内存映射的灰度图，计算一个行带（或分块）的顶点、面与法向量数组
+    合并模式下主进程按序号拼接各行带的数组，只构建一次 rhino3dm 网格
+    """
+    image = open_heightmap(path)
+    rows, cols = grid_shape(image, step)
+    pool = _get_pool(workers)
+
+    if split:
+        tiles = list(iter_tiles(rows, cols, tile_size))
+        futures = [pool.submit(_window_buffers, path, height_factor, step, row0, row1, col0, col1, stages)
+                   for _, _, row0, row1, col0, col1 in tiles]
+        return {f"{{{ti};{tj}}}": [add_buffers_to_mesh(rhino3dm.Mesh(), *future.result())]
+                for (ti, tj, *_), future in zip(tiles, futures)}
+
+    futures = [pool.submit(_window_buffers, path, height_factor, step, row0, row1, 0, cols - 1, stages)
+               for row0, row1 in iter_bands(rows, workers)]
+    buffers = stitch_bands([future.result() for future in futures], cols)
+    return add_buffers_to_mesh(rhino3dm.Mesh(), *buffers)
+
+
+def get_mesh_by_grey_map(height_factor: float, step: int, tile_size: int = DEFAULT_TILE_SIZE,
+                         split: bool = False, path: str = DEFAULT_IMAGE, workers: int = None,
+                         smooth: str = 'none', radius: int = 2, normals: bool = True):
+    """
+    根据灰度图生成网格，逐块读取灰度图并计算顶点与面
+    分块只限制 NumPy 中间数组（高度、顶点、面、法向量）的大小，它们每次只覆盖一个分块；
+    输出的 rhino3dm 网格（合并模式下的整张网格，或 split=True 时所有分块网格组成的树）仍然随网格总大小增长。
+    .npy 图片以内存映射方式按窗口读取，png/jpg 等图片会先用 cv2 完整解码
+    :param height_factor: 高度缩放系数
+    :param step: 像素采样步长
+    :param tile_size: 分块大小（网格单元数），0 表示不分块
+    :param split: True 时返回每个分块单独的网格，以 {行;列} 为路径的树
+    :param path: 灰度图路径，.npy 文件会以内存映射方式读取
+    :param workers: 并行进程数，默认为 CPU 核数，网格较小时始终单进程构建
+    :param smooth: 高度预滤波方式 'none'、'gaussian' 或 'bilateral'
+    :param radius: 预滤波半径（网格单元数）
+    :param normals: 是否由高度场梯度计算顶点法向量并写入网格
+    :return: 合并后的网格，或 {"{i;j}": [Mesh]} 形式的分块网格树
+    """
+    step = max(int(step), 1)
+    image = open_heightmap(path)
+    rows, cols = grid_shape(image, step)
+    if tile_size <= 0:
+        tile_size = max(rows, cols)
+    if smooth not in SMOOTH_FILTERS:
+        raise ValueError(f"未知的滤波方式: {smooth}，可选 {', '.join(SMOOTH_FILTERS)}")
+    stages = dict(smooth=smooth, radius=max(int(radius), 0), normals=normals)
+
+    workers = (os.cpu_count() or 1) if workers is None else int(workers)
+    if workers > 1 and rows * cols >= PARALLEL_MIN_VERTICES:
+        return get_mesh_by_grey_map_parallel(height_factor, step, tile_size, split, path, workers, stages)
+
+    if split:
+        tree = {}
+        for ti, tj, row0, row1, col0, col1 in iter_tiles(rows, cols, tile_size):
+            buffers = grid_window_buffers(image, height_factor, step, row0, row1, col0, col1, **stages)
+            tree[f"{{{ti};{tj}}}"] = [add_buffers_to_mesh(rhino3dm.Mesh(), *buffers)]
+        return tree
+
+    # 合并模式：接缝处的顶点只添加一次，后续分块通过序号复用
+    mesh = rhino3dm.Mesh()
+    top_seam = np.empty(cols, dtype=np.int64)  # 上一行分块最下方一行顶点的全局序号
+    next_top_seam = np.empty(cols, dtype=np.int64)
+    left_seam = None  # 左侧分块最右侧一列顶点的全局序号
+    vertex_count = 0
+    for ti, tj, row0, row1, col0, col1 in iter_tiles(rows, cols, tile_size):
+        vertices, local_faces, vertex_normals = grid_window_buffers(
+            image, height_factor, step, row0, row1, col0, col1, **stages)
+        tile_rows, tile_cols = row1 - row0 + 1, col1 - col0 + 1
+        index = np.full((tile_rows, tile_cols), -1, dtype=np.int64)
+        if ti > 0:
+            index[0] = top_seam[col0:col1 + 1]
+        if tj > 0:
+            index[:, 0] = left_seam
+        new = (index < 0).ravel()
+        count = int(new.sum())
+        index.ravel()[new] = np.arange(vertex_count, vertex_count + count)
+        vertex_count += count
+        add_buffers_to_mesh(mesh, vertices[new], index.ravel()[local_faces],
+                            None if vertex_normals is None else vertex_normals[new])
+        left_seam = index[:, -1].copy()
+        next_top_seam[col0:col1 + 1] = index[-1]
+        if col1 == cols - 1:
+            top_seam, next_top_seam = next_top_seam, top_seam
+    return mesh